@@ -3,6 +3,21 @@ ASGI config for healthcarePatientInformationSystem project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+This is the deployed entry point: the Procfile runs it under gunicorn with
+uvicorn workers. Live dashboard updates need it: /events/ holds one
+server-sent event stream per open dashboard on the event loop
+(main/changefeed.py), and CSV exports stream without being read into memory
+first (inventory_meds/exports.py). Under WSGI (hpis/wsgi.py, e.g. runserver)
+the events endpoint degrades to short polling.
+
+The super admin, analytics and inventory reports dashboards are async views
+that run their independent queries concurrently (main/concurrency.py); under
+ASGI they wait on the event loop rather than tying up a worker thread while
+their queries run. That holds only while every middleware in MIDDLEWARE can
+run async: Django runs everything inside a sync-only one on a thread. The
+project's own middleware (main/middleware.py, which also wraps WhiteNoise)
+all can.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
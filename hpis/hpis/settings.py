@@ -33,16 +33,18 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middleware.RequestMetricsMiddleware',  # First: request latency covers all other middleware
     'django.middleware.security.SecurityMiddleware',
+    'main.middleware.QueryInstrumentationMiddleware',  # Outermost after security: counts every query
+    'main.middleware.CacheInvalidationMiddleware',  # Before anything that reads the cache
     'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.cache.UpdateCacheMiddleware',  # Cache middleware (must be first)
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.cache.FetchFromCacheMiddleware',  # Cache middleware (must be last)
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'main.middleware.PrincipalMiddleware',  # request.principal: role from the session, no query
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'main.middleware.StaticFilesMiddleware',  # WhiteNoise with an async path
 ]
 
 ROOT_URLCONF = 'hpis.urls'
@@ -134,8 +136,37 @@ LOGGING = {
         'handlers': ['console'],
         'level': 'INFO',
     },
+    'loggers': {
+        # Per-request SQL summaries; set SQL_LOG_LEVEL=DEBUG to log every request
+        'hpis.sql': {
+            'level': os.getenv('SQL_LOG_LEVEL', 'WARNING'),
+        },
+    },
 }
 
+# ================================================
+# SQL Instrumentation
+# ================================================
+# See main/instrumentation.py. Query budgets declared with @query_budget warn
+# unless QUERY_BUDGET_STRICT is on; hpis.test_runner turns it on for
+# `manage.py test` when the environment does not set it either way.
+SQL_INSTRUMENTATION_HEADERS = os.getenv('SQL_INSTRUMENTATION_HEADERS', str(DEBUG)).lower() == 'true'
+SQL_SLOW_REQUEST_MS = int(os.getenv('SQL_SLOW_REQUEST_MS', 500))
+SQL_REPEATED_QUERY_THRESHOLD = int(os.getenv('SQL_REPEATED_QUERY_THRESHOLD', 5))
+if os.getenv('QUERY_BUDGET_STRICT'):
+    QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT').lower() == 'true'
+TEST_RUNNER = 'hpis.test_runner.TestRunner'
+
+# ================================================
+# Metrics
+# ================================================
+# /metrics serves Prometheus text format to `Authorization: Bearer
+# METRICS_TOKEN` (or a signed-in admin). Set METRICS_DIR to a directory shared
+# by the gunicorn workers so the scrape aggregates all of them.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = int(os.getenv('METRICS_FLUSH_SECONDS', 5))
+
 # ================================================
 # FIX for Authentication Redirects (404 Error) 
 # ================================================
@@ -145,28 +176,138 @@ LOGGING = {
 # defined in your main/urls.py).
 LOGIN_URL = 'user_login'
 
+# Session logins load the user, profile and notification preferences in one
+# query. ModelBackend stays listed so sessions created before the switch stay
+# signed in; they move to PrincipalBackend at their next login.
+AUTHENTICATION_BACKENDS = [
+    'main.principal.PrincipalBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Reverse proxies in front of the app that append the client address to
+# X-Forwarded-For (Render's load balancer is one). Client IPs for throttling
+# and access logs are read that many entries from the right; 0 uses
+# REMOTE_ADDR. Too high a value lets clients spoof their address.
+TRUSTED_PROXY_COUNT = int(os.getenv('TRUSTED_PROXY_COUNT', 1))
+
+# Login throttling (main/throttle.py): failed attempts allowed per username
+# and per client IP within a sliding LOGIN_THROTTLE_WINDOW seconds, halved
+# while the load average per CPU is above LOGIN_THROTTLE_LOAD_FACTOR.
+LOGIN_THROTTLE_WINDOW = int(os.getenv('LOGIN_THROTTLE_WINDOW', 300))
+LOGIN_THROTTLE_USERNAME_LIMIT = int(os.getenv('LOGIN_THROTTLE_USERNAME_LIMIT', 5))
+LOGIN_THROTTLE_IP_LIMIT = int(os.getenv('LOGIN_THROTTLE_IP_LIMIT', 20))
+LOGIN_THROTTLE_LOAD_FACTOR = float(os.getenv('LOGIN_THROTTLE_LOAD_FACTOR', 1.5))
+
+# Public appointment intake (main/intake.py): requests per client IP per
+# window, and how long a submission is remembered for deduplication.
+INTAKE_THROTTLE_WINDOW = int(os.getenv('INTAKE_THROTTLE_WINDOW', 600))
+INTAKE_THROTTLE_LIMIT = int(os.getenv('INTAKE_THROTTLE_LIMIT', 10))
+INTAKE_DEDUPE_SECONDS = int(os.getenv('INTAKE_DEDUPE_SECONDS', 86400))
+
+# Appointment scheduler (main/scheduling.py): how many days past the
+# preferred date to look for a free slot, and which doctor departments may
+# take each appointment type (types left out may go to any doctor), e.g.
+# {'emergency': ['Emergency Medicine'], 'checkup': ['General Medicine']}.
+SCHEDULER_HORIZON_DAYS = int(os.getenv('SCHEDULER_HORIZON_DAYS', 14))
+APPOINTMENT_TYPE_DEPARTMENTS = {}
+
+# Live dashboard updates (main/changefeed.py): how often each ASGI worker
+# reads the change feed, how long events are kept for reconnecting clients,
+# how long one stream stays open, the keepalive interval, and how soon the
+# browser reconnects (the polling interval when served over WSGI).
+CHANGE_FEED_POLL_SECONDS = float(os.getenv('CHANGE_FEED_POLL_SECONDS', 1.0))
+CHANGE_FEED_RETENTION_SECONDS = int(os.getenv('CHANGE_FEED_RETENTION_SECONDS', 3600))
+CHANGE_FEED_STREAM_SECONDS = int(os.getenv('CHANGE_FEED_STREAM_SECONDS', 300))
+CHANGE_FEED_HEARTBEAT_SECONDS = int(os.getenv('CHANGE_FEED_HEARTBEAT_SECONDS', 15))
+CHANGE_FEED_RECONNECT_MS = int(os.getenv('CHANGE_FEED_RECONNECT_MS', 5000))
+
+# Async dashboards (main/concurrency.py): threads, each with its own database
+# connection, that run a dashboard's independent queries concurrently. Keep
+# workers x DASHBOARD_QUERY_WORKERS within the database pooler's limit.
+DASHBOARD_QUERY_WORKERS = int(os.getenv('DASHBOARD_QUERY_WORKERS', 4))
+
+# Email. Requests only write to the outbox; `manage.py send_outbox` sends it
+# (main/outbox.py), run as the Procfile's worker process. Locally, set EMAIL_BACKEND to
+# django.core.mail.backends.filebased.EmailBackend (with EMAIL_FILE_PATH) or
+# .console.EmailBackend to see messages without an SMTP server.
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'false').lower() == 'true'
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', 30))
+EMAIL_FILE_PATH = os.getenv('EMAIL_FILE_PATH', str(BASE_DIR / 'sent_emails'))
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'HPIS <no-reply@hpis.local>')
+
+# Outbox worker: emails claimed per batch (sent over one connection), how
+# many attempts before an email is marked failed, and the first retry delay,
+# doubled after each failed attempt.
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', 50))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', 6))
+EMAIL_OUTBOX_BACKOFF_SECONDS = int(os.getenv('EMAIL_OUTBOX_BACKOFF_SECONDS', 60))
+
 # This tells Django where to redirect after a successful login (optional, but clean).
 LOGIN_REDIRECT_URL = 'homepage'
 
 # ================================================
 # Cache Configuration
 # ================================================
+# Two tiers (main/cache.py): a per-process LocMem L1 in front of an L2 shared
+# by all workers, Redis when REDIS_URL is set and a local directory otherwise.
+# Model changes clear every worker's L1 through main/invalidation.py.
+#
+# The directory fallback is for a single host without Redis. It is only shared
+# by workers on the same machine (or a shared volume); every L2 read opens and
+# unpickles a file; each write lists the directory to enforce MAX_ENTRIES and
+# culls a third of it once full; and incr() is read-modify-write, so the
+# login throttle counters can drop increments under concurrent requests.
+# Set REDIS_URL for anything with more than one host or sustained traffic.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'main.cache.TieredCache',
         'LOCATION': 'hpis-cache',
         'TIMEOUT': 300,  # 5 minutes default timeout
         'OPTIONS': {
-            'MAX_ENTRIES': 1000
+            'L2': 'shared',
+            'L1_TIMEOUT': 30,
+            'L1_MAX_ENTRIES': 1000,
+            # Shared state every worker must see at once: sessions and the
+            # throttle counters (main/throttle.py keeps its own blocks)
+            'L1_EXCLUDE_PREFIXES': ('django.contrib.sessions.', 'throttle:'),
         }
-    }
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+        'TIMEOUT': 300,
+    } if os.getenv('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_DIR', BASE_DIR / 'cache'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000
+        }
+    },
 }
+CACHE_INVALIDATION_POLL_SECONDS = float(os.getenv('CACHE_INVALIDATION_POLL_SECONDS', 1))
 
-# Cache time for pages
+# Whole-page caching is limited to the public pages (cache_page in
+# main/views.py); dashboards cache their widgets per user/role instead
+# (main/fragments.py), keyed by the invalidation bus versions.
 CACHE_MIDDLEWARE_ALIAS = 'default'
-CACHE_MIDDLEWARE_SECONDS = 60  # Cache pages for 60 seconds
+CACHE_MIDDLEWARE_SECONDS = 60  # Cache public pages for 60 seconds
 CACHE_MIDDLEWARE_KEY_PREFIX = 'hpis'
+FRAGMENT_CACHE_SECONDS = int(os.getenv('FRAGMENT_CACHE_SECONDS', 300))
 
 # Session optimization
-SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_ENGINE = 'main.sessions'  # cached_db + operation metrics
 SESSION_CACHE_ALIAS = 'default'
+
+# ================================================
+# Audit Log Archival
+# ================================================
+# `manage.py archive_audit_logs` moves medicine audit rows older than
+# AUDIT_RETENTION_DAYS into gzip NDJSON day files under AUDIT_ARCHIVE_DIR.
+AUDIT_ARCHIVE_DIR = Path(os.getenv('AUDIT_ARCHIVE_DIR', BASE_DIR / 'archive' / 'audit'))
+AUDIT_RETENTION_DAYS = int(os.getenv('AUDIT_RETENTION_DAYS', 365))
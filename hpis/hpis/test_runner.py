@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """
+    DiscoverRunner that makes @query_budget overruns fail the test instead of
+    logging a warning, unless QUERY_BUDGET_STRICT is already set either way.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._configured_strict = getattr(settings, 'QUERY_BUDGET_STRICT', None)
+        if self._configured_strict is None:
+            settings.QUERY_BUDGET_STRICT = True
+
+    def teardown_test_environment(self, **kwargs):
+        if self._configured_strict is None:
+            del settings.QUERY_BUDGET_STRICT
+        super().teardown_test_environment(**kwargs)
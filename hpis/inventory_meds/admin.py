@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Supplier, Medicine, StockMovement, DispenseRecord, MedicineAuditLog
+from .models import (
+    Supplier, MedicineProduct, Medicine, StockMovement, StockForecast, InventorySnapshot, DispenseRecord,
+    MedicineAuditLog, PurchaseOrder, PurchaseOrderLine, GoodsReceipt, GoodsReceiptLine,
+)
 
 
 @admin.register(Supplier)
@@ -9,6 +12,25 @@ class SupplierAdmin(admin.ModelAdmin):
     list_filter = ['created_at']
 
 
+class MedicineBatchInline(admin.TabularInline):
+    model = Medicine
+    fields = ['code', 'batch_number', 'expires_on', 'quantity_on_hand', 'status']
+    readonly_fields = fields
+    ordering = ['expires_on']
+    extra = 0
+    can_delete = False
+    show_change_link = True
+
+
+@admin.register(MedicineProduct)
+class MedicineProductAdmin(admin.ModelAdmin):
+    list_display = ['name', 'dosage_form', 'strength', 'category', 'quantity_on_hand', 'batch_count']
+    search_fields = ['name', 'category']
+    list_filter = ['category', 'dosage_form', 'prescription_only']
+    readonly_fields = ['quantity_on_hand', 'batch_count', 'created_at', 'updated_at']
+    inlines = [MedicineBatchInline]
+
+
 @admin.register(Medicine)
 class MedicineAdmin(admin.ModelAdmin):
     list_display = ['code', 'name', 'brand_name', 'category', 'dosage_form', 
@@ -16,13 +38,14 @@ class MedicineAdmin(admin.ModelAdmin):
     search_fields = ['code', 'name', 'brand_name', 'category', 'batch_number', 'manufacturer']
     list_filter = ['status', 'category', 'dosage_form', 'prescription_only', 'created_at']
     readonly_fields = ['created_at', 'updated_at']
+    raw_id_fields = ['product']
     fieldsets = (
         ('Basic Information', {
             'fields': ('code', 'name', 'brand_name', 'description', 'category', 
                       'dosage_form', 'strength', 'unit')
         }),
         ('Manufacturer & Batch', {
-            'fields': ('manufacturer', 'batch_number', 'lot_number', 'supplier')
+            'fields': ('product', 'manufacturer', 'batch_number', 'lot_number', 'supplier')
         }),
         ('Dates', {
             'fields': ('date_received', 'expires_on')
@@ -48,6 +71,23 @@ class StockMovementAdmin(admin.ModelAdmin):
     raw_id_fields = ['medicine', 'performed_by']
 
 
+@admin.register(StockForecast)
+class StockForecastAdmin(admin.ModelAdmin):
+    list_display = ['product', 'quantity_on_hand', 'avg_daily_usage', 'days_until_stockout',
+                   'predicted_stockout_on', 'suggested_order_quantity', 'computed_at']
+    search_fields = ['product__name']
+    list_filter = ['computed_at']
+    raw_id_fields = ['product']
+
+
+@admin.register(InventorySnapshot)
+class InventorySnapshotAdmin(admin.ModelAdmin):
+    list_display = ['date', 'total_medicines', 'total_quantity', 'low_stock_count',
+                   'out_of_stock_count', 'expired_count', 'expiring_soon_count']
+    date_hierarchy = 'date'
+    readonly_fields = ['created_at', 'updated_at']
+
+
 @admin.register(DispenseRecord)
 class DispenseRecordAdmin(admin.ModelAdmin):
     list_display = ['medicine', 'patient', 'quantity', 'dispensed_by', 'dispensed_at']
@@ -57,9 +97,51 @@ class DispenseRecordAdmin(admin.ModelAdmin):
     raw_id_fields = ['medicine', 'patient', 'prescribed_by', 'dispensed_by', 'visit_log']
 
 
+class PurchaseOrderLineInline(admin.TabularInline):
+    model = PurchaseOrderLine
+    fields = ['product', 'quantity_ordered', 'quantity_received']
+    readonly_fields = ['quantity_received']
+    raw_id_fields = ['product']
+    extra = 0
+
+
+@admin.register(PurchaseOrder)
+class PurchaseOrderAdmin(admin.ModelAdmin):
+    list_display = ['reference', 'supplier', 'status', 'expected_on', 'created_by', 'created_at']
+    search_fields = ['reference', 'supplier__name']
+    list_filter = ['status', 'created_at']
+    readonly_fields = ['created_at', 'updated_at']
+    raw_id_fields = ['created_by']
+    inlines = [PurchaseOrderLineInline]
+
+
+class GoodsReceiptLineInline(admin.TabularInline):
+    model = GoodsReceiptLine
+    fields = ['medicine', 'order_line', 'quantity', 'created_batch']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(GoodsReceipt)
+class GoodsReceiptAdmin(admin.ModelAdmin):
+    # Receipts are posted to stock when created; editing them would not move stock
+    list_display = ['id', 'supplier', 'purchase_order', 'reference', 'received_by', 'received_at']
+    search_fields = ['reference', 'supplier__name', 'purchase_order__reference']
+    list_filter = ['received_at']
+    readonly_fields = ['supplier', 'purchase_order', 'reference', 'received_by', 'received_at']
+    inlines = [GoodsReceiptLineInline]
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(MedicineAuditLog)
 class MedicineAuditLogAdmin(admin.ModelAdmin):
-    list_display = ['action', 'medicine', 'user', 'timestamp', 'field_name']
+    list_display = ['action', 'medicine', 'user', 'timestamp', 'changed_fields']
     search_fields = ['medicine__name', 'user__user__username', 'reason']
     list_filter = ['action', 'timestamp']
     readonly_fields = ['timestamp']
@@ -0,0 +1,90 @@
+"""First-expiry-first-out (FEFO) allocation of product stock across batches."""
+from dataclasses import dataclass
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from main import changefeed
+
+from . import search
+from .models import Medicine, MedicineProduct
+
+
+class InsufficientStock(Exception):
+    """Raised when the dispensable batches of a product cannot cover a request"""
+
+    def __init__(self, product, requested, available):
+        self.product = product
+        self.requested = requested
+        self.available = available
+        super().__init__(
+            f"Insufficient stock for medicine: {product}. "
+            f"Requested: {requested}, Available: {available}"
+        )
+
+
+@dataclass
+class BatchAllocation:
+    batch: Medicine
+    quantity: int
+    stock_before: int
+    stock_after: int
+
+
+def dispensable_batches(product):
+    """Batches of a product that may be dispensed, earliest expiry first"""
+    today = timezone.now().date()
+    return (
+        Medicine.objects
+        .filter(product=product, status=Medicine.STATUS_ACTIVE, quantity_on_hand__gt=0)
+        .filter(Q(expires_on__gt=today) | Q(expires_on__isnull=True))
+        .order_by(F('expires_on').asc(nulls_last=True), 'id')
+    )
+
+
+def allocate_fefo(product, quantity):
+    """
+    Take `quantity` units of `product` from its batches, earliest expiry first.
+
+    All candidate batches are read and locked in a single SELECT ... FOR UPDATE,
+    decremented with one bulk UPDATE, and the product running total is adjusted
+    with one F() update. Must be called inside a transaction.
+    """
+    if quantity <= 0:
+        raise ValueError("Quantity must be a positive integer.")
+
+    batches = list(dispensable_batches(product).select_for_update())
+
+    available = sum(batch.available_quantity for batch in batches)
+    if quantity > available:
+        raise InsufficientStock(product, quantity, available)
+
+    now = timezone.now()
+    remaining = quantity
+    allocations = []
+    for batch in batches:
+        if remaining == 0:
+            break
+        take = min(batch.available_quantity, remaining)
+        if take == 0:
+            continue
+        before = batch.quantity_on_hand
+        batch.quantity_on_hand = before - take
+        if batch.quantity_on_hand == 0:
+            batch.status = Medicine.STATUS_OUT_OF_STOCK
+        batch.updated_at = now
+        allocations.append(BatchAllocation(batch, take, before, batch.quantity_on_hand))
+        remaining -= take
+
+    Medicine.objects.bulk_update(
+        [a.batch for a in allocations], ['quantity_on_hand', 'status', 'updated_at']
+    )
+    MedicineProduct.apply_delta(product.pk, -quantity)
+    # bulk_update skips the post_save signals that normally invalidate cached
+    # autocomplete results and widgets and push low stock to the dashboards
+    search.bump_version()
+    for a in allocations:
+        if changefeed.crossed_reorder_level(a.stock_before, a.stock_after, a.batch.reorder_level):
+            changefeed.stock_low(a.batch)
+    return allocations
+
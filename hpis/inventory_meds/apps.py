@@ -5,3 +5,6 @@ class InventoryMedsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "inventory_meds"
     verbose_name = "Medicine Inventory Management"
+
+    def ready(self):
+        import inventory_meds.signals
@@ -0,0 +1,168 @@
+"""
+Cold storage for MedicineAuditLog.
+
+Rows older than the retention window are moved out of the database into
+gzip-compressed NDJSON files, one per day:
+
+    <AUDIT_ARCHIVE_DIR>/2025/03/medicine-audit-2025-03-14.ndjson.gz
+
+Each line is a self-contained JSON record (names and codes are copied in, so
+it stays readable after the medicine or patient is gone). Files can be read
+with `zcat | grep` / `jq`, or with `search_archive` and
+`manage.py search_audit_archive`.
+"""
+import gzip
+import json
+import os
+from datetime import date
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import MedicineAuditLog
+
+ARCHIVE_BATCH_SIZE = 5000
+FILE_PREFIX = 'medicine-audit-'
+
+
+def archive_root(root=None):
+    return Path(root or settings.AUDIT_ARCHIVE_DIR)
+
+
+def partition_path(root, day):
+    return Path(root) / f'{day:%Y}' / f'{day:%m}' / f'{FILE_PREFIX}{day.isoformat()}.ndjson.gz'
+
+
+def archive_record(log):
+    """Flatten an audit row (with its relations selected) into a JSON-safe dict"""
+    return {
+        'id': log.id,
+        'timestamp': log.timestamp,
+        'action': log.action,
+        'medicine_id': log.medicine_id,
+        'medicine_code': log.medicine.code if log.medicine else '',
+        'medicine_name': log.medicine.name if log.medicine else '',
+        'user_id': log.user_id,
+        'username': log.user.user.username if log.user else '',
+        'field_name': log.field_name,
+        'old_value': log.old_value,
+        'new_value': log.new_value,
+        'changes': log.changes,
+        'reason': log.reason,
+        'patient_id': log.patient_id,
+        'patient_code': log.patient.patient_code if log.patient else '',
+        'ip_address': log.ip_address,
+    }
+
+
+def _append(path, records):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Appending adds a new gzip member; readers treat the file as one stream
+    with gzip.open(path, 'at', encoding='utf-8') as handle:
+        for record in records:
+            handle.write(json.dumps(record, cls=DjangoJSONEncoder, separators=(',', ':'), ensure_ascii=False))
+            handle.write('\n')
+        handle.flush()
+        os.fsync(handle.fileno())
+
+
+def archive_before(cutoff, root=None, batch_size=ARCHIVE_BATCH_SIZE, dry_run=False):
+    """
+    Move audit rows with timestamp < `cutoff` into daily archive files.
+
+    Works in (timestamp, id) keyset batches: each batch is written and synced
+    to disk before its rows are deleted, so an interruption can at worst leave
+    a row both archived and still in the table (search_archive skips repeated
+    ids). Returns {date: rows archived}.
+    """
+    root = archive_root(root)
+    counts = {}
+    position = None
+    queryset = (
+        MedicineAuditLog.objects
+        .filter(timestamp__lt=cutoff)
+        .select_related('medicine', 'user__user', 'patient')
+        .order_by('timestamp', 'id')
+    )
+
+    while True:
+        batch = queryset
+        if position:
+            batch = batch.filter(
+                Q(timestamp__gt=position[0]) | Q(timestamp=position[0], id__gt=position[1])
+            )
+        logs = list(batch[:batch_size])
+        if not logs:
+            break
+        position = (logs[-1].timestamp, logs[-1].id)
+
+        by_day = {}
+        for log in logs:
+            by_day.setdefault(timezone.localdate(log.timestamp), []).append(archive_record(log))
+        for day, records in by_day.items():
+            counts[day] = counts.get(day, 0) + len(records)
+            if not dry_run:
+                _append(partition_path(root, day), records)
+
+        if not dry_run:
+            with transaction.atomic():
+                MedicineAuditLog.objects.filter(id__in=[log.id for log in logs]).delete()
+    return counts
+
+
+def record_text(value):
+    """Every value of a decoded record (nested in `changes` too), lowercased, one per line"""
+    if isinstance(value, dict):
+        return '\n'.join(record_text(item) for item in value.values())
+    if isinstance(value, list):
+        return '\n'.join(record_text(item) for item in value)
+    return '' if value is None else str(value).lower()
+
+
+def archive_files(root=None, start=None, end=None):
+    """Archive files for days between `start` and `end` inclusive, oldest first"""
+    root = archive_root(root)
+    for path in sorted(root.glob(f'*/*/{FILE_PREFIX}*.ndjson.gz')):
+        day = date.fromisoformat(path.name[len(FILE_PREFIX):-len('.ndjson.gz')])
+        if (start and day < start) or (end and day > end):
+            continue
+        yield path
+
+
+def search_archive(root=None, start=None, end=None, action=None, medicine=None, user=None,
+                   patient=None, text=None):
+    """
+    Yield archived records matching every given filter, oldest first.
+
+    `medicine` matches the id, code or name; `user` the id or username;
+    `patient` the id or patient code; `text` is a case-insensitive substring
+    of any value in the record. Values are matched after decoding, so text
+    JSON escapes on disk (quotes, or non-ASCII in files written before
+    ensure_ascii=False) is still found.
+    """
+    text = text.lower() if text else None
+    seen = set()
+    for path in archive_files(root, start, end):
+        with gzip.open(path, 'rt', encoding='utf-8') as handle:
+            for line in handle:
+                record = json.loads(line)
+                if record['id'] in seen:
+                    continue
+                if text and text not in record_text(record):
+                    continue
+                if action and record['action'] != action:
+                    continue
+                if medicine and str(medicine) not in (
+                    str(record['medicine_id']), record['medicine_code'], record['medicine_name']
+                ):
+                    continue
+                if user and str(user) not in (str(record['user_id']), record['username']):
+                    continue
+                if patient and str(patient) not in (str(record['patient_id']), record['patient_code']):
+                    continue
+                seen.add(record['id'])
+                yield record
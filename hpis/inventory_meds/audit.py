@@ -0,0 +1,179 @@
+"""
+Medicine audit trail.
+
+AuditRecorder collects the entries produced while handling a request and
+writes them with a single bulk_create. An edit is stored as one row whose
+`changes` column holds a JSON diff ({field: [old, new]}) rather than one row
+per changed field; `field_history` reads a field's changes back.
+"""
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+
+from main.throttle import client_ip
+
+from .models import MedicineAuditLog
+
+AUDIT_INDEX = 'inventory_meds_medicineauditlog_changes_gin'
+
+
+def get_client_ip(request):
+    """Get client IP address from request"""
+    return client_ip(request)
+
+
+def field_value(instance, name):
+    """Value of model field `name` as forms see it (FKs as their pk)"""
+    return instance._meta.get_field(name).value_from_object(instance)
+
+
+def diff_values(old_values, instance):
+    """{field: [old, new]} for every field in `old_values` whose value changed on `instance`"""
+    changes = {}
+    for name, old in old_values.items():
+        new = field_value(instance, name)
+        if old != new:
+            changes[name] = [old, new]
+    return changes
+
+
+class AuditRecorder:
+    """
+    Buffers MedicineAuditLog entries and writes them in one INSERT.
+
+        with AuditRecorder(request.user.profile, request) as audit:
+            audit.record_changes(medicine, old_values)
+            audit.add(other, MedicineAuditLog.ACTION_ARCHIVE)
+
+    Entries are flushed when the block exits cleanly and dropped if it raises.
+    """
+
+    def __init__(self, user=None, request=None):
+        self.user = user
+        self.ip_address = get_client_ip(request) if request else None
+        self.entries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.entries = []
+        return False
+
+    def add(self, medicine, action, changes=None, field_name='', old_value='', new_value='',
+            reason='', patient=None):
+        """Queue one entry; a single field change may be given as field_name/old/new"""
+        changes = dict(changes or {})
+        if field_name and field_name not in changes:
+            changes[field_name] = [old_value, new_value]
+        if not field_name and len(changes) == 1:
+            field_name, (old_value, new_value) = next(iter(changes.items()))
+
+        entry = MedicineAuditLog(
+            medicine=medicine,
+            action=action,
+            user=self.user,
+            field_name=field_name,
+            old_value='' if old_value is None else str(old_value),
+            new_value='' if new_value is None else str(new_value),
+            changes=changes,
+            reason=reason,
+            patient=patient,
+            ip_address=self.ip_address,
+        )
+        self.entries.append(entry)
+        return entry
+
+    def record_changes(self, medicine, old_values, action=MedicineAuditLog.ACTION_UPDATE, reason=''):
+        """Queue one diff entry for the fields of `old_values` that changed; None if nothing did"""
+        changes = diff_values(old_values, medicine)
+        if not changes:
+            return None
+        return self.add(medicine, action, changes=changes, reason=reason)
+
+    def flush(self):
+        entries, self.entries = self.entries, []
+        if entries:
+            MedicineAuditLog.objects.bulk_create(entries)
+        return entries
+
+
+def field_history(medicine, field_name, limit=None):
+    """
+    Changes to one field of a medicine, newest first, as (log, old, new) tuples.
+    `limit` caps how many of the most recent changes are returned.
+
+    Served by the (medicine, timestamp) index; on PostgreSQL the `changes`
+    GIN index also answers the key lookup across all medicines.
+    """
+    logs = (
+        MedicineAuditLog.objects
+        .filter(medicine=medicine, changes__has_key=field_name)
+        .select_related('user__user')
+        .order_by('-timestamp', '-id')
+    )
+    if limit is not None:
+        logs = logs[:limit]
+    return [(log, *log.changes[field_name]) for log in logs]
+
+
+def encode_cursor(log):
+    """Keyset cursor for an audit row: '<timestamp iso>_<id>'"""
+    return f'{log.timestamp.isoformat()}_{log.id}'
+
+
+def decode_cursor(value):
+    """(timestamp, id) from encode_cursor output, or None if malformed"""
+    try:
+        timestamp, _, pk = (value or '').rpartition('_')
+        timestamp = datetime.fromisoformat(timestamp)
+        if timezone.is_naive(timestamp):
+            return None
+        return timestamp, int(pk)
+    except ValueError:
+        return None
+
+
+def keyset_page(queryset, after=None, before=None, size=50):
+    """
+    One page of `queryset` in (-timestamp, -id) order without OFFSET.
+
+    `after` continues to older rows than a cursor, `before` goes back to newer
+    ones. Returns (rows, has_older, has_newer).
+    """
+    if before:
+        timestamp, pk = before
+        rows = list(
+            queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk))
+            .order_by('timestamp', 'id')[:size + 1]
+        )
+        has_newer = len(rows) > size
+        return rows[:size][::-1], True, has_newer
+
+    if after:
+        timestamp, pk = after
+        queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+    rows = list(queryset.order_by('-timestamp', '-id')[:size + 1])
+    return rows[:size], len(rows) > size, after is not None
+
+
+def install_audit_indexes(conn):
+    """GIN index over `changes` for key lookups (PostgreSQL only)"""
+    if conn.vendor != 'postgresql':
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {AUDIT_INDEX} '
+            f'ON inventory_meds_medicineauditlog USING gin (changes)'
+        )
+
+
+def drop_audit_indexes(conn):
+    if conn.vendor != 'postgresql':
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f'DROP INDEX IF EXISTS {AUDIT_INDEX}')
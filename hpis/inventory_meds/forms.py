@@ -1,7 +1,12 @@
 from django import forms
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from .models import Medicine, StockMovement, DispenseRecord, Supplier
+from main.widgets import RemoteSelect
+from records.models import PatientRecord
+from .models import (
+    Medicine, MedicineProduct, StockMovement, DispenseRecord, Supplier, MedicineAuditLog, PurchaseOrder,
+    PurchaseOrderLine, GoodsReceipt,
+)
 
 
 class MedicineForm(forms.ModelForm):
@@ -168,14 +173,21 @@ class StockAdjustmentForm(forms.Form):
 
 
 class DispenseForm(forms.ModelForm):
-    """Form for dispensing medicine to patients"""
+    """Form for dispensing medicine to patients (batches are allocated FEFO)"""
+
+    product = forms.ModelChoiceField(
+        queryset=MedicineProduct.objects.none(),
+        label="Medicine",
+        widget=RemoteSelect('inventory_meds:product_lookup', attrs={'class': 'form-control'},
+                            placeholder='Search medicine...')
+    )
     
     class Meta:
         model = DispenseRecord
-        fields = ['medicine', 'patient', 'quantity', 'instructions']
+        fields = ['patient', 'quantity', 'instructions']
         widgets = {
-            'medicine': forms.Select(attrs={'class': 'form-control'}),
-            'patient': forms.Select(attrs={'class': 'form-control'}),
+            'patient': RemoteSelect('patient_lookup', attrs={'class': 'form-control'},
+                                    placeholder='Search patient name or code...'),
             'quantity': forms.NumberInput(attrs={'class': 'form-control', 'min': '1'}),
             'instructions': forms.Textarea(attrs={'class': 'form-control', 'rows': 3, 
                                                   'placeholder': 'Dosage and usage instructions'}),
@@ -183,36 +195,21 @@ class DispenseForm(forms.ModelForm):
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # Filter to show only active medicines with stock
-        self.fields['medicine'].queryset = Medicine.objects.filter(
-            status=Medicine.STATUS_ACTIVE,
-            quantity_on_hand__gt=0
-        ).exclude(status=Medicine.STATUS_EXPIRED)
+        # Only products with stock on hand; per-batch expiry/status checks happen at allocation
+        self.fields['product'].queryset = MedicineProduct.objects.filter(quantity_on_hand__gt=0)
+        self.order_fields(['product', 'patient', 'quantity', 'instructions'])
     
     def clean(self):
         cleaned_data = super().clean()
-        medicine = cleaned_data.get('medicine')
+        product = cleaned_data.get('product')
         quantity = cleaned_data.get('quantity')
         
-        if medicine and quantity:
-            # Check if medicine is expired
-            if medicine.is_expired:
-                raise ValidationError(
-                    f"Cannot dispense expired medicine: {medicine.name}"
-                )
-            
-            # Check if medicine is archived
-            if medicine.status == Medicine.STATUS_DISCONTINUED:
-                raise ValidationError(
-                    f"Cannot dispense archived medicine: {medicine.name}"
-                )
-            
-            # Check stock availability
-            available = medicine.available_quantity
-            if quantity > available:
-                raise ValidationError(
-                    f"Insufficient stock for medicine: {medicine.name}. Available: {available}"
-                )
+        if product and quantity and quantity > product.quantity_on_hand:
+            # Cheap pre-check against the running total; the locked FEFO
+            # allocation in the view is authoritative.
+            raise ValidationError(
+                f"Insufficient stock for medicine: {product}. Available: {product.quantity_on_hand}"
+            )
         
         return cleaned_data
 
@@ -231,6 +228,110 @@ class SupplierForm(forms.ModelForm):
         }
 
 
+class PurchaseOrderForm(forms.ModelForm):
+    """Header of a purchase order"""
+    
+    class Meta:
+        model = PurchaseOrder
+        fields = ['reference', 'supplier', 'expected_on', 'notes']
+        widgets = {
+            'reference': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g., PO-2025-001'}),
+            'supplier': forms.Select(attrs={'class': 'form-control'}),
+            'expected_on': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
+            'notes': forms.Textarea(attrs={'class': 'form-control', 'rows': 2}),
+        }
+
+
+class PurchaseOrderLineForm(forms.ModelForm):
+    
+    class Meta:
+        model = PurchaseOrderLine
+        fields = ['product', 'quantity_ordered']
+        widgets = {
+            'product': RemoteSelect('inventory_meds:catalogue_lookup', attrs={'class': 'form-control'},
+                                    placeholder='Search medicine...'),
+            'quantity_ordered': forms.NumberInput(attrs={'class': 'form-control', 'min': '1'}),
+        }
+    
+    def clean_quantity_ordered(self):
+        quantity = self.cleaned_data.get('quantity_ordered')
+        if not quantity:
+            raise ValidationError("Quantity must be at least 1.")
+        return quantity
+
+
+class BasePurchaseOrderLineFormSet(forms.BaseInlineFormSet):
+    
+    def clean(self):
+        super().clean()
+        products = set()
+        for form in self.forms:
+            if not form.cleaned_data or form.cleaned_data.get('DELETE'):
+                continue
+            product = form.cleaned_data.get('product')
+            if product in products:
+                raise ValidationError(f"{product} is listed more than once.")
+            products.add(product)
+        if not products:
+            raise ValidationError("Add at least one medicine to the order.")
+
+
+PurchaseOrderLineFormSet = forms.inlineformset_factory(
+    PurchaseOrder, PurchaseOrderLine, form=PurchaseOrderLineForm, formset=BasePurchaseOrderLineFormSet,
+    extra=10, can_delete=True,
+)
+
+
+class GoodsReceiptForm(forms.ModelForm):
+    """Header of a delivery being received"""
+    
+    class Meta:
+        model = GoodsReceipt
+        fields = ['reference', 'notes']
+        widgets = {
+            'reference': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Delivery note / invoice number'}),
+            'notes': forms.Textarea(attrs={'class': 'form-control', 'rows': 2}),
+        }
+
+
+class ReceiveLineForm(forms.Form):
+    """
+    One delivered purchase order line. The line is carried as a plain id and
+    resolved by the view for the whole formset in one query.
+    """
+    
+    order_line = forms.IntegerField(widget=forms.HiddenInput)
+    batch_number = forms.CharField(
+        max_length=100, required=False,
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Batch number'})
+    )
+    lot_number = forms.CharField(
+        max_length=100, required=False,
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Lot number'})
+    )
+    expires_on = forms.DateField(
+        required=False,
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+    quantity = forms.IntegerField(
+        min_value=0, initial=0,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'min': '0'})
+    )
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('quantity'):
+            if not cleaned_data.get('batch_number'):
+                self.add_error('batch_number', "Batch number is required for received items.")
+            expires_on = cleaned_data.get('expires_on')
+            if expires_on and expires_on <= timezone.now().date():
+                self.add_error('expires_on', "Cannot receive stock that has already expired.")
+        return cleaned_data
+
+
+ReceiveLineFormSet = forms.formset_factory(ReceiveLineForm, extra=0)
+
+
 class SearchFilterForm(forms.Form):
     """Form for searching and filtering medicines"""
     
@@ -284,3 +385,69 @@ class SearchFilterForm(forms.Form):
         ],
         widget=forms.Select(attrs={'class': 'form-control'})
     )
+
+
+class AuditLogFilterForm(forms.Form):
+    """Filters for the audit log viewer; each maps onto a (column, timestamp) index"""
+    
+    action = forms.ChoiceField(
+        required=False,
+        choices=[('', 'All Actions')] + MedicineAuditLog.ACTION_CHOICES,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    patient = forms.ModelChoiceField(
+        required=False,
+        queryset=PatientRecord.objects.all(),
+        widget=RemoteSelect('patient_lookup', attrs={'class': 'form-control'},
+                            placeholder='Search patient name or code...')
+    )
+    # Set from the "filter" links in the log table
+    medicine = forms.IntegerField(required=False, min_value=1, widget=forms.HiddenInput)
+    user = forms.IntegerField(required=False, min_value=1, widget=forms.HiddenInput)
+
+
+class MedicineImportForm(forms.Form):
+    """Upload form for bulk catalogue imports"""
+    
+    file = forms.FileField(
+        help_text="CSV or Excel (.xlsx) file with a header row",
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.xlsx'})
+    )
+    update_existing = forms.BooleanField(
+        required=False, initial=True,
+        help_text="Update medicines that already exist (matched by code or name/form/strength/batch)"
+    )
+    dry_run = forms.BooleanField(
+        required=False,
+        help_text="Validate and report without saving anything"
+    )
+    
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if not upload.name.lower().endswith(('.csv', '.xlsx')):
+            raise ValidationError("Upload a .csv or .xlsx file.")
+        return upload
+
+
+class MedicineImportRowForm(forms.Form):
+    """Validates and coerces one row of a catalogue import"""
+    
+    code = forms.CharField(max_length=32, required=False)
+    name = forms.CharField(max_length=255)
+    brand_name = forms.CharField(max_length=255, required=False)
+    description = forms.CharField(required=False)
+    category = forms.CharField(max_length=100, required=False)
+    dosage_form = forms.CharField(max_length=100, required=False)
+    strength = forms.CharField(max_length=100, required=False)
+    unit = forms.CharField(max_length=50, required=False)
+    manufacturer = forms.CharField(max_length=255, required=False)
+    batch_number = forms.CharField(max_length=100, required=False)
+    lot_number = forms.CharField(max_length=100, required=False)
+    date_received = forms.DateField(required=False, input_formats=['%Y-%m-%d', '%m/%d/%Y'])
+    expires_on = forms.DateField(required=False, input_formats=['%Y-%m-%d', '%m/%d/%Y'])
+    quantity_on_hand = forms.IntegerField(required=False, min_value=0)
+    reorder_level = forms.IntegerField(required=False, min_value=0)
+    storage_instructions = forms.CharField(required=False)
+    prescription_only = forms.NullBooleanField(required=False)
+    supplier = forms.CharField(max_length=255, required=False)
+    notes = forms.CharField(required=False)
@@ -0,0 +1,343 @@
+"""
+Bulk medicine catalogue import (CSV / XLSX).
+
+Rows are validated with MedicineImportRowForm and processed in chunks. Each
+chunk matches existing batches by `code` or by the
+(name, dosage_form, strength, batch_number) unique key in one query, then
+writes with bulk_create / bulk_update. Product totals, stock movements and
+audit entries are written in bulk as well, since bulk writes bypass
+Medicine.save().
+"""
+import csv
+import io
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .audit import AuditRecorder, diff_values, field_value
+from .forms import MedicineImportRowForm
+from .models import Medicine, MedicineAuditLog, MedicineProduct, StockMovement, Supplier
+from . import search
+
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_REJECTIONS = 200
+
+# Alternative header spellings seen in supplier catalogues
+HEADER_ALIASES = {
+    'generic_name': 'name',
+    'medicine': 'name',
+    'brand': 'brand_name',
+    'form': 'dosage_form',
+    'dosage': 'dosage_form',
+    'batch': 'batch_number',
+    'batch_no': 'batch_number',
+    'lot': 'lot_number',
+    'lot_no': 'lot_number',
+    'qty': 'quantity_on_hand',
+    'quantity': 'quantity_on_hand',
+    'stock': 'quantity_on_hand',
+    'reorder': 'reorder_level',
+    'expiry': 'expires_on',
+    'expiry_date': 'expires_on',
+    'expiration_date': 'expires_on',
+    'received': 'date_received',
+    'rx': 'prescription_only',
+    'prescription': 'prescription_only',
+    'supplier_name': 'supplier',
+    'storage': 'storage_instructions',
+}
+BOOLEAN_VALUES = {
+    'yes': 'true', 'y': 'true', '1': 'true', 'true': 'true', 'rx': 'true',
+    'no': 'false', 'n': 'false', '0': 'false', 'false': 'false', 'otc': 'false',
+}
+ROW_FIELDS = MedicineImportRowForm.base_fields
+# Row fields written to Medicine (supplier is resolved separately)
+MEDICINE_FIELDS = [name for name in ROW_FIELDS if name != 'supplier']
+
+
+@dataclass
+class ImportSummary:
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    rejected: int = 0
+    errors: list = field(default_factory=list)  # (line, message), capped
+    dry_run: bool = False
+
+    @property
+    def total(self):
+        return self.created + self.updated + self.unchanged + self.rejected
+
+    def reject(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_REJECTIONS:
+            self.errors.append((line, message))
+
+
+def normalize_header(value):
+    key = '_'.join(str(value or '').strip().lower().replace('-', ' ').split())
+    return HEADER_ALIASES.get(key, key)
+
+
+def read_rows(upload, filename=None):
+    """Yield (line number, {column: value}) from a CSV or XLSX file object"""
+    filename = (filename or getattr(upload, 'name', '') or '').lower()
+    if filename.endswith('.xlsx'):
+        from openpyxl import load_workbook
+
+        sheet = load_workbook(upload, read_only=True, data_only=True).active
+        rows = sheet.iter_rows(values_only=True)
+    else:
+        rows = csv.reader(io.TextIOWrapper(upload, encoding='utf-8-sig', newline=''))
+
+    header = None
+    for line, values in enumerate(rows, start=1):
+        if header is None:
+            header = [normalize_header(v) for v in values]
+            continue
+        if not any(v not in (None, '') for v in values):
+            continue
+        yield line, {
+            column: value for column, value in zip(header, values)
+            if column in ROW_FIELDS
+        }
+
+
+def _clean(raw):
+    """
+    (values, None) for a valid row or (None, message). The fields of
+    MedicineImportRowForm are applied directly: building a bound form per row
+    deep-copies every field, which dominates the cost of large files.
+    """
+    values, errors = {}, []
+    for name, form_field in ROW_FIELDS.items():
+        value = raw.get(name)
+        if isinstance(value, str):
+            value = value.strip()
+        if name == 'prescription_only' and value not in (None, ''):
+            value = BOOLEAN_VALUES.get(str(value).lower(), value)
+        try:
+            cleaned = form_field.clean(value)
+        except ValidationError as e:
+            errors.append(f"{name}: {' '.join(e.messages)}")
+            continue
+        # Only columns that had a value: empty cells never overwrite existing data
+        if value not in (None, ''):
+            values[name] = cleaned
+    if errors:
+        return None, '; '.join(errors)
+    return values, None
+
+
+def _natural_key(values):
+    return (values.get('name', ''), values.get('dosage_form', ''),
+            values.get('strength', ''), values.get('batch_number', ''))
+
+
+def _update_rows(medicines, field_names):
+    """
+    Write `field_names` of each medicine with one prepared UPDATE run through
+    executemany. bulk_update builds a CASE/WHEN expression per field and row,
+    which costs far more than the statement itself at import sizes.
+    """
+    fields = [Medicine._meta.get_field(name) for name in field_names]
+    quote = connection.ops.quote_name
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        quote(Medicine._meta.db_table),
+        ', '.join(f'{quote(f.column)} = %s' for f in fields),
+        quote(Medicine._meta.pk.column),
+    )
+    params = [
+        [f.get_db_prep_save(getattr(m, f.attname), connection) for f in fields] + [m.pk]
+        for m in medicines
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+class CatalogueImporter:
+    def __init__(self, user=None, request=None, update_existing=True, dry_run=False,
+                 chunk_size=IMPORT_CHUNK_SIZE):
+        self.user = user
+        self.request = request
+        self.update_existing = update_existing
+        self.chunk_size = chunk_size
+        self.summary = ImportSummary(dry_run=dry_run)
+        self.seen_codes = {}
+        self.seen_keys = {}
+        self.product_ids = set()
+        self.suppliers = {}
+
+    def run(self, rows):
+        with transaction.atomic():
+            chunk = []
+            for line, raw in rows:
+                chunk.append((line, raw))
+                if len(chunk) >= self.chunk_size:
+                    self._process(chunk)
+                    chunk = []
+            if chunk:
+                self._process(chunk)
+
+            if self.product_ids:
+                MedicineProduct.refresh_totals(self.product_ids)
+            if self.summary.dry_run:
+                transaction.set_rollback(True)
+
+        if not self.summary.dry_run and (self.summary.created or self.summary.updated):
+            search.bump_version()
+        return self.summary
+
+    def _process(self, chunk):
+        # 1. Validate and drop rows that repeat an earlier row of the file
+        valid = []
+        for line, raw in chunk:
+            values, error = _clean(raw)
+            if error:
+                self.summary.reject(line, error)
+                continue
+            key = _natural_key(values)
+            code = values.get('code')
+            first = self.seen_codes.get(code) if code else None
+            first = first or self.seen_keys.get(key)
+            if first:
+                self.summary.reject(line, f"duplicate of line {first}")
+                continue
+            if code:
+                self.seen_codes[code] = line
+            self.seen_keys[key] = line
+            valid.append((line, values))
+        if not valid:
+            return
+
+        # 2. One query finds every existing batch matching a code or unique key
+        codes = {v['code'] for _, v in valid if v.get('code')}
+        names = {v['name'] for _, v in valid}
+        existing = list(Medicine.objects.filter(Q(code__in=codes) | Q(name__in=names)).filter(
+            Q(code__in=codes) | Q(batch_number__in={v.get('batch_number', '') for _, v in valid})
+        ))
+        by_code = {m.code: m for m in existing}
+        by_key = {(m.name, m.dosage_form, m.strength, m.batch_number): m for m in existing}
+
+        self._resolve_suppliers({v['supplier'] for _, v in valid if v.get('supplier')})
+
+        to_create, to_update = [], []
+        for line, values in valid:
+            by_code_match = by_code.get(values.get('code'))
+            by_key_match = by_key.get(_natural_key(values))
+            if by_code_match and by_key_match and by_code_match.pk != by_key_match.pk:
+                self.summary.reject(line, f"code {values['code']} belongs to a different batch "
+                                          f"than {values['name']} {values.get('batch_number', '')}")
+                continue
+            medicine = by_code_match or by_key_match
+            supplier = self.suppliers.get(values.pop('supplier', None))
+
+            if medicine is None:
+                if not values.get('code'):
+                    self.summary.reject(line, "code: required for new medicines")
+                    continue
+                medicine = Medicine(**values)
+                if supplier:
+                    medicine.supplier = supplier
+                to_create.append(medicine)
+            elif not self.update_existing:
+                self.summary.unchanged += 1
+            else:
+                old = {name: field_value(medicine, name) for name in MEDICINE_FIELDS + ['supplier']}
+                old_quantity = medicine.quantity_on_hand
+                for name, value in values.items():
+                    setattr(medicine, name, value)
+                if supplier:
+                    medicine.supplier = supplier
+                changes = diff_values(old, medicine)
+                if changes:
+                    to_update.append((medicine, changes, old_quantity))
+                else:
+                    self.summary.unchanged += 1
+
+        self._write(to_create, to_update)
+
+    def _resolve_suppliers(self, names):
+        missing = names - set(self.suppliers)
+        if not missing:
+            return
+        found = {s.name: s for s in Supplier.objects.filter(name__in=missing)}
+        new = [Supplier(name=name) for name in missing if name not in found]
+        if new:
+            Supplier.objects.bulk_create(new)
+            found.update({s.name: s for s in Supplier.objects.filter(name__in=[s.name for s in new])})
+        self.suppliers.update(found)
+
+    def _assign_products(self, medicines):
+        """Point each batch at its product, creating missing products in bulk"""
+        def key(obj):
+            return obj.name, obj.dosage_form, obj.strength
+
+        # Filter by name only and match the full key here; OR-ing a Q per key
+        # overflows SQLite's expression depth on large chunks
+        names = {m.name for m in medicines}
+        products = {key(p): p for p in MedicineProduct.objects.filter(name__in=names)}
+
+        missing = {}
+        for m in medicines:
+            if key(m) not in products:
+                missing.setdefault(key(m), MedicineProduct(
+                    name=m.name, dosage_form=m.dosage_form, strength=m.strength, unit=m.unit,
+                    category=m.category, prescription_only=m.prescription_only,
+                ))
+        if missing:
+            MedicineProduct.objects.bulk_create(list(missing.values()), ignore_conflicts=True)
+            products.update({
+                key(p): p for p in MedicineProduct.objects.filter(name__in={k[0] for k in missing})
+            })
+
+        for m in medicines:
+            if m.product_id:
+                self.product_ids.add(m.product_id)
+            m.product = products[key(m)]
+            self.product_ids.add(m.product_id)
+
+    def _write(self, to_create, to_update):
+        now = timezone.now()
+        updated = [m for m, _, _ in to_update]
+        for m in to_create + updated:
+            m.refresh_status()
+            m.updated_at = now
+        if to_create or updated:
+            self._assign_products(to_create + updated)
+
+        if to_create:
+            Medicine.objects.bulk_create(to_create, batch_size=self.chunk_size)
+        if updated:
+            changed = set().union(*(changes for _, changes, _ in to_update))
+            _update_rows(updated, [n for n in MEDICINE_FIELDS + ['supplier'] if n in changed]
+                         + ['product', 'status', 'updated_at'])
+        self.summary.created += len(to_create)
+        self.summary.updated += len(updated)
+
+        # Stock movements keep forecasting and history in step with imported quantities
+        movements = [
+            StockMovement(medicine=m, movement_type=StockMovement.MOVEMENT_IN, quantity=m.quantity_on_hand,
+                          reason="Catalogue import", performed_by=self.user)
+            for m in to_create if m.quantity_on_hand
+        ] + [
+            StockMovement(medicine=m, movement_type=StockMovement.MOVEMENT_ADJUST,
+                          quantity=m.quantity_on_hand - old_quantity,
+                          reason="Catalogue import", performed_by=self.user)
+            for m, _, old_quantity in to_update if m.quantity_on_hand != old_quantity
+        ]
+        StockMovement.objects.bulk_create(movements)
+
+        with AuditRecorder(self.user, self.request) as audit:
+            for m in to_create:
+                audit.add(m, MedicineAuditLog.ACTION_CREATE, reason="Catalogue import")
+            for m, changes, _ in to_update:
+                audit.add(m, MedicineAuditLog.ACTION_UPDATE, changes=changes, reason="Catalogue import")
+
+
+def import_catalogue(upload, filename=None, **options):
+    """Import a CSV/XLSX catalogue file object; returns an ImportSummary"""
+    return CatalogueImporter(**options).run(read_rows(upload, filename))
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from inventory_meds.archive import ARCHIVE_BATCH_SIZE, archive_before, archive_root
+
+
+class Command(BaseCommand):
+    help = 'Move medicine audit log rows older than the retention window into gzip NDJSON day files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.AUDIT_RETENTION_DAYS,
+                            help='Keep this many days of audit logs in the database')
+        parser.add_argument('--output-dir', default=None, help='Archive directory (default: AUDIT_ARCHIVE_DIR)')
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Count what would be archived without moving it')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=max(0, options['days']))
+        root = archive_root(options['output_dir'])
+        counts = archive_before(cutoff, root, max(1, options['batch_size']), options['dry_run'])
+
+        for day in sorted(counts):
+            self.stdout.write(f'{day}: {counts[day]} rows')
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {sum(counts.values())} audit log rows older than {cutoff:%Y-%m-%d} to {root}.'
+        ))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory_meds.importer import IMPORT_CHUNK_SIZE, import_catalogue
+
+
+class Command(BaseCommand):
+    help = 'Import or update medicines from a CSV or XLSX catalogue file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to a .csv or .xlsx file with a header row')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and report without saving anything')
+        parser.add_argument('--no-update', action='store_true', help='Leave medicines that already exist untouched')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path.lower().endswith(('.csv', '.xlsx')):
+            raise CommandError('Expected a .csv or .xlsx file.')
+        try:
+            with open(path, 'rb') as upload:
+                summary = import_catalogue(
+                    upload, path,
+                    update_existing=not options['no_update'],
+                    dry_run=options['dry_run'],
+                    chunk_size=max(1, options['chunk_size']),
+                )
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        for line, message in summary.errors:
+            self.stderr.write(f'Line {line}: {message}')
+        if summary.rejected > len(summary.errors):
+            self.stderr.write(f'... and {summary.rejected - len(summary.errors)} more rejected rows')
+        prefix = 'Dry run: ' if summary.dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}{summary.created} created, {summary.updated} updated, '
+            f'{summary.unchanged} unchanged, {summary.rejected} rejected ({summary.total} rows).'
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from inventory_meds.search import install_search_index, bump_version
+
+
+class Command(BaseCommand):
+    help = 'Create or repair the medicine search index (pg_trgm on PostgreSQL, FTS5 on SQLite)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias to index')
+
+    def handle(self, *args, **options):
+        if install_search_index(connections[options['database']]):
+            bump_version()
+            self.stdout.write(self.style.SUCCESS('Medicine search index is up to date.'))
+        else:
+            self.stdout.write(self.style.WARNING(
+                'No search index available for this backend; search falls back to icontains.'
+            ))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventory_meds import forecasting
+
+
+class Command(BaseCommand):
+    help = 'Recompute consumption-based stockout and reorder forecasts for every medicine product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=int, default=forecasting.DEFAULT_WINDOW_DAYS,
+                            help='Days of OUT movement history to use')
+        parser.add_argument('--lead-time', type=int, default=forecasting.DEFAULT_LEAD_TIME_DAYS,
+                            help='Supplier lead time in days')
+        parser.add_argument('--review-days', type=int, default=forecasting.DEFAULT_REVIEW_DAYS,
+                            help='Days of demand each order should cover after it arrives')
+        parser.add_argument('--safety-factor', type=float, default=forecasting.DEFAULT_SAFETY_FACTOR,
+                            help='Safety stock in standard deviations of daily usage')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = forecasting.refresh_forecasts(
+            window_days=max(1, options['window']),
+            lead_time=max(0, options['lead_time']),
+            review_days=max(0, options['review_days']),
+            safety_factor=options['safety_factor'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed {count} forecasts in {time.monotonic() - started:.2f}s.'
+        ))
@@ -0,0 +1,38 @@
+import json
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory_meds.archive import search_archive
+
+
+class Command(BaseCommand):
+    help = 'Search archived medicine audit logs; prints matching records as NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='First day to search (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end', help='Last day to search (YYYY-MM-DD)')
+        parser.add_argument('--action', help='e.g. UPDATE, DISPENSE')
+        parser.add_argument('--medicine', help='Medicine id, code or name')
+        parser.add_argument('--user', help='User profile id or username')
+        parser.add_argument('--patient', help='Patient id or patient code')
+        parser.add_argument('--contains', help='Case-insensitive text anywhere in the record')
+        parser.add_argument('--limit', type=int, default=0, help='Stop after this many matches')
+        parser.add_argument('--archive-dir', default=None)
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['start']) if options['start'] else None
+            end = date.fromisoformat(options['end']) if options['end'] else None
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        matches = search_archive(
+            options['archive_dir'], start, end,
+            action=options['action'], medicine=options['medicine'], user=options['user'],
+            patient=options['patient'], text=options['contains'],
+        )
+        for count, record in enumerate(matches, start=1):
+            self.stdout.write(json.dumps(record, ensure_ascii=False))
+            if count == options['limit']:
+                break
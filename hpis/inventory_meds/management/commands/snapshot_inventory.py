@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from inventory_meds.snapshots import take_snapshot
+
+
+class Command(BaseCommand):
+    help = "Record today's inventory metrics for the reports dashboard trends (run once a day)"
+
+    def handle(self, *args, **options):
+        snapshot = take_snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f'Saved snapshot for {snapshot.date}: {snapshot.total_medicines} medicines, '
+            f'{snapshot.total_quantity} units on hand.'
+        ))
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.7 on 2026-10-19 02:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def split_products(apps, schema_editor):
+    """Create one product per (name, dosage_form, strength) and attach its batches"""
+    Medicine = apps.get_model('inventory_meds', 'Medicine')
+    MedicineProduct = apps.get_model('inventory_meds', 'MedicineProduct')
+
+    groups = (
+        Medicine.objects
+        .values('name', 'dosage_form', 'strength')
+        .annotate(total=Sum('quantity_on_hand'), batches=Count('id'))
+    )
+    for group in groups:
+        sample = Medicine.objects.filter(
+            name=group['name'], dosage_form=group['dosage_form'], strength=group['strength']
+        ).order_by('id').first()
+        product = MedicineProduct.objects.create(
+            name=group['name'],
+            dosage_form=group['dosage_form'],
+            strength=group['strength'],
+            unit=sample.unit,
+            category=sample.category,
+            prescription_only=sample.prescription_only,
+            quantity_on_hand=group['total'] or 0,
+            batch_count=group['batches'],
+        )
+        Medicine.objects.filter(
+            name=group['name'], dosage_form=group['dosage_form'], strength=group['strength']
+        ).update(product=product)
+
+
+def unsplit_products(apps, schema_editor):
+    Medicine = apps.get_model('inventory_meds', 'Medicine')
+    Medicine.objects.update(product=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory_meds', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicineProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, help_text='Generic medicine name', max_length=255)),
+                ('dosage_form', models.CharField(blank=True, max_length=100)),
+                ('strength', models.CharField(blank=True, max_length=100)),
+                ('unit', models.CharField(default='tablet', max_length=50)),
+                ('category', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('prescription_only', models.BooleanField(default=False)),
+                ('quantity_on_hand', models.IntegerField(default=0)),
+                ('batch_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['name', 'strength'],
+                'constraints': [models.UniqueConstraint(fields=('name', 'dosage_form', 'strength'), name='unique_medicine_product')],
+            },
+        ),
+        migrations.AddField(
+            model_name='medicine',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='batches', to='inventory_meds.medicineproduct'),
+        ),
+        migrations.AddIndex(
+            model_name='medicine',
+            index=models.Index(fields=['product', 'expires_on'], name='inventory_m_product_cba52e_idx'),
+        ),
+        migrations.RunPython(split_products, unsplit_products),
+    ]
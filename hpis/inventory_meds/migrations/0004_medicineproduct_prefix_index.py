@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def create_prefix_index(apps, schema_editor):
+    from main.lookups import install_prefix_indexes
+    install_prefix_indexes(schema_editor.connection, 'inventory_meds_medicineproduct', ['name'])
+
+
+def remove_prefix_index(apps, schema_editor):
+    from main.lookups import drop_prefix_indexes
+    drop_prefix_indexes(schema_editor.connection, 'inventory_meds_medicineproduct', ['name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory_meds', '0003_medicine_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_index, remove_prefix_index),
+    ]
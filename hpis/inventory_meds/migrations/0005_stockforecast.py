@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-19 02:21
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory_meds', '0004_medicineproduct_prefix_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockForecast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_days', models.PositiveIntegerField(help_text='Days of OUT movement history used')),
+                ('avg_daily_usage', models.FloatField(default=0, help_text='Moving average over the whole window')),
+                ('recent_daily_usage', models.FloatField(default=0, help_text='Moving average over the most recent days')),
+                ('usage_std', models.FloatField(default=0, help_text='Standard deviation of daily usage')),
+                ('quantity_on_hand', models.IntegerField(default=0, help_text='Stock when the forecast was computed')),
+                ('days_until_stockout', models.FloatField(blank=True, null=True)),
+                ('predicted_stockout_on', models.DateField(blank=True, null=True)),
+                ('reorder_point', models.PositiveIntegerField(default=0)),
+                ('suggested_order_quantity', models.PositiveIntegerField(default=0)),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='forecast', to='inventory_meds.medicineproduct')),
+            ],
+            options={
+                'ordering': ['predicted_stockout_on', 'product__name'],
+                'indexes': [models.Index(fields=['predicted_stockout_on'], name='inventory_m_predict_6ff15c_idx')],
+            },
+        ),
+    ]
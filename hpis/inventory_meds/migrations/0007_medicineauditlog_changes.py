@@ -0,0 +1,50 @@
+# Generated by Django 5.2.7 on 2026-10-19 02:25
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def backfill_changes(apps, schema_editor):
+    """Copy legacy single-field entries into the JSON diff column"""
+    MedicineAuditLog = apps.get_model('inventory_meds', 'MedicineAuditLog')
+    legacy = MedicineAuditLog.objects.exclude(field_name='').filter(changes={}).only(
+        'id', 'field_name', 'old_value', 'new_value'
+    )
+    batch = []
+    for log in legacy.iterator(chunk_size=BATCH_SIZE):
+        log.changes = {log.field_name: [log.old_value, log.new_value]}
+        batch.append(log)
+        if len(batch) >= BATCH_SIZE:
+            MedicineAuditLog.objects.bulk_update(batch, ['changes'])
+            batch = []
+    if batch:
+        MedicineAuditLog.objects.bulk_update(batch, ['changes'])
+
+
+def create_changes_index(apps, schema_editor):
+    from inventory_meds.audit import install_audit_indexes
+    install_audit_indexes(schema_editor.connection)
+
+
+def remove_changes_index(apps, schema_editor):
+    from inventory_meds.audit import drop_audit_indexes
+    drop_audit_indexes(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory_meds', '0006_inventorysnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicineauditlog',
+            name='changes',
+            field=models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder),
+        ),
+        migrations.RunPython(backfill_changes, migrations.RunPython.noop),
+        migrations.RunPython(create_changes_index, remove_changes_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-19 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory_meds', '0007_medicineauditlog_changes'),
+        ('main', '0006_alter_accesslog_access_type_and_more'),
+        ('records', '0008_patientrecord_prefix_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='medicineauditlog',
+            index=models.Index(fields=['patient', 'timestamp'], name='inventory_m_patient_77eb23_idx'),
+        ),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
 # Avoid repeated string literals for relations
@@ -21,7 +24,78 @@ class Supplier(models.Model):
         return self.name
 
 
+class MedicineProduct(models.Model):
+    """A sellable product (name + form + strength); batches are Medicine rows"""
+
+    name = models.CharField(max_length=255, db_index=True, help_text="Generic medicine name")
+    dosage_form = models.CharField(max_length=100, blank=True)
+    strength = models.CharField(max_length=100, blank=True)
+    unit = models.CharField(max_length=50, default="tablet")
+    category = models.CharField(max_length=100, blank=True, db_index=True)
+    prescription_only = models.BooleanField(default=False)
+
+    # Running totals across all batches, maintained incrementally by Medicine.save()
+    # and the FEFO allocator so stock lookups are a single row read.
+    quantity_on_hand = models.IntegerField(default=0)
+    batch_count = models.PositiveIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["name", "strength"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'dosage_form', 'strength'],
+                name='unique_medicine_product'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.strength or ''} {self.dosage_form or ''})".strip()
+
+    @classmethod
+    def for_batch(cls, medicine):
+        """Get or create the product a batch belongs to"""
+        product, _ = cls.objects.get_or_create(
+            name=medicine.name,
+            dosage_form=medicine.dosage_form,
+            strength=medicine.strength,
+            defaults={
+                'unit': medicine.unit,
+                'category': medicine.category,
+                'prescription_only': medicine.prescription_only,
+            }
+        )
+        return product
+
+    @classmethod
+    def refresh_totals(cls, product_ids):
+        """Recompute running totals from the batches, after bulk writes that bypass save()"""
+        batches = Medicine.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        cls.objects.filter(pk__in=product_ids).update(
+            quantity_on_hand=Coalesce(
+                Subquery(batches.annotate(total=Sum('quantity_on_hand')).values('total')), 0
+            ),
+            batch_count=Coalesce(Subquery(batches.annotate(count=Count('pk')).values('count')), 0),
+            updated_at=timezone.now(),
+        )
+
+    @classmethod
+    def apply_delta(cls, product_id, quantity=0, batches=0):
+        """Atomically adjust the running totals of a product"""
+        if not product_id or (not quantity and not batches):
+            return
+        cls.objects.filter(pk=product_id).update(
+            quantity_on_hand=F('quantity_on_hand') + quantity,
+            batch_count=F('batch_count') + batches,
+            updated_at=timezone.now(),
+        )
+
+
 class Medicine(models.Model):
+    """A single received batch of a MedicineProduct"""
+
     STATUS_ACTIVE = "Active"
     STATUS_OUT_OF_STOCK = "Out of Stock"
     STATUS_EXPIRED = "Expired"
@@ -73,6 +147,7 @@ class Medicine(models.Model):
                              default=STATUS_ACTIVE, db_index=True)
     
     # Relations
+    product = models.ForeignKey(MedicineProduct, on_delete=models.PROTECT, blank=True, null=True, related_name="batches")
     supplier = models.ForeignKey(Supplier, on_delete=models.SET_NULL, blank=True, null=True, related_name="medicines")
     
     # Additional Info
@@ -88,6 +163,7 @@ class Medicine(models.Model):
             models.Index(fields=["expires_on"]),
             models.Index(fields=["batch_number"]),
             models.Index(fields=["status"]),
+            models.Index(fields=["product", "expires_on"]),
         ]
         constraints = [
             models.UniqueConstraint(
@@ -99,15 +175,52 @@ class Medicine(models.Model):
     def __str__(self):
         return f"{self.name} ({self.strength or ''} {self.dosage_form or ''})".strip()
 
-    def save(self, *args, **kwargs):
-        # Auto-update status based on quantity and expiration
+    def _locked_totals(self):
+        """(product_id, quantity) this batch contributes to product totals, read with its row locked"""
+        if self._state.adding:
+            return None, 0
+        row = (
+            Medicine.objects.select_for_update()
+            .filter(pk=self.pk).values_list('product_id', 'quantity_on_hand').first()
+        )
+        return row or (None, 0)
+
+    def refresh_status(self):
+        """Auto-update status based on quantity and expiration"""
         if self.quantity_on_hand == 0:
             self.status = self.STATUS_OUT_OF_STOCK
         elif self.expires_on and self.expires_on <= timezone.now().date():
             self.status = self.STATUS_EXPIRED
         elif self.status == self.STATUS_OUT_OF_STOCK and self.quantity_on_hand > 0:
             self.status = self.STATUS_ACTIVE
-        super().save(*args, **kwargs)
+
+    def save(self, *args, **kwargs):
+        self.refresh_status()
+
+        if self.product_id is None:
+            self.product = MedicineProduct.for_batch(self)
+
+        with transaction.atomic():
+            # Deltas come from the stored row, locked so concurrent saves of
+            # this batch apply theirs one after another
+            old_product_id, old_quantity = self._locked_totals()
+            # What the row held before this save, for post_save receivers
+            self._tracked = (old_product_id, old_quantity)
+            super().save(*args, **kwargs)
+
+            # Keep per-product running totals in step with this batch
+            if old_product_id == self.product_id:
+                MedicineProduct.apply_delta(self.product_id, self.quantity_on_hand - old_quantity)
+            else:
+                MedicineProduct.apply_delta(old_product_id, -old_quantity, batches=-1)
+                MedicineProduct.apply_delta(self.product_id, self.quantity_on_hand, batches=1)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            product_id, quantity = self._locked_totals()
+            result = super().delete(*args, **kwargs)
+            MedicineProduct.apply_delta(product_id, -quantity, batches=-1)
+        return result
 
     @property
     def is_low_stock(self) -> bool:
@@ -162,6 +275,59 @@ class StockMovement(models.Model):
         return f"{self.movement_type} {self.quantity} {self.medicine.name}"
 
 
+class StockForecast(models.Model):
+    """Consumption forecast for a product, refreshed by `manage.py refresh_stock_forecasts`"""
+
+    product = models.OneToOneField(MedicineProduct, on_delete=models.CASCADE, related_name="forecast")
+    window_days = models.PositiveIntegerField(help_text="Days of OUT movement history used")
+    avg_daily_usage = models.FloatField(default=0, help_text="Moving average over the whole window")
+    recent_daily_usage = models.FloatField(default=0, help_text="Moving average over the most recent days")
+    usage_std = models.FloatField(default=0, help_text="Standard deviation of daily usage")
+    quantity_on_hand = models.IntegerField(default=0, help_text="Stock when the forecast was computed")
+    days_until_stockout = models.FloatField(blank=True, null=True)
+    predicted_stockout_on = models.DateField(blank=True, null=True)
+    reorder_point = models.PositiveIntegerField(default=0)
+    suggested_order_quantity = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["predicted_stockout_on", "product__name"]
+        indexes = [
+            models.Index(fields=["predicted_stockout_on"]),
+        ]
+
+    def __str__(self):
+        return f"Forecast for {self.product}"
+
+    @property
+    def needs_reorder(self) -> bool:
+        return self.suggested_order_quantity > 0
+
+
+class InventorySnapshot(models.Model):
+    """End-of-day inventory metrics, written once a day by `manage.py snapshot_inventory`"""
+
+    date = models.DateField(unique=True)
+    total_medicines = models.PositiveIntegerField(default=0)
+    active_count = models.PositiveIntegerField(default=0)
+    total_quantity = models.BigIntegerField(default=0)
+    low_stock_count = models.PositiveIntegerField(default=0)
+    out_of_stock_count = models.PositiveIntegerField(default=0)
+    expired_count = models.PositiveIntegerField(default=0)
+    expiring_soon_count = models.PositiveIntegerField(default=0)
+    # {category: quantity on hand}
+    category_quantities = models.JSONField(default=dict, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-date"]
+
+    def __str__(self):
+        return f"Inventory snapshot {self.date}"
+
+
 class DispenseRecord(models.Model):
     medicine = models.ForeignKey(Medicine, on_delete=models.PROTECT, related_name="dispenses")
     patient = models.ForeignKey("records.PatientRecord", on_delete=models.PROTECT, related_name="dispenses")
@@ -190,6 +356,102 @@ class DispenseRecord(models.Model):
         return f"Dispensed {self.quantity} {self.medicine.name} to {self.patient.full_name}"
 
 
+class PurchaseOrder(models.Model):
+    """An order placed with a supplier, received through one or more GoodsReceipts"""
+
+    STATUS_ORDERED = "Ordered"
+    STATUS_PARTIAL = "Partially Received"
+    STATUS_RECEIVED = "Received"
+    STATUS_CANCELLED = "Cancelled"
+
+    STATUS_CHOICES = [
+        (STATUS_ORDERED, "Ordered"),
+        (STATUS_PARTIAL, "Partially Received"),
+        (STATUS_RECEIVED, "Received"),
+        (STATUS_CANCELLED, "Cancelled"),
+    ]
+    OPEN_STATUSES = (STATUS_ORDERED, STATUS_PARTIAL)
+
+    reference = models.CharField(max_length=50, unique=True, help_text="Purchase order number")
+    supplier = models.ForeignKey(Supplier, on_delete=models.PROTECT, related_name="purchase_orders")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_ORDERED, db_index=True)
+    expected_on = models.DateField(blank=True, null=True)
+    notes = models.TextField(blank=True)
+    created_by = models.ForeignKey(USER_PROFILE_REL, on_delete=models.SET_NULL, blank=True, null=True, related_name="purchase_orders")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at", "-id"]
+        indexes = [
+            models.Index(fields=["supplier", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.reference} ({self.supplier})"
+
+    @property
+    def is_open(self) -> bool:
+        return self.status in self.OPEN_STATUSES
+
+
+class PurchaseOrderLine(models.Model):
+    order = models.ForeignKey(PurchaseOrder, on_delete=models.CASCADE, related_name="lines")
+    product = models.ForeignKey(MedicineProduct, on_delete=models.PROTECT, related_name="order_lines")
+    quantity_ordered = models.PositiveIntegerField()
+    quantity_received = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["id"]
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='unique_purchase_order_product')
+        ]
+
+    def __str__(self):
+        return f"{self.quantity_ordered} x {self.product}"
+
+    @property
+    def outstanding(self) -> int:
+        return max(self.quantity_ordered - self.quantity_received, 0)
+
+
+class GoodsReceipt(models.Model):
+    """One delivery from a supplier, posted to stock in a single transaction"""
+
+    supplier = models.ForeignKey(Supplier, on_delete=models.PROTECT, related_name="receipts")
+    purchase_order = models.ForeignKey(PurchaseOrder, on_delete=models.PROTECT, blank=True, null=True, related_name="receipts")
+    reference = models.CharField(max_length=100, blank=True, help_text="Supplier delivery note / invoice number")
+    notes = models.TextField(blank=True)
+    received_by = models.ForeignKey(USER_PROFILE_REL, on_delete=models.SET_NULL, blank=True, null=True, related_name="goods_receipts")
+    received_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ["-received_at", "-id"]
+
+    def __str__(self):
+        return f"Receipt GR-{self.pk} from {self.supplier}"
+
+    @property
+    def movement_reference(self):
+        """Value of StockMovement.reference for the movements this receipt posted"""
+        return f"GR-{self.pk}"
+
+
+class GoodsReceiptLine(models.Model):
+    receipt = models.ForeignKey(GoodsReceipt, on_delete=models.CASCADE, related_name="lines")
+    order_line = models.ForeignKey(PurchaseOrderLine, on_delete=models.SET_NULL, blank=True, null=True, related_name="receipt_lines")
+    medicine = models.ForeignKey(Medicine, on_delete=models.PROTECT, related_name="receipt_lines")
+    quantity = models.PositiveIntegerField()
+    created_batch = models.BooleanField(default=False, help_text="The batch was created by this receipt")
+
+    class Meta:
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.medicine}"
+
+
 class MedicineAuditLog(models.Model):
     ACTION_CREATE = "CREATE"
     ACTION_UPDATE = "UPDATE"
@@ -214,9 +476,12 @@ class MedicineAuditLog(models.Model):
     medicine = models.ForeignKey(Medicine, on_delete=models.SET_NULL, null=True, blank=True, related_name="audit_logs")
     action = models.CharField(max_length=20, choices=ACTION_CHOICES, db_index=True)
     user = models.ForeignKey(USER_PROFILE_REL, on_delete=models.SET_NULL, null=True, blank=True, related_name="medicine_audit_logs")
+    # Single-field entries keep field_name/old_value/new_value filled in as text;
+    # `changes` holds the diff of every entry as {field: [old, new]}.
     field_name = models.CharField(max_length=100, blank=True)
     old_value = models.TextField(blank=True)
     new_value = models.TextField(blank=True)
+    changes = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
     reason = models.TextField(blank=True)
     patient = models.ForeignKey("records.PatientRecord", on_delete=models.SET_NULL, null=True, blank=True)
     ip_address = models.GenericIPAddressField(blank=True, null=True)
@@ -228,7 +493,12 @@ class MedicineAuditLog(models.Model):
             models.Index(fields=["action", "timestamp"]),
             models.Index(fields=["medicine", "timestamp"]),
             models.Index(fields=["user", "timestamp"]),
+            models.Index(fields=["patient", "timestamp"]),
         ]
     
     def __str__(self):
         return f"{self.action} by {self.user} at {self.timestamp}"
+
+    @property
+    def changed_fields(self):
+        return list(self.changes or {})
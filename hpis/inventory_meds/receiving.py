@@ -0,0 +1,209 @@
+"""
+Goods receiving: posting a supplier delivery to stock in one transaction.
+
+A delivery of any size runs a fixed number of queries: one SELECT ... FOR
+UPDATE for the batches it touches (and, against a purchase order, one each
+for the order and its lines, so concurrent deliveries cannot both receive
+what is outstanding), one bulk INSERT for new batches, one
+CASE-based UPDATE each for batch quantities, product totals and purchase
+order lines, and one bulk INSERT each for receipt lines, stock movements and
+audit entries.
+"""
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .audit import AuditRecorder
+from .models import (
+    GoodsReceipt, GoodsReceiptLine, Medicine, MedicineAuditLog, MedicineProduct, PurchaseOrder,
+    PurchaseOrderLine, StockMovement,
+)
+from . import search
+
+
+@dataclass
+class ReceiptLine:
+    product: MedicineProduct
+    quantity: int
+    batch_number: str = ''
+    lot_number: str = ''
+    expires_on: Optional[date] = None
+    order_line: Optional[PurchaseOrderLine] = None
+
+
+def _increments(deltas):
+    """CASE pk WHEN ... THEN delta expression for a {pk: delta} mapping"""
+    return Case(
+        *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def _lock_order(purchase_order, lines):
+    """
+    Lock `purchase_order` and its lines and check the delivery still fits:
+    the order is open and no line receives more than is outstanding.
+    """
+    order = PurchaseOrder.objects.select_for_update().get(pk=purchase_order.pk)
+    if not order.is_open:
+        raise ValueError(f"Purchase order {order.reference} is {order.get_status_display().lower()}.")
+    order_lines = {line.pk: line for line in PurchaseOrderLine.objects.select_for_update().filter(order=order)}
+
+    receiving = {}
+    for line in lines:
+        if line.order_line is None:
+            continue
+        if line.order_line.pk not in order_lines:
+            raise ValueError(f"{line.product} is not on purchase order {order.reference}.")
+        receiving[line.order_line.pk] = receiving.get(line.order_line.pk, 0) + line.quantity
+    for pk, quantity in receiving.items():
+        outstanding = order_lines[pk].outstanding
+        if quantity > outstanding:
+            raise ValueError(
+                f"Only {outstanding} of {order_lines[pk].product} outstanding on {order.reference}; "
+                f"cannot receive {quantity}."
+            )
+    return order
+
+
+def receive_delivery(supplier, lines, user=None, request=None, purchase_order=None, reference='', notes=''):
+    """
+    Post the `lines` (ReceiptLine) of one delivery from `supplier` and return
+    the GoodsReceipt.
+
+    Lines are matched to existing batches by product and batch number;
+    batches that do not exist yet are created with the received quantity.
+    Lines with a zero quantity are ignored. Raises ValueError, posting
+    nothing, when the purchase order is closed or a line would receive more
+    than is outstanding on it, or a line's expiry date contradicts the batch
+    it lands in.
+    """
+    lines = [line for line in lines if line.quantity > 0]
+    if not lines:
+        raise ValueError("A delivery needs at least one line with a quantity.")
+
+    now = timezone.now()
+    with transaction.atomic():
+        if purchase_order is not None:
+            purchase_order = _lock_order(purchase_order, lines)
+        receipt = GoodsReceipt.objects.create(
+            supplier=supplier, purchase_order=purchase_order, reference=reference,
+            notes=notes, received_by=user, received_at=now,
+        )
+
+        batches = {
+            (m.product_id, m.batch_number): m
+            for m in Medicine.objects.select_for_update().filter(
+                product__in={line.product.pk for line in lines},
+                batch_number__in={line.batch_number for line in lines},
+            )
+        }
+
+        # New batches are inserted with their received quantity; existing ones
+        # are incremented. Several lines may land in the same batch.
+        new_batches = {}
+        increments = {}
+        for line in lines:
+            key = (line.product.pk, line.batch_number)
+            batch = batches.get(key) or new_batches.get(key)
+            if batch is None:
+                product = line.product
+                batch = Medicine(
+                    code=f"GR{receipt.pk:06d}-{len(new_batches) + 1:03d}",
+                    name=product.name, dosage_form=product.dosage_form, strength=product.strength,
+                    unit=product.unit, category=product.category,
+                    prescription_only=product.prescription_only,
+                    batch_number=line.batch_number, lot_number=line.lot_number,
+                    expires_on=line.expires_on, date_received=now.date(),
+                    product=product, supplier=supplier, quantity_on_hand=0,
+                )
+                new_batches[key] = batch
+            elif line.expires_on and line.expires_on != batch.expires_on:
+                # One batch number has one expiry date; a different one is a data entry error
+                expires = batch.expires_on.isoformat() if batch.expires_on else "no expiry date"
+                raise ValueError(
+                    f"Batch {line.batch_number} of {line.product} is recorded with {expires}, "
+                    f"not {line.expires_on.isoformat()}."
+                )
+            if key in new_batches:
+                batch.quantity_on_hand += line.quantity
+            else:
+                increments[batch.pk] = increments.get(batch.pk, 0) + line.quantity
+
+        for batch in new_batches.values():
+            batch.refresh_status()
+        Medicine.objects.bulk_create(new_batches.values())
+
+        if increments:
+            Medicine.objects.filter(pk__in=increments).update(
+                quantity_on_hand=F('quantity_on_hand') + _increments(increments),
+                status=Case(
+                    When(Q(status=Medicine.STATUS_OUT_OF_STOCK, expires_on__lte=now.date()),
+                         then=Value(Medicine.STATUS_EXPIRED)),
+                    When(status=Medicine.STATUS_OUT_OF_STOCK, then=Value(Medicine.STATUS_ACTIVE)),
+                    default=F('status'),
+                ),
+                updated_at=now,
+            )
+
+        product_quantities, product_batches = {}, {}
+        for line in lines:
+            product_quantities[line.product.pk] = product_quantities.get(line.product.pk, 0) + line.quantity
+        for batch in new_batches.values():
+            product_batches[batch.product_id] = product_batches.get(batch.product_id, 0) + 1
+        MedicineProduct.objects.filter(pk__in=product_quantities).update(
+            quantity_on_hand=F('quantity_on_hand') + _increments(product_quantities),
+            batch_count=F('batch_count') + _increments(product_batches),
+            updated_at=now,
+        )
+
+        receipt_lines = []
+        movements = []
+        for line in lines:
+            key = (line.product.pk, line.batch_number)
+            batch = batches.get(key) or new_batches[key]
+            receipt_lines.append(GoodsReceiptLine(
+                receipt=receipt, order_line=line.order_line, medicine=batch,
+                quantity=line.quantity, created_batch=key in new_batches,
+            ))
+            movements.append(StockMovement(
+                medicine=batch, movement_type=StockMovement.MOVEMENT_IN, quantity=line.quantity,
+                reason=f"Received from {supplier.name}", reference=receipt.movement_reference,
+                performed_by=user, performed_at=now,
+            ))
+        GoodsReceiptLine.objects.bulk_create(receipt_lines)
+        StockMovement.objects.bulk_create(movements)
+
+        received = {}
+        for line in lines:
+            if line.order_line is not None:
+                received[line.order_line.pk] = received.get(line.order_line.pk, 0) + line.quantity
+        if received:
+            PurchaseOrderLine.objects.filter(pk__in=received).update(
+                quantity_received=F('quantity_received') + _increments(received)
+            )
+        if purchase_order is not None:
+            outstanding = purchase_order.lines.filter(quantity_received__lt=F('quantity_ordered')).exists()
+            purchase_order.status = PurchaseOrder.STATUS_PARTIAL if outstanding else PurchaseOrder.STATUS_RECEIVED
+            PurchaseOrder.objects.filter(pk=purchase_order.pk).update(status=purchase_order.status, updated_at=now)
+
+        reason = f"Goods receipt {receipt.movement_reference} from {supplier.name}"
+        with AuditRecorder(user, request) as audit:
+            for batch in new_batches.values():
+                audit.add(batch, MedicineAuditLog.ACTION_CREATE, reason=reason)
+            for batch in batches.values():
+                if batch.pk not in increments:
+                    continue
+                # quantity_on_hand is the locked value read before the increment
+                audit.add(batch, MedicineAuditLog.ACTION_STOCK_ADD, field_name='quantity_on_hand',
+                          old_value=batch.quantity_on_hand,
+                          new_value=batch.quantity_on_hand + increments[batch.pk], reason=reason)
+
+    # Autocomplete results and dashboard widgets show quantities, so any receipt invalidates them
+    search.bump_version()
+    return receipt
@@ -0,0 +1,192 @@
+"""
+Indexed medicine search.
+
+PostgreSQL: the dashboard's ``icontains`` predicates are served by pg_trgm GIN
+indexes on UPPER(column) (see migration 0003), so the OR'ed filter stays an
+index scan.
+
+SQLite: a trigram FTS5 table mirrors the searchable columns and is kept in sync
+by triggers; matches are resolved through it instead of five LIKE scans.
+
+Any other backend (or SQLite without FTS5) falls back to plain ``icontains``.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from main import invalidation
+
+from .models import Medicine
+
+SEARCH_FIELDS = ('name', 'brand_name', 'category', 'batch_number', 'manufacturer')
+FTS_TABLE = 'inventory_meds_medicine_fts'
+
+# FTS5's trigram tokenizer cannot match terms shorter than three characters
+MIN_TRIGRAM_LENGTH = 3
+
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+AUTOCOMPLETE_CACHE_SECONDS = 60
+VERSION_CACHE_KEY = 'medicine-search:version'
+
+FTS_TRIGGERS = ('ai', 'ad', 'au')
+
+_fts_ready = {}
+
+
+def normalize(term):
+    return ' '.join((term or '').split()).lower()
+
+
+def fts_available(using=None):
+    """True when the SQLite FTS5 mirror table and its sync triggers exist"""
+    alias = using or connection.alias
+    if alias not in _fts_ready:
+        conn = connections[alias]
+        ready = False
+        if conn.vendor == 'sqlite':
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT COUNT(*) FROM sqlite_master WHERE name = %s "
+                    "OR (type = 'trigger' AND name LIKE %s)",
+                    [FTS_TABLE, f'{FTS_TABLE}_%'],
+                )
+                # Table remakes on ALTER drop triggers; fall back rather than go stale
+                ready = cursor.fetchone()[0] == 1 + len(FTS_TRIGGERS)
+        _fts_ready[alias] = ready
+    return _fts_ready[alias]
+
+
+def install_search_index(conn):
+    """
+    Create (or repair) the search index for `conn`'s backend. Idempotent.
+
+    Run by migration 0003 and `manage.py rebuild_search_index`; re-run after any
+    SQLite migration that remakes the medicine table, since that drops triggers.
+    """
+    _fts_ready.pop(conn.alias, None)
+    with conn.cursor() as cursor:
+        if conn.vendor == 'postgresql':
+            # Trigram GIN indexes matching Django's icontains SQL: UPPER(col::text) LIKE UPPER(%s)
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for column in SEARCH_FIELDS:
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS inventory_meds_medicine_{column}_trgm '
+                    f'ON inventory_meds_medicine USING gin ((UPPER("{column}"::text)) gin_trgm_ops)'
+                )
+        elif conn.vendor == 'sqlite':
+            columns = ', '.join(SEARCH_FIELDS)
+            new_values = ', '.join(f'new.{c}' for c in SEARCH_FIELDS)
+            old_values = ', '.join(f'old.{c}' for c in SEARCH_FIELDS)
+            try:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({columns}, "
+                    f"content='inventory_meds_medicine', content_rowid='id', tokenize='trigram')"
+                )
+            except Exception:
+                # SQLite built without FTS5 (or < 3.34): search falls back to icontains
+                return False
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON inventory_meds_medicine BEGIN "
+                f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON inventory_meds_medicine BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) "
+                f"VALUES ('delete', old.id, {old_values}); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {columns} "
+                f"ON inventory_meds_medicine BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) "
+                f"VALUES ('delete', old.id, {old_values}); "
+                f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END"
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        else:
+            return False
+    return True
+
+
+def drop_search_index(conn):
+    _fts_ready.pop(conn.alias, None)
+    with conn.cursor() as cursor:
+        if conn.vendor == 'postgresql':
+            for column in SEARCH_FIELDS:
+                cursor.execute(f'DROP INDEX IF EXISTS inventory_meds_medicine_{column}_trgm')
+        elif conn.vendor == 'sqlite':
+            for suffix in FTS_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def _icontains_q(term):
+    q = Q()
+    for field in SEARCH_FIELDS:
+        q |= Q(**{f'{field}__icontains': term})
+    return q
+
+
+def search_medicines(queryset, term):
+    """Filter a Medicine queryset down to rows matching `term` in any search field"""
+    term = ' '.join((term or '').split())
+    if not term:
+        return queryset
+
+    if fts_available(queryset.db) and len(term) >= MIN_TRIGRAM_LENGTH:
+        phrase = '"{}"'.format(term.replace('"', '""'))
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [phrase])
+        )
+    return queryset.filter(_icontains_q(term))
+
+
+def ranked(queryset, term):
+    """Order matches: name prefix, brand prefix, other name hits, then the rest"""
+    return queryset.annotate(
+        search_rank=Case(
+            When(name__istartswith=term, then=Value(0)),
+            When(brand_name__istartswith=term, then=Value(1)),
+            When(name__icontains=term, then=Value(2)),
+            default=Value(3),
+            output_field=IntegerField(),
+        )
+    ).order_by('search_rank', 'name', 'expires_on', 'id')
+
+
+def search_version():
+    return cache.get_or_set(VERSION_CACHE_KEY, 1, None)
+
+
+def bump_version():
+    """Invalidate every cached autocomplete result, and L1 copies in every worker"""
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, 1, None)
+    invalidation.bump('medicine')
+
+
+def autocomplete(term, limit=AUTOCOMPLETE_LIMIT):
+    """Top-`limit` ranked suggestions for `term`, cached per normalized prefix"""
+    term = normalize(term)
+    limit = max(1, min(int(limit), AUTOCOMPLETE_MAX_LIMIT))
+    if not term:
+        return []
+
+    digest = hashlib.md5(term.encode('utf-8')).hexdigest()
+    cache_key = f'medicine-search:{search_version()}:{limit}:{digest}'
+    results = cache.get(cache_key)
+    if results is not None:
+        return results
+
+    medicines = ranked(search_medicines(Medicine.objects.all(), term), term).values(
+        'id', 'code', 'name', 'brand_name', 'strength', 'dosage_form',
+        'category', 'batch_number', 'quantity_on_hand', 'status',
+    )[:limit]
+    results = list(medicines)
+    cache.set(cache_key, results, AUTOCOMPLETE_CACHE_SECONDS)
+    return results
@@ -0,0 +1,25 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from main import changefeed
+
+from .models import Medicine
+from . import search
+
+
+@receiver(post_save, sender=Medicine)
+@receiver(post_delete, sender=Medicine)
+def invalidate_medicine_search(sender, instance, **kwargs):
+    """Drop cached autocomplete results whenever a medicine changes"""
+    search.bump_version()
+
+
+@receiver(post_save, sender=Medicine)
+def publish_low_stock(sender, instance, created, **kwargs):
+    """Push a batch dropping to its reorder level to open dashboards"""
+    # Medicine.save() sets _tracked to the stored row it replaced
+    tracked = getattr(instance, '_tracked', None)
+    if created or tracked is None:
+        return
+    if changefeed.crossed_reorder_level(tracked[1], instance.quantity_on_hand, instance.reorder_level):
+        changefeed.stock_low(instance)
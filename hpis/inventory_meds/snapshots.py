@@ -0,0 +1,93 @@
+"""
+Daily inventory metrics.
+
+`inventory_metrics` computes the dashboard counts in a single aggregate pass
+over the medicine table. `take_snapshot` stores them (plus per-category
+quantities) as one InventorySnapshot row per day, and `trend_series` reads a
+date range of those rows back as chart-ready lists.
+"""
+from datetime import timedelta
+
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import InventorySnapshot, Medicine
+
+EXPIRING_SOON_DAYS = 30
+VALID_STOCK_DAYS = 90
+DEFAULT_TREND_DAYS = 30
+MAX_TREND_DAYS = 366
+# Categories beyond this many are folded into "Other" in the trend chart
+TREND_CATEGORY_LIMIT = 6
+
+
+def inventory_metrics(today=None):
+    """Current inventory counts, all from one aggregate query"""
+    today = today or timezone.now().date()
+    soon = today + timedelta(days=EXPIRING_SOON_DAYS)
+    return Medicine.objects.aggregate(
+        total_medicines=Count('id'),
+        active_count=Count('id', filter=Q(status=Medicine.STATUS_ACTIVE, quantity_on_hand__gt=0)),
+        total_quantity=Coalesce(Sum('quantity_on_hand'), 0),
+        low_stock_count=Count('id', filter=Q(quantity_on_hand__lte=F('reorder_level'), quantity_on_hand__gt=0)),
+        out_of_stock_count=Count('id', filter=Q(quantity_on_hand=0)),
+        expired_count=Count('id', filter=Q(expires_on__lt=today)),
+        expiring_soon_count=Count('id', filter=Q(expires_on__gte=today, expires_on__lte=soon)),
+        valid_stock=Count('id', filter=Q(expires_on__gt=today + timedelta(days=VALID_STOCK_DAYS))),
+    )
+
+
+def category_quantities():
+    """{category: total quantity on hand}"""
+    rows = (
+        Medicine.objects.values_list('category')
+        .annotate(quantity=Coalesce(Sum('quantity_on_hand'), 0))
+        .order_by()
+    )
+    return {category or 'Uncategorized': quantity for category, quantity in rows}
+
+
+def take_snapshot(date=None):
+    """Record (or overwrite) the snapshot for `date`, default today"""
+    date = date or timezone.now().date()
+    metrics = inventory_metrics(date)
+    metrics.pop('valid_stock')
+    snapshot, _ = InventorySnapshot.objects.update_or_create(
+        date=date,
+        defaults={**metrics, 'category_quantities': category_quantities()},
+    )
+    return snapshot
+
+
+def trend_series(start, end):
+    """Chart data for snapshots between `start` and `end` inclusive"""
+    snapshots = list(
+        InventorySnapshot.objects.filter(date__gte=start, date__lte=end).order_by('date').values(
+            'date', 'total_quantity', 'low_stock_count', 'out_of_stock_count',
+            'expired_count', 'expiring_soon_count', 'category_quantities',
+        )
+    )
+
+    # Chart the categories that are largest in the most recent snapshot
+    latest = snapshots[-1]['category_quantities'] if snapshots else {}
+    categories = sorted(latest, key=latest.get, reverse=True)[:TREND_CATEGORY_LIMIT]
+    category_series = {category: [] for category in categories}
+    other = []
+    for snapshot in snapshots:
+        quantities = snapshot['category_quantities'] or {}
+        for category in categories:
+            category_series[category].append(quantities.get(category, 0))
+        other.append(sum(q for c, q in quantities.items() if c not in category_series))
+    if any(other):
+        category_series['Other'] = other
+
+    return {
+        'trend_dates': [s['date'].isoformat() for s in snapshots],
+        'trend_total_quantity': [s['total_quantity'] for s in snapshots],
+        'trend_low_stock': [s['low_stock_count'] for s in snapshots],
+        'trend_out_of_stock': [s['out_of_stock_count'] for s in snapshots],
+        'trend_expired': [s['expired_count'] for s in snapshots],
+        'trend_expiring_soon': [s['expiring_soon_count'] for s in snapshots],
+        'trend_categories': category_series,
+    }
@@ -0,0 +1,728 @@
+import datetime
+import gzip
+import importlib
+import io
+import json
+import math
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from inventory_meds import archive, forecasting, search, snapshots
+from inventory_meds.allocation import InsufficientStock, allocate_fefo
+from inventory_meds.archive import archive_before, search_archive
+from inventory_meds.audit import AuditRecorder, field_history
+from inventory_meds.exports import ROWS_PER_WRITE
+from inventory_meds.importer import import_catalogue
+from inventory_meds.models import (
+    GoodsReceipt, InventorySnapshot, Medicine, MedicineAuditLog, MedicineProduct, PurchaseOrder, PurchaseOrderLine, StockForecast, StockMovement,
+    Supplier,
+)
+from inventory_meds.receiving import ReceiptLine, receive_delivery
+
+
+def make_batch(batch_number, quantity, expires_in_days=None, **fields):
+    today = timezone.now().date()
+    values = {
+        'code': f'PCM-{batch_number}',
+        'name': 'Paracetamol',
+        'dosage_form': 'Tablet',
+        'strength': '500mg',
+        'batch_number': batch_number,
+        'quantity_on_hand': quantity,
+        'expires_on': today + datetime.timedelta(days=expires_in_days) if expires_in_days is not None else None,
+    }
+    return Medicine.objects.create(**{**values, **fields})
+
+
+class ProductTotalsTests(TestCase):
+    def test_batches_share_one_product_and_its_totals(self):
+        first = make_batch('A', 10, 30)
+        second = make_batch('B', 5, 60)
+
+        product = MedicineProduct.objects.get()
+        self.assertEqual(first.product_id, product.pk)
+        self.assertEqual(second.product_id, product.pk)
+        self.assertEqual((product.quantity_on_hand, product.batch_count), (15, 2))
+
+    def test_save_and_delete_adjust_totals(self):
+        batch = make_batch('A', 10, 30)
+        make_batch('B', 5, 60)
+
+        batch.quantity_on_hand = 4
+        batch.save()
+        self.assertEqual(MedicineProduct.objects.get().quantity_on_hand, 9)
+
+        batch.delete()
+        product = MedicineProduct.objects.get()
+        self.assertEqual((product.quantity_on_hand, product.batch_count), (5, 1))
+
+    def test_saves_from_stale_copies_keep_totals_in_step(self):
+        make_batch('A', 10, 30)
+        first = Medicine.objects.get(batch_number='A')
+        second = Medicine.objects.get(batch_number='A')
+
+        first.quantity_on_hand = 5
+        first.save()
+        second.quantity_on_hand = 8
+        second.save()
+
+        self.assertEqual(Medicine.objects.get(batch_number='A').quantity_on_hand, 8)
+        self.assertEqual(MedicineProduct.objects.get().quantity_on_hand, 8)
+
+    def test_refresh_totals_recomputes_from_batches(self):
+        make_batch('A', 10, 30)
+        product = MedicineProduct.objects.get()
+        MedicineProduct.objects.filter(pk=product.pk).update(quantity_on_hand=0, batch_count=0)
+
+        MedicineProduct.refresh_totals([product.pk])
+
+        product.refresh_from_db()
+        self.assertEqual((product.quantity_on_hand, product.batch_count), (10, 1))
+
+
+class AllocateFefoTests(TestCase):
+    def setUp(self):
+        self.late = make_batch('LATE', 10, 90)
+        self.early = make_batch('EARLY', 4, 10)
+        self.undated = make_batch('UNDATED', 10)
+        self.expired = make_batch('EXPIRED', 50, -1)
+        self.product = MedicineProduct.objects.get()
+
+    def test_takes_earliest_expiry_first(self):
+        allocations = allocate_fefo(self.product, 6)
+
+        self.assertEqual(
+            [(a.batch.batch_number, a.quantity) for a in allocations],
+            [('EARLY', 4), ('LATE', 2)],
+        )
+        self.early.refresh_from_db()
+        self.late.refresh_from_db()
+        self.assertEqual((self.early.quantity_on_hand, self.early.status), (0, Medicine.STATUS_OUT_OF_STOCK))
+        self.assertEqual(self.late.quantity_on_hand, 8)
+
+    def test_undated_batches_go_last_and_expired_never(self):
+        allocations = allocate_fefo(self.product, 20)
+
+        self.assertEqual([a.batch.batch_number for a in allocations], ['EARLY', 'LATE', 'UNDATED'])
+        self.expired.refresh_from_db()
+        self.assertEqual(self.expired.quantity_on_hand, 50)
+
+    def test_adjusts_product_total(self):
+        before = MedicineProduct.objects.get().quantity_on_hand
+
+        allocate_fefo(self.product, 6)
+
+        self.assertEqual(MedicineProduct.objects.get().quantity_on_hand, before - 6)
+
+    def test_reserved_units_are_not_dispensed(self):
+        Medicine.objects.filter(pk=self.early.pk).update(quantity_reserved=3)
+
+        allocations = allocate_fefo(self.product, 2)
+
+        self.assertEqual([(a.batch.batch_number, a.quantity) for a in allocations], [('EARLY', 1), ('LATE', 1)])
+
+    def test_insufficient_stock_changes_nothing(self):
+        with self.assertRaises(InsufficientStock) as raised:
+            allocate_fefo(self.product, 25)
+
+        self.assertEqual(raised.exception.available, 24)
+        self.early.refresh_from_db()
+        self.assertEqual(self.early.quantity_on_hand, 4)
+
+    def test_autocomplete_shows_the_dispensed_stock(self):
+        cache.clear()
+        before = {row['batch_number']: row['quantity_on_hand'] for row in search.autocomplete('paracetamol')}
+
+        allocate_fefo(self.product, 6)
+
+        after = {row['batch_number']: row['quantity_on_hand'] for row in search.autocomplete('paracetamol')}
+        self.assertEqual((before['EARLY'], before['LATE']), (4, 10))
+        self.assertEqual((after['EARLY'], after['LATE']), (0, 8))
+
+    def test_rejects_non_positive_quantity(self):
+        with self.assertRaises(ValueError):
+            allocate_fefo(self.product, 0)
+
+
+def csv_upload(text):
+    return io.BytesIO(text.encode('utf-8'))
+
+
+class CatalogueImportTests(TestCase):
+    HEADER = 'Code,Generic Name,Form,Strength,Batch No,Qty,Expiry,Rx,Supplier\n'
+
+    def run_import(self, rows, **options):
+        return import_catalogue(csv_upload(self.HEADER + rows), 'catalogue.csv', **options)
+
+    def test_creates_batches_products_and_suppliers(self):
+        summary = self.run_import(
+            'AMX-1,Amoxicillin,Capsule,500mg,B1,100,2030-01-31,yes,MedSupply\n'
+            'AMX-2,Amoxicillin,Capsule,500mg,B2,50,2030-06-30,yes,MedSupply\n'
+        )
+
+        self.assertEqual((summary.created, summary.rejected), (2, 0))
+        first = Medicine.objects.get(code='AMX-1')
+        self.assertEqual(first.expires_on, datetime.date(2030, 1, 31))
+        self.assertTrue(first.prescription_only)
+        self.assertEqual(first.supplier, Supplier.objects.get(name='MedSupply'))
+        product = MedicineProduct.objects.get()
+        self.assertEqual((product.quantity_on_hand, product.batch_count), (150, 2))
+        self.assertEqual(StockMovement.objects.filter(movement_type=StockMovement.MOVEMENT_IN).count(), 2)
+
+    def test_reimport_updates_by_code_and_records_the_adjustment(self):
+        self.run_import('AMX-1,Amoxicillin,Capsule,500mg,B1,100,2030-01-31,yes,\n')
+
+        summary = self.run_import(
+            'AMX-1,Amoxicillin,Capsule,500mg,B1,80,2030-01-31,yes,\n'
+        )
+
+        self.assertEqual((summary.created, summary.updated), (0, 1))
+        self.assertEqual(Medicine.objects.get(code='AMX-1').quantity_on_hand, 80)
+        self.assertEqual(MedicineProduct.objects.get().quantity_on_hand, 80)
+        adjustment = StockMovement.objects.get(movement_type=StockMovement.MOVEMENT_ADJUST)
+        self.assertEqual(adjustment.quantity, -20)
+
+    def test_unchanged_rows_and_update_existing_off(self):
+        row = 'AMX-1,Amoxicillin,Capsule,500mg,B1,100,2030-01-31,yes,\n'
+        self.run_import(row)
+
+        self.assertEqual(self.run_import(row).unchanged, 1)
+        summary = self.run_import(row.replace(',100,', ',5,'), update_existing=False)
+        self.assertEqual((summary.updated, summary.unchanged), (0, 1))
+        self.assertEqual(Medicine.objects.get().quantity_on_hand, 100)
+
+    def test_rejects_invalid_and_duplicate_rows_with_line_numbers(self):
+        summary = self.run_import(
+            'AMX-1,Amoxicillin,Capsule,500mg,B1,100,2030-01-31,yes,\n'
+            'AMX-2,Amoxicillin,Capsule,500mg,B2,-5,2030-01-31,yes,\n'
+            'AMX-1,Amoxicillin,Capsule,500mg,B3,10,2030-01-31,yes,\n'
+            ',Ibuprofen,Tablet,200mg,B9,10,,no,\n'
+        )
+
+        self.assertEqual((summary.created, summary.rejected), (1, 3))
+        lines = dict(summary.errors)
+        self.assertIn('quantity_on_hand', lines[3])
+        self.assertEqual(lines[4], 'duplicate of line 2')
+        self.assertEqual(lines[5], 'code: required for new medicines')
+
+    def test_dry_run_writes_nothing(self):
+        summary = self.run_import('AMX-1,Amoxicillin,Capsule,500mg,B1,100,2030-01-31,yes,\n', dry_run=True)
+
+        self.assertEqual(summary.created, 1)
+        self.assertFalse(Medicine.objects.exists())
+        self.assertFalse(MedicineProduct.objects.exists())
+
+
+class ReceiveDeliveryTests(TestCase):
+    def setUp(self):
+        self.supplier = Supplier.objects.create(name='MedSupply')
+        self.existing = make_batch('A', 10, 90, supplier=self.supplier)
+        self.product = MedicineProduct.objects.get()
+        self.order = PurchaseOrder.objects.create(reference='PO-1', supplier=self.supplier)
+        self.order_line = PurchaseOrderLine.objects.create(order=self.order, product=self.product, quantity_ordered=30)
+        self.expiry = self.existing.expires_on
+
+    def line(self, quantity, batch_number, expires_on=None, order_line=None):
+        return ReceiptLine(self.product, quantity, batch_number=batch_number, expires_on=expires_on,
+                           order_line=order_line)
+
+    def test_adds_to_existing_batches_and_creates_new_ones(self):
+        later = self.expiry + datetime.timedelta(days=30)
+        receipt = receive_delivery(self.supplier, [
+            self.line(5, 'A', self.expiry), self.line(7, 'NEW', later), self.line(3, 'NEW', later),
+        ])
+
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.quantity_on_hand, 15)
+        created = Medicine.objects.get(batch_number='NEW')
+        self.assertEqual((created.quantity_on_hand, created.expires_on), (10, later))
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity_on_hand, self.product.batch_count), (25, 2))
+        self.assertEqual(receipt.lines.count(), 3)
+        self.assertEqual(
+            StockMovement.objects.filter(reference=receipt.movement_reference).count(), 3
+        )
+
+    def test_partial_then_full_receipt_of_an_order(self):
+        receive_delivery(self.supplier, [self.line(10, 'A', order_line=self.order_line)], purchase_order=self.order)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, PurchaseOrder.STATUS_PARTIAL)
+
+        receive_delivery(self.supplier, [self.line(20, 'A', order_line=self.order_line)], purchase_order=self.order)
+        self.order.refresh_from_db()
+        self.order_line.refresh_from_db()
+        self.assertEqual(self.order.status, PurchaseOrder.STATUS_RECEIVED)
+        self.assertEqual(self.order_line.quantity_received, 30)
+
+    def test_refuses_more_than_outstanding(self):
+        receive_delivery(self.supplier, [self.line(25, 'A', order_line=self.order_line)], purchase_order=self.order)
+
+        with self.assertRaisesMessage(ValueError, 'Only 5'):
+            receive_delivery(self.supplier, [self.line(6, 'A', order_line=self.order_line)], purchase_order=self.order)
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.quantity_on_hand, 35)
+
+    def test_refuses_closed_orders_read_before_they_closed(self):
+        stale = PurchaseOrder.objects.get(pk=self.order.pk)
+        PurchaseOrder.objects.filter(pk=self.order.pk).update(status=PurchaseOrder.STATUS_CANCELLED)
+
+        with self.assertRaisesMessage(ValueError, 'is cancelled'):
+            receive_delivery(self.supplier, [self.line(5, 'A', order_line=self.order_line)], purchase_order=stale)
+        self.assertFalse(GoodsReceipt.objects.exists())
+
+    def test_refuses_a_conflicting_expiry_date(self):
+        other = self.expiry + datetime.timedelta(days=1)
+
+        with self.assertRaisesMessage(ValueError, 'Batch A'):
+            receive_delivery(self.supplier, [self.line(5, 'A', other)])
+        with self.assertRaisesMessage(ValueError, 'Batch NEW'):
+            receive_delivery(self.supplier, [self.line(5, 'NEW', self.expiry), self.line(5, 'NEW', other)])
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.quantity_on_hand, 10)
+        self.assertFalse(Medicine.objects.filter(batch_number='NEW').exists())
+
+
+class CsvExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('pharmacist', password='x')
+        for number in range(ROWS_PER_WRITE + 1):
+            make_batch(f'B{number:04d}', 1)
+        self.url = reverse('inventory_meds:export_csv')
+
+    def assert_full_export(self, body):
+        lines = body.decode('utf-8').splitlines()
+        self.assertEqual(len(lines), ROWS_PER_WRITE + 2)
+        self.assertTrue(lines[0].startswith('Code,Name'))
+        self.assertTrue(lines[-1].startswith(f'PCM-B{ROWS_PER_WRITE:04d},Paracetamol'))
+
+    def test_streams_synchronously_under_wsgi(self):
+        self.client.force_login(self.user)
+
+        response = self.client.get(self.url)
+
+        self.assertFalse(response.is_async)
+        self.assert_full_export(b''.join(response.streaming_content))
+
+    async def test_streams_chunk_by_chunk_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+
+        response = await self.async_client.get(self.url, {'gzip': '1'}, headers={'Accept-Encoding': 'gzip'})
+
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertGreater(len(chunks), 1)
+        self.assert_full_export(gzip.decompress(b''.join(chunks)))
+
+
+class MedicineSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.batch = make_batch('LOT-7', 10, 30, brand_name='Biogesic', manufacturer='Unilab')
+
+    def search(self, term):
+        with CaptureQueriesContext(connection) as queries:
+            found = list(search.search_medicines(Medicine.objects.all(), term).values_list('batch_number', flat=True))
+        return found, queries[-1]['sql']
+
+    def test_short_terms_use_icontains_and_longer_ones_the_index(self):
+        found, sql = self.search('bi')
+        self.assertEqual(found, ['LOT-7'])
+        self.assertNotIn('MATCH', sql)
+
+        found, sql = self.search('  gesic ')
+        self.assertEqual(found, ['LOT-7'])
+        if search.fts_available():
+            self.assertIn('MATCH', sql)
+
+    def test_quotes_in_terms_are_matched_literally(self):
+        self.assertEqual(self.search('"bio')[0], [])
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        if not search.fts_available():
+            self.skipTest('SQLite without FTS5')
+        other = make_batch('LOT-8', 5, 60, manufacturer='Pascual')
+        self.assertEqual(self.search('pascual')[0], ['LOT-8'])
+
+        Medicine.objects.filter(pk=other.pk).update(manufacturer='Ritemed')
+        self.assertEqual(self.search('pascual')[0], [])
+        self.assertEqual(self.search('ritemed')[0], ['LOT-8'])
+
+        other.delete()
+        self.assertEqual(self.search('ritemed')[0], [])
+
+    def test_rebuild_repairs_a_dropped_index(self):
+        if not search.fts_available():
+            self.skipTest('SQLite without FTS5')
+        search.drop_search_index(connection)
+        try:
+            self.assertFalse(search.fts_available())
+            found, sql = self.search('unilab')
+            self.assertEqual(found, ['LOT-7'])
+            self.assertNotIn('MATCH', sql)
+
+            call_command('rebuild_search_index', stdout=io.StringIO())
+
+            found, sql = self.search('unilab')
+            self.assertEqual(found, ['LOT-7'])
+            self.assertIn('MATCH', sql)
+        finally:
+            search.install_search_index(connection)
+
+    def test_autocomplete_is_cached_until_a_medicine_changes(self):
+        self.assertEqual([row['quantity_on_hand'] for row in search.autocomplete('Paracetamol')], [10])
+        with self.assertNumQueries(0):
+            search.autocomplete('  PARACETAMOL ')
+
+        Medicine.objects.filter(pk=self.batch.pk).update(quantity_on_hand=3)
+        self.assertEqual([row['quantity_on_hand'] for row in search.autocomplete('paracetamol')], [10])
+
+        self.batch.refresh_from_db()
+        self.batch.save()
+        self.assertEqual([row['quantity_on_hand'] for row in search.autocomplete('paracetamol')], [3])
+
+    def test_autocomplete_ranks_name_prefixes_first(self):
+        make_batch('LOT-9', 1, 90, name='Acetaminophen', brand_name='Paracetamol Plus')
+
+        results = search.autocomplete('para')
+
+        self.assertEqual([row['name'] for row in results], ['Paracetamol', 'Acetaminophen'])
+
+
+def dispensed(batch, quantity, days_ago):
+    """An OUT movement of `batch` at noon `days_ago` days before today"""
+    day = timezone.localdate() - datetime.timedelta(days=days_ago)
+    return StockMovement.objects.create(
+        medicine=batch, movement_type=StockMovement.MOVEMENT_OUT, quantity=quantity,
+        performed_at=timezone.make_aware(datetime.datetime.combine(day, datetime.time(12))),
+    )
+
+
+class ForecastTests(TestCase):
+    def setUp(self):
+        self.batch = make_batch('A', 100, 365)
+        self.idle = make_batch('B', 40, 365, name='Ibuprofen')
+        self.today = timezone.localdate()
+
+    def test_steady_usage_gives_stockout_and_reorder_quantity(self):
+        for days_ago in range(1, 11):
+            dispensed(self.batch, 5 if days_ago % 2 else -5, days_ago)  # stored either sign
+        dispensed(self.batch, 500, 11)  # before the window
+        dispensed(self.batch, 500, 0)  # today is not a complete day
+
+        self.assertEqual(forecasting.refresh_forecasts(window_days=10), 2)
+
+        forecast = StockForecast.objects.get(product=self.batch.product)
+        self.assertEqual((forecast.avg_daily_usage, forecast.recent_daily_usage, forecast.usage_std), (5, 5, 0))
+        self.assertEqual(forecast.days_until_stockout, 20)
+        self.assertEqual(forecast.predicted_stockout_on, self.today + datetime.timedelta(days=20))
+        # 7 lead-time days of usage; an order lifts stock to cover lead time plus the 14-day review period
+        self.assertEqual((forecast.reorder_point, forecast.suggested_order_quantity), (35, 5))
+
+        idle = StockForecast.objects.get(product=self.idle.product)
+        self.assertEqual((idle.days_until_stockout, idle.predicted_stockout_on), (None, None))
+        self.assertEqual((idle.reorder_point, idle.suggested_order_quantity), (0, 0))
+
+    def test_refresh_updates_the_existing_forecast(self):
+        dispensed(self.batch, 10, 1)
+        forecasting.refresh_forecasts(window_days=10)
+        first = StockForecast.objects.get(product=self.batch.product)
+
+        self.batch.quantity_on_hand = 3
+        self.batch.save()
+        forecasting.refresh_forecasts(window_days=10)
+
+        self.assertEqual(StockForecast.objects.count(), 2)
+        forecast = StockForecast.objects.get(product=self.batch.product)
+        self.assertEqual(forecast.pk, first.pk)
+        self.assertEqual(forecast.quantity_on_hand, 3)
+        self.assertLess(forecast.days_until_stockout, first.days_until_stockout)
+
+    def test_a_recent_surge_sets_the_rate(self):
+        usage = np.array([[0.0] * 7 + [14.0] * 7])
+
+        result = forecasting.compute_forecasts(usage, [28], lead_time=7, review_days=14, safety_factor=1.65)
+
+        std = 7 * math.sqrt(14 / 13)
+        safety_stock = 1.65 * std * math.sqrt(7)
+        self.assertEqual((result['avg_daily_usage'][0], result['recent_daily_usage'][0]), (7, 14))
+        self.assertAlmostEqual(result['usage_std'][0], std)
+        self.assertEqual(result['days_until_stockout'][0], 2)
+        self.assertEqual(result['reorder_point'][0], math.ceil(14 * 7 + safety_stock))
+        self.assertEqual(result['suggested_order_quantity'][0], math.ceil(14 * 21 + safety_stock - 28))
+
+
+class InventorySnapshotTests(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        make_batch('A', 100, 365, category='Analgesic', reorder_level=10)
+        make_batch('B', 5, 10, category='Analgesic', reorder_level=10)
+        make_batch('C', 0, -1, name='Amoxicillin', category='Antibiotic')
+
+    def test_snapshot_records_the_day_metrics(self):
+        snapshot = snapshots.take_snapshot()
+
+        self.assertEqual(snapshot.date, self.today)
+        self.assertEqual(
+            (snapshot.total_medicines, snapshot.total_quantity, snapshot.low_stock_count,
+             snapshot.out_of_stock_count, snapshot.expired_count, snapshot.expiring_soon_count),
+            (3, 105, 1, 1, 1, 1),
+        )
+        self.assertEqual(snapshot.category_quantities, {'Analgesic': 105, 'Antibiotic': 0})
+
+    def test_rerunning_the_same_day_overwrites_its_snapshot(self):
+        call_command('snapshot_inventory', stdout=io.StringIO())
+        Medicine.objects.filter(batch_number='A').update(quantity_on_hand=40)
+
+        stdout = io.StringIO()
+        call_command('snapshot_inventory', stdout=stdout)
+
+        self.assertEqual(InventorySnapshot.objects.count(), 1)
+        self.assertEqual(InventorySnapshot.objects.get().total_quantity, 45)
+        self.assertIn('45 units on hand', stdout.getvalue())
+
+    def test_trend_series_charts_the_largest_categories_and_folds_the_rest(self):
+        yesterday = self.today - datetime.timedelta(days=1)
+        InventorySnapshot.objects.create(date=yesterday, total_quantity=50,
+                                         category_quantities={'Analgesic': 30, 'Vitamin': 20})
+        snapshots.take_snapshot()
+        InventorySnapshot.objects.create(date=self.today - datetime.timedelta(days=40), total_quantity=1)
+
+        with mock.patch.object(snapshots, 'TREND_CATEGORY_LIMIT', 1):
+            trends = snapshots.trend_series(yesterday, self.today)
+
+        self.assertEqual(trends['trend_dates'], [yesterday.isoformat(), self.today.isoformat()])
+        self.assertEqual(trends['trend_total_quantity'], [50, 105])
+        self.assertEqual(trends['trend_categories'], {'Analgesic': [30, 105], 'Other': [20, 0]})
+
+    def test_trend_series_without_snapshots_is_empty(self):
+        trends = snapshots.trend_series(self.today, self.today)
+
+        self.assertEqual((trends['trend_dates'], trends['trend_categories']), ([], {}))
+
+
+# The dashboard runs its queries concurrently on other connections, which
+# SQLite would block behind TestCase's open transaction
+class ReportsDashboardTrendTests(TransactionTestCase):
+    def test_ajax_refresh_returns_the_trend_series(self):
+        today = timezone.localdate()
+        make_batch('A', 100, 365, category='Analgesic')
+        snapshots.take_snapshot()
+        self.client.force_login(User.objects.create_user('pharmacist'))
+
+        response = self.client.get(
+            reverse('inventory_meds:reports_dashboard'),
+            {'start_date': (today - datetime.timedelta(days=7)).isoformat(), 'end_date': today.isoformat()},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+
+        data = response.json()
+        self.assertEqual(data['trend_dates'], [today.isoformat()])
+        self.assertEqual(data['trend_total_quantity'], [100])
+        self.assertEqual(data['total_medicines'], 1)
+
+
+class MedicineAuditTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('pharmacist', password='x')
+        self.medicine = make_batch('A', 10, expires_in_days=90, reorder_level=5)
+
+    def record_edit(self, reason='', **values):
+        old_values = {name: getattr(self.medicine, name) for name in values}
+        for name, value in values.items():
+            setattr(self.medicine, name, value)
+        self.medicine.save()
+        with AuditRecorder(self.user.profile) as audit:
+            return audit.record_changes(self.medicine, old_values, reason=reason)
+
+    def test_an_edit_is_one_row_holding_only_the_changed_fields(self):
+        entry = self.record_edit(quantity_on_hand=12, reorder_level=5, category='Analgesic')
+
+        log = MedicineAuditLog.objects.get()
+        self.assertEqual(log.pk, entry.pk)
+        self.assertEqual(log.action, MedicineAuditLog.ACTION_UPDATE)
+        self.assertEqual(log.changes, {'quantity_on_hand': [10, 12], 'category': ['', 'Analgesic']})
+        self.assertEqual(log.field_name, '')
+
+    def test_an_edit_that_changes_nothing_writes_nothing(self):
+        self.assertIsNone(self.record_edit(quantity_on_hand=10))
+        self.assertFalse(MedicineAuditLog.objects.exists())
+
+    def test_field_history_reads_one_field_out_of_the_diffs_newest_first(self):
+        self.record_edit(quantity_on_hand=12, reorder_level=8)
+        self.record_edit(category='Analgesic')
+        self.record_edit(reorder_level=3, reason='Slow mover')
+
+        history = field_history(self.medicine, 'reorder_level')
+
+        self.assertEqual([(old, new) for _, old, new in history], [(8, 3), (5, 8)])
+        self.assertEqual(history[0][0].reason, 'Slow mover')
+        self.assertEqual(len(field_history(self.medicine, 'reorder_level', limit=1)), 1)
+
+    def test_the_medicine_page_shows_the_chosen_fields_history(self):
+        self.record_edit(reorder_level=8, reason='Flu season')
+        self.client.force_login(self.user)
+        url = reverse('inventory_meds:view_medicine', args=[self.medicine.pk])
+
+        response = self.client.get(url, {'history': 'reorder_level'})
+
+        self.assertEqual(response.context['history_field'], 'reorder_level')
+        self.assertEqual([(old, new) for _, old, new in response.context['field_changes']], [(5, 8)])
+        self.assertContains(response, 'Flu season')
+        response = self.client.get(url, {'history': 'notes'})
+        self.assertEqual(response.context['history_field'], 'quantity_on_hand')
+        self.assertContains(response, 'No changes recorded.')
+
+    def test_backfill_copies_legacy_single_field_rows_into_the_diff(self):
+        legacy = MedicineAuditLog.objects.create(
+            medicine=self.medicine, action=MedicineAuditLog.ACTION_STOCK_ADD,
+            field_name='quantity_on_hand', old_value='10', new_value='15',
+        )
+        archived = MedicineAuditLog.objects.create(medicine=self.medicine, action=MedicineAuditLog.ACTION_ARCHIVE)
+        current = self.record_edit(reorder_level=8)
+        migration = importlib.import_module('inventory_meds.migrations.0007_medicineauditlog_changes')
+
+        migration.backfill_changes(apps, None)
+
+        legacy.refresh_from_db()
+        archived.refresh_from_db()
+        current.refresh_from_db()
+        self.assertEqual(legacy.changes, {'quantity_on_hand': ['10', '15']})
+        self.assertEqual(archived.changes, {})
+        self.assertEqual(current.changes, {'reorder_level': [5, 8]})
+        self.assertEqual([(old, new) for _, old, new in field_history(self.medicine, 'quantity_on_hand')], [('10', '15')])
+
+
+class AuditArchiveTests(TestCase):
+    def setUp(self):
+        self.root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.medicine = make_batch('A', 10)
+        self.day = timezone.now() - datetime.timedelta(days=400)
+        self.cutoff = timezone.now() - datetime.timedelta(days=365)
+
+    def make_logs(self, count, timestamp=None, **fields):
+        values = {'medicine': self.medicine, 'action': MedicineAuditLog.ACTION_UPDATE}
+        return [
+            MedicineAuditLog.objects.create(**{
+                **values, 'timestamp': timestamp or self.day + datetime.timedelta(minutes=number), **fields
+            })
+            for number in range(count)
+        ]
+
+    def archived_ids(self, **filters):
+        return [record['id'] for record in search_archive(self.root, **filters)]
+
+    def test_rows_with_equal_timestamps_are_all_walked_once(self):
+        logs = self.make_logs(5, timestamp=self.day)
+        recent = self.make_logs(1, timestamp=timezone.now())
+
+        counts = archive_before(self.cutoff, self.root, batch_size=2)
+
+        self.assertEqual(counts, {timezone.localdate(self.day): 5})
+        self.assertEqual(self.archived_ids(), [log.id for log in logs])
+        self.assertEqual(list(MedicineAuditLog.objects.values_list('id', flat=True)), [recent[0].id])
+
+    def test_each_batch_is_written_before_it_is_deleted(self):
+        logs = self.make_logs(4)
+        append = archive._append
+        calls = []
+
+        def fail_second_write(path, records):
+            calls.append(records)
+            if len(calls) == 2:
+                raise OSError('disk full')
+            append(path, records)
+
+        with mock.patch.object(archive, '_append', fail_second_write):
+            with self.assertRaises(OSError):
+                archive_before(self.cutoff, self.root, batch_size=2)
+
+        self.assertEqual(self.archived_ids(), [logs[0].id, logs[1].id])
+        self.assertEqual(
+            sorted(MedicineAuditLog.objects.values_list('id', flat=True)), [logs[2].id, logs[3].id]
+        )
+
+    def test_a_rerun_after_an_interrupted_delete_does_not_repeat_search_results(self):
+        logs = self.make_logs(3)
+
+        # Killed after the day file is synced but before the batch's DELETE commits
+        with mock.patch.object(archive, 'transaction') as transaction:
+            transaction.atomic.side_effect = RuntimeError('killed')
+            with self.assertRaises(RuntimeError):
+                archive_before(self.cutoff, self.root, batch_size=2)
+        self.assertEqual(MedicineAuditLog.objects.count(), 3)
+        self.assertEqual(self.archived_ids(), [logs[0].id, logs[1].id])
+        archive_before(self.cutoff, self.root, batch_size=2)
+
+        self.assertFalse(MedicineAuditLog.objects.exists())
+        self.assertEqual(self.archived_ids(), [log.id for log in logs])
+
+    def test_a_dry_run_counts_without_writing_or_deleting(self):
+        self.make_logs(3)
+
+        counts = archive_before(self.cutoff, self.root, dry_run=True)
+
+        self.assertEqual(counts, {timezone.localdate(self.day): 3})
+        self.assertEqual(MedicineAuditLog.objects.count(), 3)
+        self.assertEqual(list(archive.archive_files(self.root)), [])
+
+    def test_text_search_matches_decoded_values(self):
+        accented, quoted, plain = self.make_logs(3)
+        MedicineAuditLog.objects.filter(pk=accented.pk).update(reason='Recalled by Dr. Muñoz')
+        MedicineAuditLog.objects.filter(pk=quoted.pk).update(changes={'notes': ['', 'Keep "cold"']})
+        archive_before(self.cutoff, self.root)
+
+        self.assertEqual(self.archived_ids(text='MUÑOZ'), [accented.id])
+        self.assertEqual(self.archived_ids(text='"cold"'), [quoted.id])
+        self.assertEqual(self.archived_ids(text='paracetamol'), [accented.id, quoted.id, plain.id])
+        with gzip.open(next(archive.archive_files(self.root)), 'rt', encoding='utf-8') as handle:
+            self.assertIn('Muñoz', handle.read())
+
+    def test_search_filters_by_day_action_and_medicine(self):
+        old, = self.make_logs(1, timestamp=self.day - datetime.timedelta(days=2))
+        update, = self.make_logs(1)
+        dispense, = self.make_logs(1, action=MedicineAuditLog.ACTION_DISPENSE)
+        archive_before(self.cutoff, self.root)
+
+        self.assertEqual(self.archived_ids(start=timezone.localdate(self.day)), [update.id, dispense.id])
+        self.assertEqual(self.archived_ids(action=MedicineAuditLog.ACTION_DISPENSE), [dispense.id])
+        self.assertEqual(self.archived_ids(medicine=self.medicine.code), [old.id, update.id, dispense.id])
+        self.assertEqual(self.archived_ids(medicine='PCM-OTHER'), [])
+
+    def test_archive_and_search_commands(self):
+        logs = self.make_logs(2)
+        self.make_logs(1, timestamp=timezone.now())
+        out = io.StringIO()
+
+        call_command('archive_audit_logs', '--days', '365', '--output-dir', str(self.root), stdout=out)
+
+        self.assertIn('Archived 2 audit log rows', out.getvalue())
+        self.assertEqual(MedicineAuditLog.objects.count(), 1)
+        out = io.StringIO()
+        call_command('search_audit_archive', '--archive-dir', str(self.root), '--medicine', 'Paracetamol',
+                     '--limit', '1', stdout=out)
+        self.assertEqual([json.loads(line)['id'] for line in out.getvalue().splitlines()], [logs[0].id])
+        with self.assertRaises(CommandError):
+            call_command('search_audit_archive', '--archive-dir', str(self.root), '--from', 'yesterday')
+
+    def test_archive_command_dry_run(self):
+        self.make_logs(2)
+        out = io.StringIO()
+
+        call_command('archive_audit_logs', '--dry-run', '--output-dir', str(self.root), stdout=out)
+
+        self.assertIn('Would archive 2 audit log rows', out.getvalue())
+        self.assertEqual(MedicineAuditLog.objects.count(), 2)
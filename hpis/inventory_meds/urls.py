@@ -6,9 +6,13 @@ app_name = "inventory_meds"
 urlpatterns = [
     # Dashboard
     path("", views.inventory_dashboard, name="dashboard"),
+    path("search/autocomplete/", views.medicine_autocomplete, name="medicine_autocomplete"),
+    path("lookup/products/", views.product_lookup, name="product_lookup"),
+    path("lookup/catalogue/", views.catalogue_lookup, name="catalogue_lookup"),
     
     # Medicine CRUD
     path("add/", views.add_medicine, name="add_medicine"),
+    path("import/", views.import_medicines, name="import_medicines"),
     path("medicine/<int:medicine_id>/", views.view_medicine, name="view_medicine"),
     path("medicine/<int:medicine_id>/edit/", views.edit_medicine, name="edit_medicine"),
     path("medicine/<int:medicine_id>/archive/", views.archive_medicine, name="archive_medicine"),
@@ -20,6 +24,12 @@ urlpatterns = [
     path("dispense/", views.dispense_medicine, name="dispense_medicine"),
     path("medicine/<int:medicine_id>/dispense/", views.dispense_medicine, name="dispense_medicine_specific"),
     
+    # Purchasing
+    path("purchase-orders/", views.purchase_orders, name="purchase_orders"),
+    path("purchase-orders/add/", views.add_purchase_order, name="add_purchase_order"),
+    path("purchase-orders/<int:order_id>/", views.view_purchase_order, name="view_purchase_order"),
+    path("purchase-orders/<int:order_id>/receive/", views.receive_purchase_order, name="receive_purchase_order"),
+    
     # Reports
     path("reports/", views.reports_dashboard, name="reports_dashboard"),
     path("reports/inventory-summary/", views.inventory_summary_report, name="inventory_summary"),
@@ -31,6 +41,8 @@ urlpatterns = [
     
     # Export
     path("export/csv/", views.export_inventory_csv, name="export_csv"),
+    path("export/csv/movements/", views.export_stock_movements_csv, name="export_movements_csv"),
+    path("export/csv/dispenses/", views.export_dispenses_csv, name="export_dispenses_csv"),
     
     # Audit Logs
     path("audit-logs/", views.audit_log_view, name="audit_logs"),
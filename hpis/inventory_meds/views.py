@@ -1,4 +1,5 @@
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.db.models import Q, F, Sum, Count
@@ -6,67 +7,55 @@ from django.utils import timezone
 from django.http import HttpResponseForbidden, JsonResponse, HttpResponse
 from django.core.paginator import Paginator
 from django.db import transaction
-import csv
 from datetime import timedelta
 
-from .models import Medicine, StockMovement, DispenseRecord, Supplier, MedicineAuditLog
+from main import concurrency
+from main.fragments import cached_widget
+from main.instrumentation import query_budget
+from main.lookups import lookup_response
+from .models import (
+    Medicine, MedicineProduct, StockMovement, StockForecast, DispenseRecord, Supplier, MedicineAuditLog,
+    PurchaseOrder,
+)
+from .allocation import allocate_fefo, InsufficientStock
+from .audit import AuditRecorder, decode_cursor, encode_cursor, field_history, keyset_page
+from . import exports
+from .importer import import_catalogue
+from .receiving import ReceiptLine, receive_delivery
+from . import search as medicine_search
+from .snapshots import DEFAULT_TREND_DAYS, MAX_TREND_DAYS, inventory_metrics, trend_series
 from .forms import (
     MedicineForm, MedicineEditForm, StockAdjustmentForm, 
-    DispenseForm, SupplierForm, SearchFilterForm
+    DispenseForm, SupplierForm, SearchFilterForm, AuditLogFilterForm, MedicineImportForm,
+    PurchaseOrderForm, PurchaseOrderLineFormSet, GoodsReceiptForm, ReceiveLineFormSet
 )
 
-
-def get_client_ip(request):
-    """Get client IP address from request"""
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
+AUDIT_PAGE_SIZE = 50
+PURCHASE_ORDER_PAGE_SIZE = 25
+# Fields whose change history the medicine page can show, and how many changes
+HISTORY_FIELDS = ('quantity_on_hand', 'reorder_level', 'expires_on', 'status')
+HISTORY_LIMIT = 20
 
 
 def log_audit(medicine, action, user, field_name='', old_value='', new_value='', reason='', patient=None, request=None):
     """Create audit log entry"""
-    MedicineAuditLog.objects.create(
-        medicine=medicine,
-        action=action,
-        user=user,
-        field_name=field_name,
-        old_value=str(old_value),
-        new_value=str(new_value),
-        reason=reason,
-        patient=patient,
-        ip_address=get_client_ip(request) if request else None
-    )
+    with AuditRecorder(user, request) as audit:
+        audit.add(medicine, action, field_name=field_name, old_value=old_value,
+                  new_value=new_value, reason=reason, patient=patient)
 
 
-def check_permission(user, required_roles):
-    """Check if user has required role"""
-    if not hasattr(user, 'userprofile'):
-        return False
-    return user.userprofile.role in required_roles
+def check_permission(request, required_roles):
+    """Check if the signed-in user has one of `required_roles`"""
+    return request.principal.role in required_roles
 
 
-@login_required
-def inventory_dashboard(request):
-    """Main inventory dashboard with summary, alerts, and medicine list"""
-    
-    # Get all medicines (as a QuerySet)
-    medicines = Medicine.objects.select_related('supplier').all()
-    
-    # Apply filters
-    form = SearchFilterForm(request.GET or None)
+def filter_medicines(medicines, form):
+    """Apply the dashboard's SearchFilterForm to a Medicine queryset"""
     if form.is_valid():
         search = form.cleaned_data.get('search')
         if search:
-            medicines = medicines.filter(
-                Q(name__icontains=search) |
-                Q(brand_name__icontains=search) |
-                Q(category__icontains=search) |
-                Q(batch_number__icontains=search) |
-                Q(manufacturer__icontains=search)
-            )        
+            # Served by the trigram/FTS index instead of five LIKE scans
+            medicines = medicine_search.search_medicines(medicines, search)
         
         category = form.cleaned_data.get('category')
         if category:
@@ -105,27 +94,44 @@ def inventory_dashboard(request):
             medicines = medicines.filter(prescription_only=True)
         elif prescription_only == 'no':
             medicines = medicines.filter(prescription_only=False)
+    return medicines
+
+
+@login_required
+@query_budget(9, max_repeated=2)
+def inventory_dashboard(request):
+    """Main inventory dashboard with summary, alerts, and medicine list"""
     
-    # Calculate summary statistics (FIX: Use efficient database counts)
-    total_items = Medicine.objects.count()
-    
-    low_stock_count = Medicine.objects.filter(
-        quantity_on_hand__lte=F('reorder_level'), 
-        quantity_on_hand__gt=0
-    ).count()
-    
-    out_of_stock_count = Medicine.objects.filter(quantity_on_hand=0).count()
+    # Get all medicines (as a QuerySet)
+    medicines = Medicine.objects.select_related('supplier').all()
     
-    # Use the same time calculation as the filter
-    thirty_days_ahead = timezone.now().date() + timedelta(days=30)
-    expiring_soon_count = Medicine.objects.filter(
-        expires_on__lte=thirty_days_ahead,
-        expires_on__gt=timezone.now().date()
-    ).count()
+    # Apply filters
+    form = SearchFilterForm(request.GET or None)
+    medicines = filter_medicines(medicines, form)
     
-    expired_count = Medicine.objects.filter(
-        expires_on__lte=timezone.now().date()
-    ).count()
+    # Calculate summary statistics (FIX: Use efficient database counts)
+    today = timezone.now().date()
+
+    def compute_summary():
+        # Use the same time calculation as the filter
+        thirty_days_ahead = today + timedelta(days=30)
+        return {
+            'total_items': Medicine.objects.count(),
+            'low_stock_count': Medicine.objects.filter(
+                quantity_on_hand__lte=F('reorder_level'),
+                quantity_on_hand__gt=0
+            ).count(),
+            'out_of_stock_count': Medicine.objects.filter(quantity_on_hand=0).count(),
+            'expiring_soon_count': Medicine.objects.filter(
+                expires_on__lte=thirty_days_ahead,
+                expires_on__gt=today
+            ).count(),
+            'expired_count': Medicine.objects.filter(expires_on__lte=today).count(),
+        }
+
+    # The same for every user, so shared rather than per role
+    summary = cached_widget(request, 'inventory.summary', compute_summary, ('medicine',),
+                            scope='global', params={'today': today})
     
     # Pagination
     paginator = Paginator(medicines, 20)
@@ -133,7 +139,7 @@ def inventory_dashboard(request):
     page_obj = paginator.get_page(page_number)
     
     # Get role-based permissions - TEMPORARY: Allow all users full access
-    user_role = request.user.userprofile.role if hasattr(request.user, 'userprofile') else None
+    user_role = request.principal.role
     can_add = True  # Temporarily allow all users
     can_edit = True  # Temporarily allow all users
     can_delete = True  # Temporarily allow all users
@@ -143,11 +149,7 @@ def inventory_dashboard(request):
         "title": "Medicine Inventory Dashboard",
         "medicines": page_obj,
         "form": form,
-        "total_items": total_items,
-        "low_stock_count": low_stock_count,
-        "out_of_stock_count": out_of_stock_count,
-        "expiring_soon_count": expiring_soon_count,
-        "expired_count": expired_count,
+        **summary,
         "user_role": user_role,
         "can_add": can_add,
         "can_edit": can_edit,
@@ -156,13 +158,44 @@ def inventory_dashboard(request):
     }
     return render(request, "inventory_meds/dashboard.html", context)
 
+@login_required
+def medicine_autocomplete(request):
+    """Top-k ranked medicine suggestions as JSON for search-as-you-type"""
+    query = request.GET.get('q', '')
+    try:
+        limit = int(request.GET.get('limit', medicine_search.AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        limit = medicine_search.AUTOCOMPLETE_LIMIT
+    
+    results = medicine_search.autocomplete(query, limit)
+    
+    # Echo the query so debounced clients can discard out-of-order responses
+    response = JsonResponse({"query": query, "results": results})
+    response['Cache-Control'] = f'private, max-age={medicine_search.AUTOCOMPLETE_CACHE_SECONDS}'
+    return response
+
+
+@login_required
+def product_lookup(request):
+    """Paginated search over products with stock, for the dispense form"""
+    products = MedicineProduct.objects.filter(quantity_on_hand__gt=0).order_by('name', 'strength', 'id')
+    return lookup_response(request, products, ['name'])
+
+
+@login_required
+def catalogue_lookup(request):
+    """Paginated search over every product, for purchase order lines"""
+    products = MedicineProduct.objects.order_by('name', 'strength', 'id')
+    return lookup_response(request, products, ['name'])
+
+
 @login_required
 def add_medicine(request):
     """Add new medicine entry"""
     
     # TEMPORARY: Remove permission check to allow all users
-    # if not check_permission(request.user, ['Admin', 'Nurse', 'Pharmacist']):
-    #     log_audit(None, MedicineAuditLog.ACTION_ACCESS_DENIED, request.user.userprofile,
+    # if not check_permission(request, ['Admin', 'Nurse', 'Pharmacist']):
+    #     log_audit(None, MedicineAuditLog.ACTION_ACCESS_DENIED, request.user.profile,
     #              reason="Attempted to add medicine", request=request)
     #     messages.error(request, "You do not have permission to add medicines.")
     #     return HttpResponseForbidden("Access denied: insufficient privileges.")
@@ -172,7 +205,7 @@ def add_medicine(request):
         if form.is_valid():
             try:
                 medicine = form.save()
-                log_audit(medicine, MedicineAuditLog.ACTION_CREATE, request.user.userprofile,
+                log_audit(medicine, MedicineAuditLog.ACTION_CREATE, request.user.profile,
                          reason="New medicine added", request=request)
                 messages.success(request, f"Medicine '{medicine.name}' added successfully!")
                 return redirect('inventory_meds:dashboard')
@@ -199,8 +232,8 @@ def edit_medicine(request, medicine_id):
     medicine = get_object_or_404(Medicine, pk=medicine_id)
     
     # TEMPORARY: Remove permission check to allow all users
-    # if not check_permission(request.user, ['Admin', 'Nurse', 'Pharmacist']):
-    #     log_audit(medicine, MedicineAuditLog.ACTION_ACCESS_DENIED, request.user.userprofile,
+    # if not check_permission(request, ['Admin', 'Nurse', 'Pharmacist']):
+    #     log_audit(medicine, MedicineAuditLog.ACTION_ACCESS_DENIED, request.user.profile,
     #              reason="Attempted to edit medicine", request=request)
     #     messages.error(request, "You do not have permission to edit medicines.")
     #     return HttpResponseForbidden("Access denied: insufficient privileges.")
@@ -209,23 +242,14 @@ def edit_medicine(request, medicine_id):
         form = MedicineEditForm(request.POST, instance=medicine)
         if form.is_valid():
             try:
-                # Track changes
-                changed_fields = form.changed_data
-                old_values = {field: getattr(medicine, field) for field in changed_fields}
-                
-                updated_medicine = form.save()
+                # Track changes (form.initial holds the values from before validation
+                # copied the submitted data onto the instance)
+                old_values = {field: form.initial.get(field) for field in form.changed_data}
                 
-                # Log each changed field
-                for field in changed_fields:
-                    log_audit(
-                        updated_medicine, 
-                        MedicineAuditLog.ACTION_UPDATE, 
-                        request.user.userprofile,
-                        field_name=field,
-                        old_value=old_values[field],
-                        new_value=getattr(updated_medicine, field),
-                        request=request
-                    )
+                with transaction.atomic(), AuditRecorder(request.user.profile, request) as audit:
+                    updated_medicine = form.save()
+                    # One JSON-diff entry for the whole edit
+                    audit.record_changes(updated_medicine, old_values)
                 
                 messages.success(request, f"Medicine '{medicine.name}' updated successfully!")
                 return redirect('inventory_meds:view_medicine', medicine_id=medicine.id)
@@ -242,6 +266,42 @@ def edit_medicine(request, medicine_id):
     return render(request, "inventory_meds/edit_medicine.html", context)
 
 
+@login_required
+def import_medicines(request):
+    """Bulk create/update medicines from an uploaded CSV or XLSX catalogue"""
+    summary = None
+    if request.method == 'POST':
+        form = MedicineImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                summary = import_catalogue(
+                    upload, upload.name,
+                    user=request.user.profile,
+                    request=request,
+                    update_existing=form.cleaned_data['update_existing'],
+                    dry_run=form.cleaned_data['dry_run'],
+                )
+            except Exception as e:
+                messages.error(request, f"Failed to import file: {str(e)}")
+            else:
+                if summary.dry_run:
+                    messages.info(request, "Dry run: nothing was saved.")
+                else:
+                    messages.success(
+                        request, f"Imported {summary.created} new and {summary.updated} updated medicines."
+                    )
+    else:
+        form = MedicineImportForm()
+
+    context = {
+        "title": "Import Medicines",
+        "form": form,
+        "summary": summary,
+    }
+    return render(request, "inventory_meds/import_medicines.html", context)
+
+
 @login_required
 def view_medicine(request, medicine_id):
     """View medicine details"""
@@ -254,8 +314,12 @@ def view_medicine(request, medicine_id):
     # Get recent dispenses
     recent_dispenses = medicine.dispenses.select_related('patient', 'dispensed_by')[:10]
     
-    # Get audit logs
-    audit_logs = medicine.audit_logs.select_related('user')[:20]
+    # Change history of one field (?history=<field>), read from the audit diffs
+    history_field = request.GET.get('history')
+    if history_field not in HISTORY_FIELDS:
+        history_field = HISTORY_FIELDS[0]
+    field_changes = field_history(medicine, history_field, limit=HISTORY_LIMIT)
+    history_fields = [(name, Medicine._meta.get_field(name).verbose_name) for name in HISTORY_FIELDS]
     
     # Check permissions
     # TEMPORARY: Allow all users full access
@@ -268,7 +332,9 @@ def view_medicine(request, medicine_id):
         "medicine": medicine,
         "recent_movements": recent_movements,
         "recent_dispenses": recent_dispenses,
-        "audit_logs": audit_logs,
+        "history_field": history_field,
+        "history_fields": history_fields,
+        "field_changes": field_changes,
         "can_edit": can_edit,
         "can_adjust_stock": can_adjust_stock,
         "can_dispense": can_dispense,
@@ -283,8 +349,8 @@ def archive_medicine(request, medicine_id):
     medicine = get_object_or_404(Medicine, pk=medicine_id)
     
     # TEMPORARY: Remove permission check to allow all users
-    # if not check_permission(request.user, ['Admin']):
-    #     log_audit(medicine, MedicineAuditLog.ACTION_ACCESS_DENIED, request.user.userprofile,
+    # if not check_permission(request, ['Admin']):
+    #     log_audit(medicine, MedicineAuditLog.ACTION_ACCESS_DENIED, request.user.profile,
     #              reason="Attempted to archive medicine", request=request)
     #     messages.error(request, "You are not authorized to archive medicines.")
     #     return HttpResponseForbidden("Access denied: insufficient privileges.")
@@ -295,7 +361,7 @@ def archive_medicine(request, medicine_id):
             medicine.status = Medicine.STATUS_DISCONTINUED
             medicine.save()
             
-            log_audit(medicine, MedicineAuditLog.ACTION_ARCHIVE, request.user.userprofile,
+            log_audit(medicine, MedicineAuditLog.ACTION_ARCHIVE, request.user.profile,
                      field_name='status', old_value=old_status, 
                      new_value=Medicine.STATUS_DISCONTINUED, request=request)
             
@@ -318,8 +384,8 @@ def adjust_stock(request, medicine_id):
     medicine = get_object_or_404(Medicine, pk=medicine_id)
     
     # TEMPORARY: Remove permission check to allow all users
-    # if not check_permission(request.user, ['Admin', 'Nurse', 'Pharmacist']):
-    #     log_audit(medicine, MedicineAuditLog.ACTION_ACCESS_DENIED, request.user.userprofile,
+    # if not check_permission(request, ['Admin', 'Nurse', 'Pharmacist']):
+    #     log_audit(medicine, MedicineAuditLog.ACTION_ACCESS_DENIED, request.user.profile,
     #              reason="Attempted to adjust stock", request=request)
     #     messages.error(request, "You do not have permission to modify stock.")
     #     return HttpResponseForbidden("Access denied: insufficient privileges.")
@@ -354,12 +420,12 @@ def adjust_stock(request, medicine_id):
                         quantity=quantity if adjustment_type == 'add' else -quantity,
                         reason=reason,
                         reference=batch_number,
-                        performed_by=request.user.userprofile
+                        performed_by=request.user.profile
                     )
                     
                     # Log audit
                     log_audit(
-                        medicine, action, request.user.userprofile,
+                        medicine, action, request.user.profile,
                         field_name='quantity_on_hand',
                         old_value=old_quantity,
                         new_value=medicine.quantity_on_hand,
@@ -387,8 +453,8 @@ def dispense_medicine(request, medicine_id=None):
     """Dispense medicine to patient"""
     
     # TEMPORARY: Remove permission check to allow all users
-    # if not check_permission(request.user, ['Admin', 'Doctor', 'Nurse', 'Pharmacist']):
-    #     log_audit(None, MedicineAuditLog.ACTION_ACCESS_DENIED, request.user.userprofile,
+    # if not check_permission(request, ['Admin', 'Doctor', 'Nurse', 'Pharmacist']):
+    #     log_audit(None, MedicineAuditLog.ACTION_ACCESS_DENIED, request.user.profile,
     #              reason="Attempted to dispense medicine", request=request)
     #     messages.error(request, "You do not have permission to dispense medicines.")
     #     return HttpResponseForbidden("Access denied: insufficient privileges.")
@@ -402,47 +468,64 @@ def dispense_medicine(request, medicine_id=None):
         if form.is_valid():
             try:
                 with transaction.atomic():
-                    dispense = form.save(commit=False)
-                    dispense.dispensed_by = request.user.userprofile
+                    product = form.cleaned_data['product']
+                    patient = form.cleaned_data['patient']
+                    quantity = form.cleaned_data['quantity']
+                    instructions = form.cleaned_data['instructions']
+                    profile = request.user.profile
                     
-                    # Record stock before and after
-                    dispense.stock_before = dispense.medicine.quantity_on_hand
-                    dispense.medicine.quantity_on_hand -= dispense.quantity
-                    dispense.stock_after = dispense.medicine.quantity_on_hand
-                    dispense.batch_number = dispense.medicine.batch_number
+                    # Earliest-expiring batches first, one locked read
+                    allocations = allocate_fefo(product, quantity)
                     
-                    dispense.medicine.save()
-                    dispense.save()
+                    # One dispense record per batch touched, keeping batch traceability
+                    dispenses = DispenseRecord.objects.bulk_create([
+                        DispenseRecord(
+                            medicine=allocation.batch,
+                            patient=patient,
+                            quantity=allocation.quantity,
+                            instructions=instructions,
+                            dispensed_by=profile,
+                            stock_before=allocation.stock_before,
+                            stock_after=allocation.stock_after,
+                            batch_number=allocation.batch.batch_number,
+                        )
+                        for allocation in allocations
+                    ])
                     
-                    # Create stock movement
-                    StockMovement.objects.create(
-                        medicine=dispense.medicine,
-                        movement_type=StockMovement.MOVEMENT_OUT,
-                        quantity=-dispense.quantity,
-                        reason=f"Dispensed to patient: {dispense.patient.full_name}",
-                        reference=f"DISP-{dispense.id}",
-                        performed_by=request.user.userprofile
-                    )
+                    StockMovement.objects.bulk_create([
+                        StockMovement(
+                            medicine=dispense.medicine,
+                            movement_type=StockMovement.MOVEMENT_OUT,
+                            quantity=-dispense.quantity,
+                            reason=f"Dispensed to patient: {patient.full_name}",
+                            reference=f"DISP-{dispense.id}",
+                            performed_by=profile
+                        )
+                        for dispense in dispenses
+                    ])
                     
-                    # Log audit
-                    log_audit(
-                        dispense.medicine, 
-                        MedicineAuditLog.ACTION_DISPENSE, 
-                        request.user.userprofile,
-                        reason=f"Dispensed {dispense.quantity} to {dispense.patient.full_name}",
-                        patient=dispense.patient,
-                        request=request
-                    )
+                    with AuditRecorder(profile, request) as audit:
+                        for dispense in dispenses:
+                            audit.add(
+                                dispense.medicine, MedicineAuditLog.ACTION_DISPENSE,
+                                field_name='quantity_on_hand',
+                                old_value=dispense.stock_before,
+                                new_value=dispense.stock_after,
+                                reason=f"Dispensed {dispense.quantity} to {patient.full_name}",
+                                patient=patient,
+                            )
                     
                     messages.success(request, 
-                        f"Successfully dispensed {dispense.quantity} {dispense.medicine.name} to {dispense.patient.full_name}")
+                        f"Successfully dispensed {quantity} {product.name} to {patient.full_name}")
                     return redirect('inventory_meds:dashboard')
+            except InsufficientStock as e:
+                form.add_error('quantity', str(e))
             except Exception as e:
                 messages.error(request, f"Dispensing failed: {str(e)}")
     else:
         initial = {}
         if medicine:
-            initial['medicine'] = medicine
+            initial['product'] = medicine.product
         form = DispenseForm(initial=initial)
     
     context = {
@@ -454,7 +537,157 @@ def dispense_medicine(request, medicine_id=None):
 
 
 @login_required
-def reports_dashboard(request):
+def purchase_orders(request):
+    """List purchase orders, optionally filtered by status"""
+    
+    orders = (
+        PurchaseOrder.objects.select_related('supplier')
+        .annotate(
+            line_count=Count('lines'),
+            total_ordered=Sum('lines__quantity_ordered'),
+            total_received=Sum('lines__quantity_received'),
+        )
+        .order_by('-created_at', '-id')
+    )
+    status = request.GET.get('status', '')
+    if status in dict(PurchaseOrder.STATUS_CHOICES):
+        orders = orders.filter(status=status)
+    
+    page_obj = Paginator(orders, PURCHASE_ORDER_PAGE_SIZE).get_page(request.GET.get('page'))
+    
+    context = {
+        "title": "Purchase Orders",
+        "page_obj": page_obj,
+        "orders": page_obj.object_list,
+        "status": status,
+        "status_choices": PurchaseOrder.STATUS_CHOICES,
+    }
+    return render(request, "inventory_meds/purchase_orders.html", context)
+
+
+@login_required
+def add_purchase_order(request):
+    """Create a purchase order with its lines"""
+    
+    order = PurchaseOrder()
+    if request.method == 'POST':
+        form = PurchaseOrderForm(request.POST, instance=order)
+        formset = PurchaseOrderLineFormSet(request.POST, instance=order)
+        if form.is_valid() and formset.is_valid():
+            with transaction.atomic():
+                order = form.save(commit=False)
+                order.created_by = request.user.profile
+                order.save()
+                formset.instance = order
+                formset.save()
+            messages.success(request, f"Purchase order {order.reference} created.")
+            return redirect('inventory_meds:view_purchase_order', order_id=order.pk)
+    else:
+        form = PurchaseOrderForm(instance=order)
+        formset = PurchaseOrderLineFormSet(instance=order)
+    
+    context = {
+        "title": "New Purchase Order",
+        "form": form,
+        "formset": formset,
+    }
+    return render(request, "inventory_meds/purchase_order_form.html", context)
+
+
+@login_required
+def view_purchase_order(request, order_id):
+    """Purchase order with its lines and the deliveries received against it"""
+    
+    order = get_object_or_404(PurchaseOrder.objects.select_related('supplier', 'created_by__user'), pk=order_id)
+    lines = order.lines.select_related('product')
+    receipts = (
+        order.receipts.select_related('received_by__user')
+        .annotate(line_count=Count('lines'), total_quantity=Sum('lines__quantity'))
+    )
+    
+    context = {
+        "title": f"Purchase Order {order.reference}",
+        "order": order,
+        "lines": lines,
+        "receipts": receipts,
+    }
+    return render(request, "inventory_meds/purchase_order_detail.html", context)
+
+
+@login_required
+def receive_purchase_order(request, order_id):
+    """Receive a delivery against a purchase order; all lines post in one transaction"""
+    
+    order = get_object_or_404(PurchaseOrder.objects.select_related('supplier'), pk=order_id)
+    if not order.is_open:
+        messages.error(request, f"Purchase order {order.reference} is {order.get_status_display().lower()}.")
+        return redirect('inventory_meds:view_purchase_order', order_id=order.pk)
+    
+    lines = {line.pk: line for line in order.lines.select_related('product')}
+    
+    if request.method == 'POST':
+        form = GoodsReceiptForm(request.POST)
+        formset = ReceiveLineFormSet(request.POST)
+        if form.is_valid() and formset.is_valid():
+            receipt_lines = []
+            for line_form in formset:
+                data = line_form.cleaned_data
+                order_line = lines.get(data.get('order_line'))
+                if order_line is None or not data.get('quantity'):
+                    continue
+                receipt_lines.append(ReceiptLine(
+                    product=order_line.product,
+                    quantity=data['quantity'],
+                    batch_number=data['batch_number'],
+                    lot_number=data['lot_number'],
+                    expires_on=data['expires_on'],
+                    order_line=order_line,
+                ))
+            try:
+                receipt = receive_delivery(
+                    order.supplier, receipt_lines,
+                    user=request.user.profile,
+                    request=request,
+                    purchase_order=order,
+                    reference=form.cleaned_data['reference'],
+                    notes=form.cleaned_data['notes'],
+                )
+            except ValueError as e:
+                messages.error(request, str(e))
+            else:
+                total = sum(line.quantity for line in receipt_lines)
+                messages.success(
+                    request, f"Received {total} units on {len(receipt_lines)} lines ({receipt.movement_reference})."
+                )
+                return redirect('inventory_meds:view_purchase_order', order_id=order.pk)
+    else:
+        form = GoodsReceiptForm()
+        formset = ReceiveLineFormSet(initial=[
+            {'order_line': line.pk, 'quantity': line.outstanding}
+            for line in lines.values() if line.outstanding
+        ])
+    
+    rows = []
+    for line_form in formset:
+        try:
+            line_id = int(line_form['order_line'].value())
+        except (TypeError, ValueError):
+            line_id = None
+        rows.append((line_form, lines.get(line_id)))
+    
+    context = {
+        "title": f"Receive Delivery for {order.reference}",
+        "order": order,
+        "form": form,
+        "formset": formset,
+        "rows": rows,
+    }
+    return render(request, "inventory_meds/receive_purchase_order.html", context)
+
+
+@login_required
+@query_budget(7, max_repeated=2)
+async def reports_dashboard(request):
     """Reports dashboard with visual analytics, supporting dynamic filtering via query parameters."""
     from datetime import datetime, timedelta
     from django.db.models import Count
@@ -473,66 +706,74 @@ def reports_dashboard(request):
     # Start with all medicines
     all_medicines = Medicine.objects.all()
     
-    # Apply date filters to movement/dispensing data if present
-    dispenses = DispenseRecord.objects.select_related('medicine', 'patient', 'dispensed_by').all()
-    
-    if start_date_str:
-        # Convert string to date object
+    # The date range drives the trend charts (daily snapshots); default last 30 days
+    end_date = today
+    if end_date_str:
         try:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-            dispenses = dispenses.filter(dispensed_at__date__gte=start_date)
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
         except ValueError:
             pass # Ignore if date format is wrong
-            
-    if end_date_str:
+    
+    start_date = end_date - timedelta(days=DEFAULT_TREND_DAYS)
+    if start_date_str:
         try:
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-            dispenses = dispenses.filter(dispensed_at__date__lte=end_date)
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
         except ValueError:
             pass # Ignore if date format is wrong
+    
+    start_date = max(min(start_date, end_date), end_date - timedelta(days=MAX_TREND_DAYS))
+    is_ajax = request.headers.get('x-requested-with') == 'XMLHttpRequest'
 
 
     # ----------------------------------------------------
     # 2. CALCULATE STATISTICS
     # ----------------------------------------------------
     
-    # These counts are always based on the ENTIRE inventory, regardless of date range, 
-    # unless you want to filter them too (e.g., if you had a 'Last Checked' date field).
-    total_medicines = all_medicines.count()
-    active_medicines = all_medicines.filter(status='active', quantity_on_hand__gt=0).count()
-    low_stock_count = all_medicines.filter(quantity_on_hand__lte=F('reorder_level'), quantity_on_hand__gt=0).count()
-    out_of_stock_count = all_medicines.filter(quantity_on_hand=0).count()
-    
     # Expiry stats
-    thirty_days_ahead = today + timedelta(days=30)
     ninety_days_ahead = today + timedelta(days=90)
 
-    expired_count = all_medicines.filter(expires_on__lt=today).count()
-    expiring_soon_count = all_medicines.filter(
-        expires_on__gte=today,
-        expires_on__lte=thirty_days_ahead
-    ).count()
+    # The queries are independent, so they run concurrently (main/concurrency.py)
+    queries = {
+        'trends': lambda: trend_series(start_date, end_date),
+        # These counts are always based on the ENTIRE inventory, regardless of date range
+        'metrics': lambda: inventory_metrics(today),
+        # Category distribution (always based on total inventory)
+        'categories': lambda: list(
+            all_medicines.values('category').annotate(count=Count('id')).order_by('-count')[:8]
+        ),
+        # Top medicines by stock (always based on current stock levels)
+        'top_medicines': lambda: list(all_medicines.order_by('-quantity_on_hand')[:8]),
+    }
+    if not is_ajax:
+        # Expiring medicines timeline (next 90 days)
+        queries['expiring'] = lambda: list(all_medicines.filter(
+            Q(expires_on__lt=today) | 
+            Q(expires_on__gte=today, expires_on__lte=ninety_days_ahead) 
+        ).order_by('expires_on')[:20])
+    results = await concurrency.gather(**queries)
+
+    trends = results['trends']
+    metrics = results['metrics']
+    total_medicines = metrics['total_medicines']
+    active_medicines = metrics['active_count']
+    low_stock_count = metrics['low_stock_count']
+    out_of_stock_count = metrics['out_of_stock_count']
+    
+    expired_count = metrics['expired_count']
+    expiring_soon_count = metrics['expiring_soon_count']
     
     critical_expiry = expiring_soon_count # Same definition as expiring_soon_count (within 30 days)
     
-    valid_stock = all_medicines.filter(expires_on__gt=ninety_days_ahead).count()
+    valid_stock = metrics['valid_stock']
     
-    # Category distribution (always based on total inventory)
-    category_data = all_medicines.values('category').annotate(count=Count('id')).order_by('-count')[:8]
+    category_data = results['categories']
     category_labels = [item['category'] for item in category_data]
     category_counts = [item['count'] for item in category_data]
     
-    # Top medicines by stock (always based on current stock levels)
-    top_medicines = all_medicines.order_by('-quantity_on_hand')[:8]
+    top_medicines = results['top_medicines']
     top_medicines_names = [f"{m.name}" for m in top_medicines]
     top_medicines_stock = [m.quantity_on_hand for m in top_medicines]
     top_medicines_reorder = [m.reorder_level for m in top_medicines]
-
-    # Expiring medicines timeline (next 90 days)
-    expiring_medicines = all_medicines.filter(
-        Q(expires_on__lt=today) | 
-        Q(expires_on__gte=today, expires_on__lte=ninety_days_ahead) 
-    ).order_by('expires_on')[:20]
     
     
     # ----------------------------------------------------
@@ -540,7 +781,7 @@ def reports_dashboard(request):
     # ----------------------------------------------------
     
     # Check if this is an AJAX request for dynamic updates
-    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+    if is_ajax:
         return JsonResponse({
             'total_medicines': total_medicines,
             'active_medicines': active_medicines,
@@ -557,6 +798,7 @@ def reports_dashboard(request):
             'top_medicines_names': top_medicines_names,
             'top_medicines_stock': top_medicines_stock,
             'top_medicines_reorder': top_medicines_reorder,
+            **trends,
         })
 
     # If it's a regular request (initial load), render the HTML template
@@ -580,14 +822,17 @@ def reports_dashboard(request):
         "top_medicines_stock": json.dumps(top_medicines_stock),
         "top_medicines_reorder": json.dumps(top_medicines_reorder),
         
+        # Trend charts from the daily snapshots
+        "trends": trends,
+        
         # List data for the bottom section
-        "expiring_medicines": expiring_medicines,
+        "expiring_medicines": results['expiring'],
 
-        # Pass filters back to the template to pre-fill the form (optional)
-        "start_date": start_date_str, 
-        "end_date": end_date_str,
+        # Pass filters back to the template to pre-fill the form
+        "start_date": start_date.isoformat(), 
+        "end_date": end_date.isoformat(),
     }
-    return render(request, "inventory_meds/reports_dashboard.html", context)
+    return await concurrency.run(render, request, "inventory_meds/reports_dashboard.html", context)
 
 
 
@@ -614,6 +859,16 @@ def inventory_summary_report(request):
 def low_stock_report(request):
     """Generate low stock report"""
     
+    try:
+        horizon = min(max(int(request.GET.get('days', 30)), 1), 365)
+    except ValueError:
+        horizon = 30
+    
+    # Predicted stockouts from the consumption forecasts (refresh_stock_forecasts)
+    forecasts = StockForecast.objects.filter(
+        predicted_stockout_on__lte=timezone.now().date() + timedelta(days=horizon)
+    ).select_related('product').order_by('predicted_stockout_on', 'product__name')
+    
     medicines = Medicine.objects.filter(
         quantity_on_hand__lte=F('reorder_level'),
         quantity_on_hand__gt=0
@@ -621,6 +876,8 @@ def low_stock_report(request):
     
     context = {
         "title": "Low Stock Report",
+        "forecasts": forecasts,
+        "horizon": horizon,
         "medicines": medicines,
         "generated_at": timezone.now(),
     }
@@ -719,37 +976,64 @@ def dispensing_summary_report(request):
 
 @login_required
 def export_inventory_csv(request):
-    """Export inventory to CSV"""
-    
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="medicine_inventory.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow([
+    """Export inventory to CSV (streams; honours the dashboard filters)"""
+    
+    medicines = filter_medicines(Medicine.objects.order_by('id'), SearchFilterForm(request.GET or None))
+    rows = exports.iterate(
+        medicines,
+        'code', 'name', 'brand_name', 'category', 'dosage_form', 'strength',
+        'manufacturer', 'batch_number', 'quantity_on_hand', 'reorder_level',
+        'expires_on', 'status', 'supplier__name',
+    )
+    return exports.csv_response(request, "medicine_inventory.csv", [
         'Code', 'Name', 'Brand Name', 'Category', 'Form', 'Strength',
         'Manufacturer', 'Batch Number', 'Quantity', 'Reorder Level',
         'Expires On', 'Status', 'Supplier'
-    ])
-    
-    medicines = Medicine.objects.select_related('supplier').all()
-    for med in medicines:
-        writer.writerow([
-            med.code,
-            med.name,
-            med.brand_name,
-            med.category,
-            med.dosage_form,
-            med.strength,
-            med.manufacturer,
-            med.batch_number,
-            med.quantity_on_hand,
-            med.reorder_level,
-            med.expires_on,
-            med.status,
-            med.supplier.name if med.supplier else ''
-        ])
-    
-    return response
+    ], rows)
+
+
+@login_required
+def export_stock_movements_csv(request):
+    """Export stock movements to CSV, optionally limited by start_date/end_date and type"""
+    
+    movements = StockMovement.objects.filter(
+        **exports.date_range_filter(request, 'performed_at')
+    ).order_by('performed_at', 'id')
+    
+    movement_type = request.GET.get('movement_type')
+    if movement_type in dict(StockMovement.MOVEMENT_TYPES):
+        movements = movements.filter(movement_type=movement_type)
+    
+    rows = exports.iterate(
+        movements,
+        'performed_at', 'movement_type', 'medicine__code', 'medicine__name',
+        'medicine__batch_number', 'quantity', 'reason', 'reference',
+        'performed_by__user__username',
+    )
+    return exports.csv_response(request, "stock_movements.csv", [
+        'Performed At', 'Type', 'Medicine Code', 'Medicine', 'Batch Number',
+        'Quantity', 'Reason', 'Reference', 'Performed By'
+    ], rows)
+
+
+@login_required
+def export_dispenses_csv(request):
+    """Export dispensing records to CSV, optionally limited by start_date/end_date"""
+    
+    dispenses = DispenseRecord.objects.filter(
+        **exports.date_range_filter(request, 'dispensed_at')
+    ).order_by('dispensed_at', 'id')
+    
+    rows = exports.iterate(
+        dispenses,
+        'dispensed_at', 'medicine__code', 'medicine__name', 'batch_number', 'quantity',
+        'patient__patient_code', 'patient__full_name', 'dispensed_by__user__username',
+        'stock_before', 'stock_after', 'instructions',
+    )
+    return exports.csv_response(request, "dispensing_records.csv", [
+        'Dispensed At', 'Medicine Code', 'Medicine', 'Batch Number', 'Quantity',
+        'Patient Code', 'Patient', 'Dispensed By', 'Stock Before', 'Stock After', 'Instructions'
+    ], rows)
 
 
 @login_required
@@ -757,14 +1041,56 @@ def audit_log_view(request):
     """View audit logs"""
     
     # TEMPORARY: Remove permission check to allow all users
-    # if not check_permission(request.user, ['Admin', 'Auditor']):
+    # if not check_permission(request, ['Admin', 'Auditor']):
     #     messages.error(request, "You do not have permission to view audit logs.")
     #     return HttpResponseForbidden("Access denied: insufficient privileges.")
     
-    logs = MedicineAuditLog.objects.select_related('medicine', 'user', 'patient').order_by('-timestamp')[:200]
+    logs = MedicineAuditLog.objects.select_related('medicine', 'user__user', 'patient')
+    
+    # Each filter is an equality on a column with a (column, timestamp) index
+    filter_form = AuditLogFilterForm(request.GET)
+    filters = {}
+    if filter_form.is_valid():
+        for field in ('action', 'medicine', 'user', 'patient'):
+            value = filter_form.cleaned_data.get(field)
+            if value:
+                filters[field] = value
+    logs = logs.filter(**filters)
+    
+    # Keyset pagination over (timestamp, id): no OFFSET, constant cost per page
+    after = decode_cursor(request.GET.get('after'))
+    before = decode_cursor(request.GET.get('before')) if not after else None
+    page, has_older, has_newer = keyset_page(logs, after, before, AUDIT_PAGE_SIZE)
+    
+    params = request.GET.copy()
+    for key in ('after', 'before'):
+        params.pop(key, None)
+    
+    def page_url(drop=None, **cursor):
+        query = params.copy()
+        query.pop(drop, None)
+        query.update(cursor)
+        return f"?{query.urlencode()}"
+    
+    # Chips for the active filters, each linking to the same view without it
+    labels = {
+        'action': lambda value: dict(MedicineAuditLog.ACTION_CHOICES).get(value, value),
+        'medicine': lambda pk: Medicine.objects.filter(pk=pk).values_list('name', flat=True).first() or f"#{pk}",
+        'user': lambda pk: User.objects.filter(profile__pk=pk).values_list('username', flat=True).first() or f"#{pk}",
+        'patient': str,
+    }
+    active_filters = [
+        (field.title(), labels[field](value), page_url(drop=field))
+        for field, value in filters.items()
+    ]
     
     context = {
         "title": "Medicine Inventory Audit Logs",
-        "logs": logs,
+        "logs": page,
+        "filter_form": filter_form,
+        "active_filters": active_filters,
+        "newest_url": page_url(),
+        "older_url": page_url(after=encode_cursor(page[-1])) if page and has_older else None,
+        "newer_url": page_url(before=encode_cursor(page[0])) if page and has_newer else None,
     }
     return render(request, "inventory_meds/audit_logs.html", context)
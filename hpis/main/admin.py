@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     UserProfile, NotificationPreference, AccessLog,
-    DataExportRequest, DeleteAccountRequest
+    DataExportRequest, DeleteAccountRequest, DoctorSchedule, OutboxEmail
 )
 
 
@@ -131,4 +131,22 @@ class DeleteAccountRequestAdmin(admin.ModelAdmin):
         )
         self.message_user(request, f'{updated} account(s) marked as deleted.')
 
-    mark_as_deleted.short_description = "Mark selected as deleted"
\ No newline at end of file
+    mark_as_deleted.short_description = "Mark selected as deleted"
+
+
+@admin.register(DoctorSchedule)
+class DoctorScheduleAdmin(admin.ModelAdmin):
+    list_display = ('doctor', 'working_days', 'start_time', 'end_time', 'slot_minutes', 'slot_capacity')
+    search_fields = ('doctor__username', 'doctor__first_name', 'doctor__last_name')
+    list_select_related = ('doctor',)
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('to_email', 'subject', 'category', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status', 'category', 'created_at')
+    search_fields = ('to_email', 'subject', 'user__username')
+    # Bodies can hold credentials (welcome emails), so the admin never shows them
+    exclude = ('body', 'html_body')
+    readonly_fields = ('user', 'to_email', 'category', 'subject',
+                       'attempts', 'last_error', 'created_at', 'sent_at')
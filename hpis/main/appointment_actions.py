@@ -0,0 +1,124 @@
+"""
+Bulk appointment actions for the dashboard queues.
+
+An action moves many appointments from the statuses it accepts to one new
+status. It runs in one transaction:
+
+1. one SELECT ... FOR UPDATE of the requested rows, to tell the caller why
+   any are skipped (not found, not theirs, wrong status);
+2. one UPDATE of the rest, still guarded by status so a concurrent change
+   is never overwritten;
+3. one bulk insert of the AccessLog rows, one per appointment.
+
+update() sends no post_save, so the `appointment` cache namespace is bumped
+and the change feed event published here.
+"""
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import changefeed, invalidation
+from .models import AccessLog, PatientAppointment
+
+MAX_BATCH = 1000
+
+
+@dataclass(frozen=True)
+class Action:
+    verb: str
+    from_statuses: tuple
+    to_status: str
+    roles: tuple
+
+
+# Same roles as the single-appointment views: admins assign, only the
+# assigned doctor confirms and completes
+ACTIONS = {
+    'assign': Action('Assigned', ('pending',), 'assigned', ('admin',)),
+    'confirm': Action('Confirmed', ('assigned',), 'confirmed', ('doctor',)),
+    'complete': Action('Completed', ('confirmed',), 'completed', ('doctor',)),
+    'cancel': Action('Cancelled', ('pending', 'assigned', 'confirmed'), 'cancelled', ('admin', 'doctor')),
+}
+
+
+class BulkActionError(ValueError):
+    pass
+
+
+@dataclass
+class BulkResult:
+    action: str
+    updated: list = field(default_factory=list)
+    skipped: dict = field(default_factory=dict)  # id -> reason
+
+
+def apply(name, ids, user, role, doctor=None, appointment_date=None, appointment_time=None, request=None):
+    """
+    Run action `name` on appointments `ids` for `user` acting as `role`.
+    Doctors only act on appointments assigned to them. Raises
+    BulkActionError when the action itself is not allowed.
+    """
+    action = ACTIONS.get(name)
+    if action is None:
+        raise BulkActionError(f'Unknown action "{name}".')
+    if role not in action.roles:
+        raise BulkActionError('You do not have permission to do that.')
+    if name == 'assign' and doctor is None:
+        raise BulkActionError('Choose a doctor to assign to.')
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MAX_BATCH:
+        raise BulkActionError(f'Select at most {MAX_BATCH} appointments at a time.')
+
+    result = BulkResult(name)
+    with transaction.atomic():
+        scope = PatientAppointment.objects.filter(id__in=ids)
+        if role == 'doctor':
+            scope = scope.filter(assigned_doctor=user)
+        found = {
+            appointment_id: (status, doctor_id)
+            for appointment_id, status, doctor_id
+            in scope.select_for_update().values_list('id', 'status', 'assigned_doctor_id')
+        }
+
+        allowed = ' or '.join(action.from_statuses)
+        valid = []
+        for appointment_id in ids:
+            status, _ = found.get(appointment_id, (None, None))
+            if status is None:
+                result.skipped[appointment_id] = 'Not found' if role != 'doctor' else 'Not found or not assigned to you'
+            elif status not in action.from_statuses:
+                result.skipped[appointment_id] = f'Is {status}, must be {allowed}'
+            else:
+                valid.append(appointment_id)
+        if not valid:
+            return result
+
+        changes = {'status': action.to_status, 'updated_at': timezone.now()}
+        if name == 'assign':
+            changes.update(assigned_doctor=doctor, assigned_admin=user)
+            if appointment_date:
+                changes['appointment_date'] = appointment_date
+            if appointment_time:
+                changes['appointment_time'] = appointment_time
+        PatientAppointment.objects.filter(id__in=valid, status__in=action.from_statuses).update(**changes)
+        result.updated = valid
+
+        detail = f' to Dr. {doctor.first_name} {doctor.last_name}' if doctor is not None and name == 'assign' else ''
+        ip_address, user_agent = None, ''
+        if request is not None:
+            from .views import get_client_ip
+
+            ip_address = get_client_ip(request)
+            user_agent = request.META.get('HTTP_USER_AGENT', '')
+        AccessLog.objects.bulk_create([
+            AccessLog(
+                user=user, access_type='data_update', ip_address=ip_address, user_agent=user_agent,
+                description=f'{action.verb} appointment #{appointment_id}{detail} (bulk)',
+            )
+            for appointment_id in valid
+        ])
+        invalidation.bump('appointment')
+        doctors = [doctor.pk] if name == 'assign' else [found[appointment_id][1] for appointment_id in valid]
+        changefeed.appointments_changed(action.to_status, len(valid), doctors)
+    return result
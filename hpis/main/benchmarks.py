@@ -0,0 +1,147 @@
+"""
+View latency benchmarks.
+
+Each ViewCase is requested through the Django test client as a generated user
+of the right role: `warmup` unmeasured requests, then `repeat` timed ones
+(wall time and query count per request), then one more under tracemalloc for
+peak Python memory. Timed and memory runs are kept apart because tracemalloc
+itself slows allocation-heavy code down severalfold.
+
+`manage.py benchmark_views` runs the cases at several data scales on a
+throwaway test database and writes the results as JSON. The test database is
+created on the configured server, so pointing DATABASE_URL at a local Postgres
+benchmarks Postgres instead of SQLite.
+
+A local database answers in microseconds, which hides what the async
+dashboards save against a remote one. SimulatedLatency adds a fixed round
+trip to every statement, and running the cases at several
+DASHBOARD_QUERY_WORKERS shows their latency fall from about the sum of their
+queries (one worker) towards the slowest single query (`slowest_query_ms`).
+"""
+import math
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+
+from contextlib import ExitStack
+
+from django.core.cache import cache
+from django.test import Client
+from django.urls import reverse
+
+from .instrumentation import QueryRecorder, wrapping_queries
+
+
+@dataclass
+class ViewCase:
+    name: str
+    url_name: str
+    role: str = 'admin'
+    method: str = 'get'
+    data: dict = field(default_factory=dict)
+
+
+VIEW_CASES = [
+    ViewCase('super_admin_dashboard', 'super_admin_dashboard', role='super_admin'),
+    ViewCase('admin_dashboard', 'admin_dashboard'),
+    ViewCase('doctor_dashboard', 'doctor_dashboard', role='doctor'),
+    ViewCase('analytics_dashboard', 'analytics_dashboard'),
+    ViewCase('records_list', 'records_list'),
+    ViewCase('inventory_dashboard', 'inventory_meds:dashboard'),
+    ViewCase('reports_dashboard', 'inventory_meds:reports_dashboard'),
+    ViewCase('generate_report', 'reports'),
+    ViewCase('generate_report[appointments csv]', 'reports', method='post',
+             data={'report_type': 'appointments', 'format': 'csv'}),
+    ViewCase('generate_report[audit csv]', 'reports', method='post',
+             data={'report_type': 'audit', 'format': 'csv'}),
+]
+
+
+class SimulatedLatency:
+    """Execute wrapper that delays every statement by a fixed round trip, as a remote database would"""
+
+    def __init__(self, milliseconds):
+        self.seconds = milliseconds / 1000
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.seconds)
+        return execute(sql, params, many, context)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def request(client, case):
+    response = getattr(client, case.method)(reverse(case.url_name), case.data)
+    # Drain streaming responses so their cost is part of the measurement
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def measure(client, case, warmup=3, repeat=20, cold_cache=True, latency_ms=0):
+    """Latency (ms), query count and peak memory (KiB) of one view case"""
+    with ExitStack() as stack:
+        if latency_ms:
+            stack.enter_context(wrapping_queries(SimulatedLatency(latency_ms)))
+        status = None
+        for _ in range(warmup):
+            if cold_cache:
+                cache.clear()
+            status = request(client, case).status_code
+
+        timings, queries, slowest = [], [], []
+        for _ in range(repeat):
+            if cold_cache:
+                cache.clear()
+            with QueryRecorder() as recorder:
+                started = time.perf_counter()
+                status = request(client, case).status_code
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(recorder.count)
+            # The latency wrapper runs outside the recorder, so add the round trip back
+            slowest.append(max((ms + latency_ms for _, ms in recorder.statements), default=0))
+
+    if cold_cache:
+        cache.clear()
+    tracemalloc.start()
+    try:
+        request(client, case)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'view': case.name,
+        'status': status,
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'mean_ms': round(statistics.fmean(timings), 2),
+        'min_ms': round(min(timings), 2),
+        'max_ms': round(max(timings), 2),
+        'queries': max(queries),
+        'slowest_query_ms': round(statistics.median(slowest), 2),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def run_cases(users, cases=None, **options):
+    """
+    Measure every case; `users` maps a role to the User to log in as.
+    Cases whose role has no user are skipped.
+    """
+    clients = {}
+    for role, user in users.items():
+        client = Client()
+        client.force_login(user)
+        clients[role] = client
+
+    results = []
+    for case in cases or VIEW_CASES:
+        if case.role in clients:
+            results.append(measure(clients[case.role], case, **options))
+    return results
@@ -0,0 +1,159 @@
+"""
+Two-tier cache backend.
+
+L1 is a small LocMemCache private to the process; L2 is a cache shared by all
+workers (Redis when REDIS_URL is set, otherwise a FileBasedCache directory;
+see CACHES in settings). Reads try L1, then L2, and copy L2 hits into L1 for
+at most L1_TIMEOUT seconds. Writes go to both.
+
+A write or delete in one worker reaches the other workers' L1 copies only
+when they expire, so L1_TIMEOUT bounds staleness for plain cache writes.
+Model changes are faster: main.invalidation clears every worker's L1 within
+CACHE_INVALIDATION_POLL_SECONDS. Keys starting with one of
+L1_EXCLUDE_PREFIXES (sessions, by default) never enter L1, so a logout in one
+worker takes effect in every worker at once.
+"""
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from .metrics import CACHE_OPERATIONS
+
+_MISSING = object()
+
+# Raw key prefixes used by Django's page cache and cached_db sessions
+NAMESPACES = (
+    ('views.decorators.cache.', 'page'),
+    ('django.contrib.sessions.', 'session'),
+)
+
+
+def _namespace(key):
+    for prefix, namespace in NAMESPACES:
+        if str(key).startswith(prefix):
+            return namespace
+    return 'app'
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.location = location
+        self.l2_alias = options.get('L2', 'shared')
+        self.l1_timeout = options.get('L1_TIMEOUT', 30)
+        self.l1_exclude = tuple(options.get('L1_EXCLUDE_PREFIXES', ('django.contrib.sessions.',)))
+        self.l1 = LocMemCache(f'{location}-l1', {
+            'TIMEOUT': self.l1_timeout,
+            'OPTIONS': {'MAX_ENTRIES': options.get('L1_MAX_ENTRIES', 1000)},
+        })
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def _count(self, key, operation, result):
+        CACHE_OPERATIONS.inc(cache=self.location, namespace=_namespace(key), operation=operation, result=result)
+
+    def _in_l1(self, key):
+        return not str(key).startswith(self.l1_exclude)
+
+    def _timeouts(self, timeout):
+        """(L2 timeout, L1 timeout) for a requested timeout"""
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return timeout, self.l1_timeout if timeout is None else min(timeout, self.l1_timeout)
+
+    def clear_local(self):
+        """Drop this process's L1 copies; L2 is untouched"""
+        self.l1.clear()
+
+    def get(self, key, default=None, version=None):
+        local = self._in_l1(key)
+        if local:
+            value = self.l1.get(key, _MISSING, version)
+            if value is not _MISSING:
+                self._count(key, 'get', 'l1_hit')
+                return value
+        value = self.l2.get(key, _MISSING, version)
+        if value is _MISSING:
+            self._count(key, 'get', 'miss')
+            return default
+        self._count(key, 'get', 'l2_hit')
+        if local:
+            self.l1.set(key, value, self.l1_timeout, version)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.l1.get(key, _MISSING, version) if self._in_l1(key) else _MISSING
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                self._count(key, 'get', 'l1_hit')
+                found[key] = value
+        if missing:
+            shared = self.l2.get_many(missing, version)
+            for key in missing:
+                if key in shared:
+                    self._count(key, 'get', 'l2_hit')
+                    if self._in_l1(key):
+                        self.l1.set(key, shared[key], self.l1_timeout, version)
+                else:
+                    self._count(key, 'get', 'miss')
+            found.update(shared)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        l2_timeout, l1_timeout = self._timeouts(timeout)
+        self.l2.set(key, value, l2_timeout, version)
+        if self._in_l1(key):
+            self.l1.set(key, value, l1_timeout, version)
+        self._count(key, 'set', 'ok')
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        l2_timeout, l1_timeout = self._timeouts(timeout)
+        failed = self.l2.set_many(data, l2_timeout, version)
+        for key, value in data.items():
+            if key not in failed and self._in_l1(key):
+                self.l1.set(key, value, l1_timeout, version)
+            self._count(key, 'set', 'ok')
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        l2_timeout, l1_timeout = self._timeouts(timeout)
+        added = self.l2.add(key, value, l2_timeout, version)
+        if added and self._in_l1(key):
+            self.l1.set(key, value, l1_timeout, version)
+        self._count(key, 'add', 'ok' if added else 'exists')
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        l2_timeout, l1_timeout = self._timeouts(timeout)
+        self.l1.touch(key, l1_timeout, version)
+        return self.l2.touch(key, l2_timeout, version)
+
+    def delete(self, key, version=None):
+        self.l1.delete(key, version)
+        deleted = self.l2.delete(key, version)
+        self._count(key, 'delete', 'ok' if deleted else 'missing')
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.l1.delete_many(keys, version)
+        self.l2.delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        return (self._in_l1(key) and self.l1.has_key(key, version)) or self.l2.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        # Counters live in L2 only, where Redis increments atomically
+        self.l1.delete(key, version)
+        return self.l2.incr(key, delta, version)
+
+    def clear(self):
+        self.l1.clear()
+        self.l2.clear()
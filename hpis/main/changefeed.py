@@ -0,0 +1,304 @@
+"""
+Change feed and server-sent event stream for live dashboard updates.
+
+Writers call publish(), through the helpers below: post_save receivers for
+single saves, and the bulk paths (bulk actions, the scheduler, FEFO
+allocation) directly since bulk writes send no signals. The ChangeEvent row is
+inserted once the surrounding transaction commits, so a rolled back change is
+never pushed.
+
+Dashboards open ``/events/`` with EventSource (static/js/live_updates.js).
+Under ASGI (hpis/asgi.py) each worker runs one Broadcaster task while any
+stream is open: every CHANGE_FEED_POLL_SECONDS it reads the new rows in one
+query and hands them to every open stream, and when appointments changed it
+computes the dashboard counters once, a single grouped query shared through
+the cache by feed position so other workers reuse it. Open dashboards cost
+one poll per worker rather than one aggregate per dashboard.
+
+Events, by SSE event name:
+
+    appointment   {"id", "status", "doctor", "type", "date", "created"}
+    appointments  {"status", "count", "doctors"}  many rows changed at once
+    stock         {"id", "name", "quantity", "reorder_level"}
+    counters      admins {"pending", "assigned"}; doctors {"assigned", "confirmed", "total"}
+    reload        the stream fell too far behind; the page should be reloaded
+
+Admins receive everything; doctors only appointment events assigned to them
+and their own counters. A stream closes after CHANGE_FEED_STREAM_SECONDS and
+the browser reconnects with Last-Event-ID, missing nothing. Under WSGI the
+endpoint instead answers each (re)connection with the events since
+Last-Event-ID and closes, so EventSource falls back to polling every
+CHANGE_FEED_RECONNECT_MS.
+"""
+import asyncio
+import datetime
+import json
+import logging
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import ChangeEvent, PatientAppointment
+
+logger = logging.getLogger('hpis.changefeed')
+
+REPLAY_LIMIT = 500
+QUEUE_SIZE = 100
+PRUNE_INTERVAL = 60
+OVERFLOW = object()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# ---------------------------------------------------------------- writing
+
+def publish(kind, payload):
+    """Add an event to the feed when the current transaction commits"""
+    transaction.on_commit(partial(ChangeEvent.objects.create, kind=kind, payload=payload), robust=True)
+
+
+def appointment_changed(appointment, created=False):
+    publish('appointment', {
+        'id': appointment.pk,
+        'status': appointment.status,
+        'doctor': appointment.assigned_doctor_id,
+        'type': appointment.appointment_type,
+        'date': str(appointment.appointment_date) if appointment.appointment_date else None,
+        'created': created,
+    })
+
+
+def appointments_changed(status, count, doctors=()):
+    """Many appointments moved to `status` at once"""
+    if count:
+        publish('appointments', {
+            'status': status,
+            'count': count,
+            'doctors': sorted({doctor for doctor in doctors if doctor}),
+        })
+
+
+def crossed_reorder_level(before, after, level):
+    """True when stock fell from above the reorder level to at or below it, or ran out"""
+    if before is None or after >= before:
+        return False
+    return before > level >= after or after == 0
+
+
+def stock_low(medicine):
+    publish('stock', {
+        'id': medicine.pk,
+        'name': str(medicine),
+        'quantity': medicine.quantity_on_hand,
+        'reorder_level': medicine.reorder_level,
+    })
+
+
+# ---------------------------------------------------------------- reading
+
+def latest_id():
+    return ChangeEvent.objects.aggregate(last=Max('id'))['last'] or 0
+
+
+def read(after, limit=REPLAY_LIMIT):
+    """[(id, kind, payload)] of the events after id `after`, oldest first"""
+    return list(
+        ChangeEvent.objects.filter(id__gt=after).order_by('id').values_list('id', 'kind', 'payload')[:limit]
+    )
+
+
+def counters(position):
+    """Appointment counts by status, overall and per doctor, as of feed `position`"""
+    def compute():
+        totals, doctors = Counter(), defaultdict(dict)
+        rows = (
+            PatientAppointment.objects.order_by()
+            .values_list('assigned_doctor_id', 'status').annotate(n=Count('id'))
+        )
+        for doctor_id, status, n in rows:
+            totals[status] += n
+            if doctor_id:
+                doctors[doctor_id][status] = n
+        return {'status': dict(totals), 'doctors': dict(doctors)}
+
+    return cache.get_or_set(f'changefeed:counters:{position}', compute, 60)
+
+
+def prune():
+    cutoff = timezone.now() - datetime.timedelta(seconds=_setting('CHANGE_FEED_RETENTION_SECONDS', 3600))
+    ChangeEvent.objects.filter(created_at__lt=cutoff).delete()
+
+
+def format_event(kind, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines += [f'event: {kind}', 'data: ' + json.dumps(data, separators=(',', ':'))]
+    return '\n'.join(lines) + '\n\n'
+
+
+# ---------------------------------------------------------------- streaming
+
+@dataclass(eq=False)
+class Subscriber:
+    role: str
+    user_id: int
+    queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(QUEUE_SIZE))
+    last_counters: dict = None
+
+    def wants(self, kind, payload):
+        if self.role == 'admin':
+            return True
+        if kind == 'appointment':
+            return payload.get('doctor') == self.user_id
+        if kind == 'appointments':
+            return self.user_id in payload.get('doctors', ())
+        return False
+
+    def counters(self, counts):
+        if self.role == 'admin':
+            totals = counts['status']
+            return {'pending': totals.get('pending', 0), 'assigned': totals.get('assigned', 0)}
+        mine = counts['doctors'].get(self.user_id, {})
+        return {'assigned': mine.get('assigned', 0), 'confirmed': mine.get('confirmed', 0), 'total': sum(mine.values())}
+
+    def deliver(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Too slow to keep up; tell it to reload instead of buffering more
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+    def render(self, events, counts, sent):
+        """(SSE text for the events this subscriber should see, last id covered)"""
+        parts = []
+        for event_id, kind, payload in events:
+            if event_id <= sent:
+                continue
+            sent = event_id
+            if self.wants(kind, payload):
+                parts.append(format_event(kind, payload, event_id))
+        if counts is not None:
+            mine = self.counters(counts)
+            if mine != self.last_counters:
+                self.last_counters = mine
+                parts.append(format_event('counters', mine))
+        return ''.join(parts), sent
+
+
+class Broadcaster:
+    """Polls the feed for this worker's open streams; runs only while there are any"""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.task = None
+        self.position = None
+        self.next_prune = 0.0
+
+    def subscribe(self, subscriber):
+        self.subscribers.add(subscriber)
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self.run())
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def poll(self):
+        close_old_connections()
+        if self.position is None:
+            self.position = latest_id()
+        events = read(self.position)
+        counts = None
+        if events:
+            self.position = events[-1][0]
+            if any(kind.startswith('appointment') for _, kind, _ in events):
+                counts = counters(self.position)
+        if time.monotonic() >= self.next_prune:
+            self.next_prune = time.monotonic() + PRUNE_INTERVAL
+            prune()
+        return events, counts
+
+    async def run(self):
+        interval = _setting('CHANGE_FEED_POLL_SECONDS', 1.0)
+        while self.subscribers:
+            try:
+                events, counts = await sync_to_async(self.poll)()
+            except DatabaseError:
+                logger.exception('Could not read the change feed')
+                events, counts = [], None
+            if events:
+                for subscriber in list(self.subscribers):
+                    subscriber.deliver((events, counts))
+            await asyncio.sleep(interval)
+
+
+broadcaster = Broadcaster()
+
+
+async def stream(subscriber, last_event_id=None):
+    """Async SSE body for one dashboard; ends after CHANGE_FEED_STREAM_SECONDS"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + _setting('CHANGE_FEED_STREAM_SECONDS', 300)
+    heartbeat = _setting('CHANGE_FEED_HEARTBEAT_SECONDS', 15)
+    # Subscribe before reading the backlog so nothing falls between the two
+    broadcaster.subscribe(subscriber)
+    try:
+        yield f'retry: {_setting("CHANGE_FEED_RECONNECT_MS", 5000)}\n\n'
+        if last_event_id is None:
+            sent = await sync_to_async(latest_id)()
+            yield f'id: {sent}\n\n'
+        else:
+            backlog = await sync_to_async(read)(last_event_id, REPLAY_LIMIT + 1)
+            if len(backlog) > REPLAY_LIMIT:
+                yield format_event('reload', {})
+                return
+            text, sent = subscriber.render(backlog, None, last_event_id)
+            if text:
+                yield text
+
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                item = await asyncio.wait_for(subscriber.queue.get(), min(heartbeat, remaining))
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if item is OVERFLOW:
+                yield format_event('reload', {})
+                return
+            text, sent = subscriber.render(*item, sent)
+            if text:
+                yield text
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+def replay(subscriber, last_event_id=None):
+    """SSE body for servers that cannot hold a stream open: the backlog, then close"""
+    parts = [f'retry: {_setting("CHANGE_FEED_RECONNECT_MS", 5000)}\n\n']
+    if last_event_id is None:
+        parts.append(f'id: {latest_id()}\n\n')
+        return ''.join(parts)
+    backlog = read(last_event_id, REPLAY_LIMIT + 1)
+    if len(backlog) > REPLAY_LIMIT:
+        parts.append(format_event('reload', {}))
+        return ''.join(parts)
+    text, sent = subscriber.render(backlog, None, last_event_id)
+    parts.append(text)
+    if any(kind.startswith('appointment') for _, kind, _ in backlog):
+        parts.append(format_event('counters', subscriber.counters(counters(sent))))
+    emitted = max((event_id for event_id, kind, payload in backlog if subscriber.wants(kind, payload)), default=None)
+    if sent not in (last_event_id, emitted):
+        # Move the browser past events this subscriber does not receive
+        parts.append(f'id: {sent}\n\n')
+    return ''.join(parts)
@@ -0,0 +1,77 @@
+"""
+Concurrent independent queries for the async dashboard views.
+
+The aggregates behind a dashboard do not depend on one another. Run one
+after another, the view's latency is the sum of every round trip to the
+database, which adds up against a remote pooler. gather() runs them on a
+small thread pool instead, each worker thread with its own connection, so the
+view waits about as long as the slowest of them. Django's async ORM methods
+(acount(), aaggregate() ...) would not help: they all queue on the one
+thread-sensitive executor and still run one at a time.
+
+Worker connections are kept and reused like request connections
+(CONN_MAX_AGE), with close_old_connections() before each task, so the pool
+holds at most DASHBOARD_QUERY_WORKERS extra connections per process. Query
+instrumentation follows the work into the pool (main/instrumentation.py), so
+query budgets and X-DB-Queries still count every statement.
+
+run() is for the rest of an async view's sync work (sessions, the cache,
+templates, access logs); it runs on the request's thread as sync_to_async
+does, with the same instrumentation.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .instrumentation import active_wrappers, inherited_wrappers
+
+_pool = {'executor': None, 'lock': threading.Lock()}
+
+
+def executor():
+    with _pool['lock']:
+        if _pool['executor'] is None:
+            _pool['executor'] = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'DASHBOARD_QUERY_WORKERS', 4),
+                thread_name_prefix='hpis-query',
+            )
+        return _pool['executor']
+
+
+def reset():
+    """Drop the pool so the next gather() builds one with the current DASHBOARD_QUERY_WORKERS"""
+    with _pool['lock']:
+        if _pool['executor'] is not None:
+            _pool['executor'].shutdown(wait=True)
+            _pool['executor'] = None
+
+
+def _call(wrappers, func):
+    close_old_connections()
+    with inherited_wrappers(wrappers):
+        return func()
+
+
+async def gather(**calls):
+    """{name: result} for each callable in `calls`, run concurrently on the query pool"""
+    loop = asyncio.get_running_loop()
+    wrappers = active_wrappers()
+    results = await asyncio.gather(*(
+        loop.run_in_executor(executor(), _call, wrappers, func) for func in calls.values()
+    ))
+    return dict(zip(calls, results))
+
+
+async def run(func, *args, **kwargs):
+    """func(*args, **kwargs) from an async view, on the request's thread"""
+    wrappers = active_wrappers()
+
+    def call():
+        with inherited_wrappers(wrappers):
+            return func(*args, **kwargs)
+
+    return await sync_to_async(call)()
@@ -0,0 +1,389 @@
+"""
+Synthetic data for load testing.
+
+DatasetGenerator fills every large table with plausible, seeded rows: the same
+`seed` and `scale` always produce the same data (relative to `end`). Rows are
+built lazily and written with bulk_create in batches, so memory stays flat at
+millions of rows. Generated rows are namespaced by the seed (usernames
+``g<seed>_...``, patient and medicine codes ``G<seed>-...``) and can sit next to
+real data.
+
+Row counts per unit of scale are in SCALE_UNIT; ``--scale 20`` gives about
+2 million access log rows.
+"""
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from inventory_meds.models import (
+    Medicine, MedicineAuditLog, MedicineProduct, DispenseRecord, StockMovement, Supplier,
+)
+from inventory_meds import search
+from records.models import PatientRecord, VisitLog
+from .models import AccessLog, NotificationPreference, PatientAppointment, UserProfile
+
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_PASSWORD = 'loadtest123'
+
+SCALE_UNIT = {
+    'users': 25,
+    'patients': 2000,
+    'appointments': 5000,
+    'visits': 8000,
+    'products': 200,
+    'medicines': 1000,
+    'stock_movements': 20000,
+    'dispenses': 10000,
+    'access_logs': 100000,
+    'audit_logs': 20000,
+}
+
+FIRST_NAMES = [
+    'Maria', 'Jose', 'Juan', 'Ana', 'Mark', 'Angel', 'Paul', 'Grace', 'John', 'Joy', 'Michael', 'Kristine',
+    'James', 'Mary', 'Carlo', 'Andrea', 'Miguel', 'Patricia', 'Rafael', 'Camille', 'Daniel', 'Nicole',
+]
+LAST_NAMES = [
+    'Santos', 'Reyes', 'Cruz', 'Bautista', 'Garcia', 'Mendoza', 'Torres', 'Flores', 'Gonzales', 'Ramos',
+    'Villanueva', 'Castillo', 'Aquino', 'Navarro', 'Dela Cruz', 'Fernandez', 'Lopez', 'Rivera', 'Tan', 'Lim',
+]
+DEPARTMENTS = ['General Medicine', 'Pediatrics', 'Cardiology', 'Orthopedics', 'Emergency', 'OB-GYN', 'Dermatology']
+DIAGNOSES = [
+    'Upper respiratory tract infection', 'Hypertension', 'Type 2 diabetes mellitus', 'Acute gastroenteritis',
+    'Urinary tract infection', 'Migraine', 'Allergic rhinitis', 'Lower back pain', 'Bronchial asthma',
+    'Dengue fever', 'Community-acquired pneumonia', 'Dermatitis',
+]
+ALLERGIES = ['None known', 'Penicillin', 'Sulfa drugs', 'Seafood', 'Peanuts', 'Aspirin', 'Latex']
+GENERIC_NAMES = [
+    'Paracetamol', 'Ibuprofen', 'Amoxicillin', 'Cefalexin', 'Azithromycin', 'Metformin', 'Amlodipine',
+    'Losartan', 'Atorvastatin', 'Omeprazole', 'Cetirizine', 'Loratadine', 'Salbutamol', 'Mefenamic Acid',
+    'Ciprofloxacin', 'Metronidazole', 'Co-trimoxazole', 'Ascorbic Acid', 'Ferrous Sulfate', 'Folic Acid',
+    'Losartan Potassium', 'Simvastatin', 'Carbocisteine', 'Ambroxol', 'Dextromethorphan', 'Loperamide',
+    'Oral Rehydration Salts', 'Hydrocortisone', 'Clotrimazole', 'Mupirocin', 'Prednisone', 'Diclofenac',
+]
+CATEGORIES = ['Analgesic', 'Antibiotic', 'Antihistamine', 'Cardiovascular', 'Gastrointestinal', 'Respiratory',
+              'Vitamin/Supplement', 'Anti-inflammatory']
+DOSAGE_FORMS = [('Tablet', 'tablet'), ('Capsule', 'capsule'), ('Syrup', 'bottle'), ('Injection', 'vial'),
+                ('Cream', 'tube')]
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/129.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_6) AppleWebKit/605.1.15 Version/17.6 Safari/605.1.15',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:131.0) Gecko/20100101 Firefox/131.0',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_6 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148',
+]
+ACCESS_TYPES = [('data_view', 60), ('login', 15), ('logout', 12), ('data_update', 8), ('failed_login', 3),
+                ('data_download', 2)]
+AUDIT_ACTIONS = [
+    (MedicineAuditLog.ACTION_DISPENSE, 45), (MedicineAuditLog.ACTION_UPDATE, 20),
+    (MedicineAuditLog.ACTION_STOCK_ADD, 15), (MedicineAuditLog.ACTION_STOCK_REDUCE, 10),
+    (MedicineAuditLog.ACTION_CREATE, 8), (MedicineAuditLog.ACTION_ARCHIVE, 2),
+]
+APPOINTMENT_TIMES = [time(8 + minutes // 60, minutes % 60) for minutes in range(0, 9 * 60, 30)]
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Let rows keep the created_at/updated_at/timestamp values they were built
+    with instead of auto_now/auto_now_add overwriting them with "now".
+    """
+    saved = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class DatasetGenerator:
+    def __init__(self, scale=1, seed=1, batch_size=DEFAULT_BATCH_SIZE, days=365, end=None, progress=None):
+        self.scale = scale
+        self.seed = seed
+        self.batch_size = batch_size
+        self.days = days
+        self.end = end or timezone.now().replace(microsecond=0)
+        self.progress = progress or (lambda table, count: None)
+        self.rng = random.Random(seed)
+        self.prefix = f'g{seed}'
+        self.code_prefix = f'G{seed}'
+
+    def count(self, table):
+        return max(1, int(SCALE_UNIT[table] * self.scale))
+
+    def exists(self):
+        return User.objects.filter(username__startswith=f'{self.prefix}_').exists()
+
+    # -- value helpers ---------------------------------------------------
+
+    def moment(self, days=None):
+        """A random aware datetime within the last `days` (default: the whole window)"""
+        return self.end - timedelta(seconds=self.rng.randrange(int((days or self.days) * 86400)))
+
+    def birth_date(self):
+        return self.end.date() - timedelta(days=self.rng.randrange(365, 90 * 365))
+
+    def full_name(self):
+        return f'{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}'
+
+    def ip_address(self):
+        return f'10.{self.rng.randrange(256)}.{self.rng.randrange(256)}.{self.rng.randrange(1, 255)}'
+
+    def weighted(self, choices):
+        values, weights = zip(*choices)
+        return self.rng.choices(values, weights)[0]
+
+    def insert(self, table, model, rows):
+        total = 0
+        for batch in batched(rows, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            total += len(batch)
+            self.progress(table, total)
+        return total
+
+    # -- tables ----------------------------------------------------------
+
+    def generate(self):
+        """Generate every table; returns {table: rows inserted}"""
+        counts = {}
+        with explicit_timestamps(User, UserProfile, NotificationPreference, PatientAppointment, AccessLog,
+                                 PatientRecord, VisitLog, Supplier, MedicineProduct, Medicine, StockMovement,
+                                 DispenseRecord):
+            counts['users'] = self.users()
+            counts['patients'] = self.patients()
+            counts['appointments'] = self.insert('appointments', PatientAppointment, self.appointments())
+            counts['visits'] = self.insert('visits', VisitLog, self.visits())
+            counts['medicines'] = self.catalogue()
+            counts['stock_movements'] = self.insert('stock_movements', StockMovement, self.stock_movements())
+            counts['dispenses'] = self.insert('dispenses', DispenseRecord, self.dispenses())
+            counts['access_logs'] = self.insert('access_logs', AccessLog, self.access_logs())
+            counts['audit_logs'] = self.insert('audit_logs', MedicineAuditLog, self.audit_logs())
+        search.bump_version()
+        return counts
+
+    def users(self):
+        # One hash for every account: hashing is deliberately slow
+        password = make_password(DEFAULT_PASSWORD)
+        n = self.count('users')
+        users = []
+        for i in range(n):
+            first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+            users.append(User(
+                username=f'{self.prefix}_user{i:05d}', first_name=first, last_name=last,
+                email=f'{self.prefix}.user{i:05d}@example.com', password=password,
+                date_joined=self.moment(), is_active=True,
+            ))
+        self.insert('users', User, users)
+
+        self.user_ids = list(
+            User.objects.filter(username__startswith=f'{self.prefix}_').order_by('id').values_list('id', flat=True)
+        )
+        # bulk_create skips the post_save signals that normally add these
+        profiles = []
+        for i, user_id in enumerate(self.user_ids):
+            created = self.moment()
+            profiles.append(UserProfile(
+                user_id=user_id, role='admin' if i % 10 == 0 else 'doctor',
+                department=self.rng.choice(DEPARTMENTS), license_number=f'PRC-{self.seed}-{i:05d}',
+                created_at=created, updated_at=created,
+            ))
+        self.insert('users', UserProfile, profiles)
+        self.insert('users', NotificationPreference, (
+            NotificationPreference(user_id=user_id, created_at=self.end, updated_at=self.end)
+            for user_id in self.user_ids
+        ))
+
+        self.profile_ids = list(
+            UserProfile.objects.filter(user_id__in=self.user_ids).order_by('id').values_list('id', flat=True)
+        )
+        return n
+
+    def patients(self):
+        today = self.end.date()
+
+        def rows():
+            for i in range(self.count('patients')):
+                born = self.birth_date()
+                yield PatientRecord(
+                    full_name=self.full_name(), date_of_birth=born,
+                    age=today.year - born.year - ((today.month, today.day) < (born.month, born.day)),
+                    gender=self.rng.choice('MFO'), department=self.rng.choice(DEPARTMENTS)[:50],
+                    attending_physician_id=self.rng.choice(self.user_ids),
+                    patient_code=f'{self.code_prefix}-{i:07d}', created_at=self.moment(),
+                )
+
+        n = self.insert('patients', PatientRecord, rows())
+        self.patient_ids = list(
+            PatientRecord.objects.filter(patient_code__startswith=f'{self.code_prefix}-')
+            .order_by('id').values_list('id', flat=True)
+        )
+        return n
+
+    def appointments(self):
+        today = self.end.date()
+        for _ in range(self.count('appointments')):
+            # Mostly history, with a month of upcoming appointments
+            day = today + timedelta(days=self.rng.randrange(-self.days, 31))
+            if day < today:
+                status = self.weighted([('completed', 80), ('cancelled', 15), ('confirmed', 5)])
+            else:
+                status = self.weighted([('pending', 40), ('assigned', 30), ('confirmed', 30)])
+            created = timezone.make_aware(datetime.combine(day, time(8))) - timedelta(
+                hours=self.rng.randrange(1, 24 * 30)
+            )
+            created = min(created, self.end)
+            first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+            yield PatientAppointment(
+                first_name=first, last_name=last, date_of_birth=self.birth_date(),
+                gender=self.rng.choice('MFO'), email=f'{first}.{last}@example.com'.lower().replace(' ', ''),
+                contact_number=f'09{self.rng.randrange(10 ** 9):09d}', address=f'{self.rng.randrange(1, 999)} Rizal St.',
+                appointment_type=self.weighted([('consultation', 50), ('followup', 25), ('checkup', 20),
+                                                ('emergency', 5)]),
+                appointment_date=day, appointment_time=self.rng.choice(APPOINTMENT_TIMES),
+                status=status,
+                assigned_doctor_id=None if status == 'pending' else self.rng.choice(self.user_ids),
+                created_at=created, updated_at=created,
+            )
+
+    def visits(self):
+        for _ in range(self.count('visits')):
+            yield VisitLog(
+                patient_id=self.rng.choice(self.patient_ids), clinician_id=self.rng.choice(self.user_ids),
+                visit_date=self.moment(), diagnosis=self.rng.choice(DIAGNOSES),
+                vitals=f'BP {self.rng.randrange(100, 160)}/{self.rng.randrange(60, 100)}, '
+                       f'HR {self.rng.randrange(55, 110)}, T {self.rng.uniform(36.0, 39.0):.1f}',
+                allergies=self.rng.choice(ALLERGIES), medications=self.rng.choice(GENERIC_NAMES),
+            )
+
+    def catalogue(self):
+        today = self.end.date()
+        suppliers = [
+            Supplier(name=f'{self.code_prefix} Supplier {i}', contact_email=f'supplier{i}@example.com',
+                     created_at=self.end, updated_at=self.end)
+            for i in range(10)
+        ]
+        self.insert('medicines', Supplier, suppliers)
+        supplier_ids = list(
+            Supplier.objects.filter(name__startswith=f'{self.code_prefix} Supplier ').values_list('id', flat=True)
+        )
+
+        # (name, strength) pairs are unique by construction
+        products = []
+        for i in range(self.count('products')):
+            form, unit = DOSAGE_FORMS[i % len(DOSAGE_FORMS)]
+            products.append(MedicineProduct(
+                name=f'{GENERIC_NAMES[i % len(GENERIC_NAMES)]} {self.code_prefix}',
+                strength=f'{(i // len(GENERIC_NAMES) + 1) * 5}mg', dosage_form=form, unit=unit,
+                category=self.rng.choice(CATEGORIES), prescription_only=self.rng.random() < 0.4,
+                created_at=self.end, updated_at=self.end,
+            ))
+        self.insert('medicines', MedicineProduct, products)
+        products = list(MedicineProduct.objects.filter(name__endswith=f' {self.code_prefix}').order_by('id'))
+
+        def rows():
+            for i in range(self.count('medicines')):
+                product = self.rng.choice(products)
+                received = self.moment()
+                medicine = Medicine(
+                    code=f'{self.code_prefix}-{i:07d}', name=product.name, dosage_form=product.dosage_form,
+                    strength=product.strength, unit=product.unit, category=product.category,
+                    prescription_only=product.prescription_only, manufacturer=self.rng.choice(LAST_NAMES) + ' Pharma',
+                    batch_number=f'{self.code_prefix}B{i:07d}', lot_number=f'L{self.rng.randrange(10 ** 6):06d}',
+                    date_received=received.date(),
+                    expires_on=today + timedelta(days=self.rng.randrange(-60, 3 * 365)),
+                    quantity_on_hand=self.weighted([(0, 5), (self.rng.randrange(1, 20), 15),
+                                                    (self.rng.randrange(20, 2000), 80)]),
+                    reorder_level=self.rng.choice([10, 20, 50, 100]),
+                    product_id=product.pk, supplier_id=self.rng.choice(supplier_ids),
+                    created_at=received, updated_at=received,
+                )
+                medicine.refresh_status()
+                yield medicine
+
+        n = self.insert('medicines', Medicine, rows())
+        MedicineProduct.refresh_totals([p.pk for p in products])
+        self.medicines = list(
+            Medicine.objects.filter(code__startswith=f'{self.code_prefix}-').order_by('id')
+            .values_list('id', 'batch_number', 'quantity_on_hand')
+        )
+        return n
+
+    def stock_movements(self):
+        for _ in range(self.count('stock_movements')):
+            medicine_id = self.rng.choice(self.medicines)[0]
+            kind = self.weighted([(StockMovement.MOVEMENT_OUT, 75), (StockMovement.MOVEMENT_IN, 20),
+                                  (StockMovement.MOVEMENT_ADJUST, 5)])
+            quantity = self.rng.randrange(1, 60)
+            if kind == StockMovement.MOVEMENT_OUT:
+                quantity, reason = -quantity, 'Dispensed'
+            elif kind == StockMovement.MOVEMENT_IN:
+                quantity, reason = quantity * 10, 'Delivery received'
+            else:
+                quantity, reason = self.rng.choice([-1, 1]) * quantity, 'Stock count correction'
+            performed = self.moment()
+            yield StockMovement(
+                medicine_id=medicine_id, movement_type=kind, quantity=quantity, reason=reason,
+                performed_by_id=self.rng.choice(self.profile_ids), performed_at=performed, created_at=performed,
+            )
+
+    def dispenses(self):
+        for _ in range(self.count('dispenses')):
+            medicine_id, batch_number, on_hand = self.rng.choice(self.medicines)
+            quantity = self.rng.randrange(1, 30)
+            dispensed = self.moment()
+            yield DispenseRecord(
+                medicine_id=medicine_id, patient_id=self.rng.choice(self.patient_ids), quantity=quantity,
+                prescribed_by_id=self.rng.choice(self.profile_ids), dispensed_by_id=self.rng.choice(self.profile_ids),
+                instructions='Take as directed', dispensed_at=dispensed, created_at=dispensed,
+                stock_before=on_hand + quantity, stock_after=on_hand, batch_number=batch_number,
+            )
+
+    def access_logs(self):
+        for _ in range(self.count('access_logs')):
+            access_type = self.weighted(ACCESS_TYPES)
+            yield AccessLog(
+                user_id=self.rng.choice(self.user_ids), access_type=access_type, ip_address=self.ip_address(),
+                user_agent=self.rng.choice(USER_AGENTS), description=access_type.replace('_', ' ').capitalize(),
+                timestamp=self.moment(),
+            )
+
+    def audit_logs(self):
+        for _ in range(self.count('audit_logs')):
+            medicine_id = self.rng.choice(self.medicines)[0]
+            action = self.weighted(AUDIT_ACTIONS)
+            changes, patient_id = {}, None
+            if action == MedicineAuditLog.ACTION_DISPENSE:
+                patient_id = self.rng.choice(self.patient_ids)
+                old = self.rng.randrange(30, 500)
+                changes = {'quantity_on_hand': [old, old - self.rng.randrange(1, 30)]}
+            elif action in (MedicineAuditLog.ACTION_STOCK_ADD, MedicineAuditLog.ACTION_STOCK_REDUCE):
+                old = self.rng.randrange(30, 500)
+                delta = self.rng.randrange(1, 200)
+                changes = {'quantity_on_hand': [old, old + delta if action == MedicineAuditLog.ACTION_STOCK_ADD
+                                                else max(old - delta, 0)]}
+            elif action == MedicineAuditLog.ACTION_UPDATE:
+                changes = {'reorder_level': [self.rng.choice([10, 20]), self.rng.choice([50, 100])]}
+            elif action == MedicineAuditLog.ACTION_ARCHIVE:
+                changes = {'status': [Medicine.STATUS_ACTIVE, Medicine.STATUS_DISCONTINUED]}
+            field_name, (old_value, new_value) = next(iter(changes.items()), ('', ('', '')))
+            yield MedicineAuditLog(
+                medicine_id=medicine_id, action=action, user_id=self.rng.choice(self.profile_ids),
+                field_name=field_name, old_value=str(old_value), new_value=str(new_value), changes=changes,
+                patient_id=patient_id, ip_address=self.ip_address(), timestamp=self.moment(),
+            )
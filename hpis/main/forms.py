@@ -2,6 +2,11 @@ from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import PasswordChangeForm
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .appointment_actions import MAX_BATCH
+from .models import PatientAppointment
+from .widgets import RemoteSelect
 
 class LoginForm(forms.Form):
     """Login form for staff members"""
@@ -146,6 +151,67 @@ class NotificationPreferencesForm(forms.Form):
         widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
     )
 
+class AppointmentRequestForm(forms.Form):
+    """Public appointment request from the landing page; field names match its inputs"""
+
+    first_name = forms.CharField(max_length=100)
+    last_name = forms.CharField(max_length=100)
+    middle_name = forms.CharField(max_length=100, required=False)
+    dob = forms.DateField()
+    gender = forms.ChoiceField(choices=PatientAppointment._meta.get_field('gender').choices)
+    email = forms.EmailField()
+    contact = forms.CharField(max_length=20)
+    address = forms.CharField(max_length=500)
+    appointment_type = forms.ChoiceField(choices=PatientAppointment.APPOINTMENT_TYPE_CHOICES)
+    available_date = forms.DateField()
+    notes = forms.CharField(required=False, max_length=2000)
+
+    def clean_dob(self):
+        dob = self.cleaned_data['dob']
+        if dob > timezone.localdate():
+            raise ValidationError("Date of birth cannot be in the future.")
+        return dob
+
+    def clean_available_date(self):
+        date = self.cleaned_data['available_date']
+        if date < timezone.localdate():
+            raise ValidationError("Preferred date cannot be in the past.")
+        return date
+
+
+class BulkAppointmentActionForm(forms.Form):
+    """Bulk status change for appointments ticked in a dashboard queue"""
+
+    action = forms.ChoiceField(choices=[
+        ('assign', 'Assign'),
+        ('confirm', 'Confirm'),
+        ('complete', 'Complete'),
+        ('cancel', 'Cancel'),
+    ])
+    doctor = forms.ModelChoiceField(
+        queryset=User.objects.filter(profile__role='doctor', is_active=True),
+        required=False,
+        widget=RemoteSelect('doctor_lookup', placeholder='Search doctor...'),
+    )
+    appointment_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    appointment_time = forms.TimeField(required=False, widget=forms.TimeInput(attrs={'type': 'time'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        try:
+            ids = [int(value) for value in self.data.getlist('appointment_ids')]
+        except ValueError:
+            raise ValidationError("Invalid appointment selection.")
+        if not ids:
+            raise ValidationError("Select at least one appointment.")
+        if len(ids) > MAX_BATCH:
+            raise ValidationError(f"Select at most {MAX_BATCH} appointments at a time.")
+        if cleaned_data.get('action') == 'assign' and not cleaned_data.get('doctor'):
+            raise ValidationError("Choose a doctor to assign the selected appointments to.")
+        cleaned_data['appointment_ids'] = ids
+        return cleaned_data
+
+
 # # Custom Signup Form
 # class SignupForm(UserCreationForm):
 #     email = forms.EmailField(required=True)
@@ -0,0 +1,73 @@
+"""
+Per-user widget caching for dashboards.
+
+A widget is the data behind one part of a page (counts, chart series,
+appointment lists), cached under
+(widget, role, user or department, data version, parameters). The data
+version comes from the invalidation bus (main/invalidation.py), so a change
+to a Medicine, PatientAppointment or UserProfile row retires every widget
+built on it without any explicit delete. FRAGMENT_CACHE_SECONDS only bounds
+how long an unchanged widget lives.
+
+Scopes:
+    'user'        per signed-in user (a doctor's own appointments)
+    'department'  shared by users of the same role and department
+    'role'        shared by everyone with the same role
+    'global'      the same for everyone (inventory counts)
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import concurrency, invalidation
+
+SCOPES = ('user', 'department', 'role', 'global')
+
+
+def widget_key(request, widget, namespaces, scope='role', params=None):
+    if scope not in SCOPES:
+        raise ValueError(f"scope must be one of {', '.join(SCOPES)}")
+    if scope == 'global':
+        owner = 'all'
+    else:
+        principal = request.principal
+        role = principal.role or 'anonymous'
+        if scope == 'user':
+            owner = f'{role}:u{principal.user_id}'
+        elif scope == 'department':
+            owner = f'{role}:d{principal.department or "-"}'
+        else:
+            owner = role
+    version = '.'.join(str(v) for v in invalidation.versions(*namespaces))
+    key = f'widget:{widget}:{owner}:{version}'
+    if params:
+        digest = hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        key = f'{key}:{digest}'
+    return key
+
+
+def cached_widget(request, widget, compute, namespaces, scope='role', params=None, timeout=None):
+    """
+    Return compute() for this widget, from the cache when the data it is built
+    on has not changed. `namespaces` names the invalidation namespaces the
+    widget reads; `params` holds anything else the result depends on, such as
+    filters or today's date.
+    """
+    key = widget_key(request, widget, namespaces, scope, params)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout or getattr(settings, 'FRAGMENT_CACHE_SECONDS', 300))
+    return value
+
+
+async def acached_widget(request, widget, compute, namespaces, scope='role', params=None, timeout=None):
+    """cached_widget() for async views; `compute` is a coroutine function"""
+    key = await concurrency.run(widget_key, request, widget, namespaces, scope, params)
+    value = await concurrency.run(cache.get, key)
+    if value is None:
+        value = await compute()
+        await concurrency.run(cache.set, key, value, timeout or getattr(settings, 'FRAGMENT_CACHE_SECONDS', 300))
+    return value
@@ -0,0 +1,182 @@
+"""
+SQL instrumentation: per-request query counts, DB time, slowest statements and
+repeated-query (N+1) patterns, plus per-view query budgets.
+
+Queries are captured with connection.execute_wrapper, so this works with
+DEBUG off and does not depend on connection.queries. Statements are grouped
+by their SQL text, which Django keeps separate from the parameters, so the
+same query run in a loop with different ids shows up as one repeated pattern.
+Parameters are never recorded: they can hold patient data.
+
+Wrappers installed with wrapping_queries() also follow work handed to the
+query pool in main/concurrency.py, so statements run concurrently on other
+threads count towards the request that started them.
+"""
+import contextvars
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('hpis.sql')
+
+SLOWEST_REPORTED = 5
+MAX_LOGGED_SQL = 500
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view ran more queries than its query_budget allows (raised in strict mode)"""
+
+
+# Execute wrappers active in the current context, for worker threads to inherit
+_wrappers = contextvars.ContextVar('hpis_query_wrappers', default=())
+
+
+def active_wrappers():
+    return _wrappers.get()
+
+
+@contextmanager
+def inherited_wrappers(wrappers):
+    """Install `wrappers`, captured in another thread, on this thread's connections"""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            for wrapper in wrappers:
+                if wrapper not in connection.execute_wrappers:
+                    stack.enter_context(connection.execute_wrapper(wrapper))
+        yield
+
+
+@contextmanager
+def wrapping_queries(wrapper):
+    """
+    Pass every statement run by this thread, and by the query pool on its
+    behalf, through `wrapper` (see connection.execute_wrapper).
+    """
+    previous = _wrappers.get()
+    _wrappers.set(previous + (wrapper,))
+    try:
+        with inherited_wrappers((wrapper,)):
+            yield
+    finally:
+        _wrappers.set(previous)
+
+
+class QueryRecorder:
+    """
+    Context manager recording every statement run on any database connection
+    of the current thread, or by the query pool for it, while it is active.
+    """
+
+    def __init__(self):
+        self.statements = []  # (sql, milliseconds)
+        self._context = None
+
+    def __enter__(self):
+        self._context = wrapping_queries(self)
+        self._context.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._context.__exit__(*exc_info)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.statements.append((sql, (time.perf_counter() - started) * 1000))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def total_ms(self):
+        return sum(ms for _, ms in self.statements)
+
+    def slowest(self, limit=SLOWEST_REPORTED):
+        return sorted(self.statements, key=lambda s: s[1], reverse=True)[:limit]
+
+    def repeated(self, threshold=None):
+        """[(sql, count)] for statements run at least `threshold` times, most frequent first"""
+        threshold = threshold or _setting('SQL_REPEATED_QUERY_THRESHOLD', 3)
+        counts = Counter(sql for sql, _ in self.statements)
+        return [(sql, n) for sql, n in counts.most_common() if n >= threshold]
+
+    @property
+    def duplicates(self):
+        """Executions beyond the first of each distinct statement"""
+        return self.count - len({sql for sql, _ in self.statements})
+
+    def summary(self):
+        return {
+            'queries': self.count,
+            'db_ms': round(self.total_ms, 2),
+            'duplicates': self.duplicates,
+            'slowest': [{'ms': round(ms, 2), 'sql': sql[:MAX_LOGGED_SQL]} for sql, ms in self.slowest()],
+            'repeated': [{'count': n, 'sql': sql[:MAX_LOGGED_SQL]} for sql, n in self.repeated()],
+        }
+
+
+def budgets_are_strict():
+    """Budgets fail hard when QUERY_BUDGET_STRICT is on (see hpis.test_runner), and only warn otherwise"""
+    return bool(_setting('QUERY_BUDGET_STRICT', False))
+
+
+def query_budget(max_queries, max_repeated=None):
+    """
+    Declare how many queries a view may run, counting the decorators below it.
+    Put it above role_required to include the profile lookup.
+
+    `max_repeated` caps how often any single statement may repeat, which
+    catches N+1 loops that a generous total budget would let through.
+    """
+    def decorator(view_func):
+        def check(recorder):
+            problems = []
+            if recorder.count > max_queries:
+                problems.append(f"ran {recorder.count} queries, budget is {max_queries}")
+            if max_repeated is not None:
+                for sql, n in recorder.repeated(threshold=max_repeated + 1):
+                    problems.append(f"repeated {n} times (max {max_repeated}): {sql[:MAX_LOGGED_SQL]}")
+            if problems:
+                message = f"{view_func.__module__}.{view_func.__name__} " + '; '.join(problems)
+                if budgets_are_strict():
+                    raise QueryBudgetExceeded(message)
+                logger.warning("Query budget exceeded: %s", message)
+
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def wrapper(request, *args, **kwargs):
+                # The view's sync work runs on another thread, which inherits the recorder from here
+                recorder = QueryRecorder()
+                previous = _wrappers.get()
+                _wrappers.set(previous + (recorder,))
+                try:
+                    response = await view_func(request, *args, **kwargs)
+                finally:
+                    _wrappers.set(previous)
+                check(recorder)
+                return response
+        else:
+            @wraps(view_func)
+            def wrapper(request, *args, **kwargs):
+                with QueryRecorder() as recorder:
+                    response = view_func(request, *args, **kwargs)
+                check(recorder)
+                return response
+
+        wrapper.query_budget = max_queries
+        return wrapper
+
+    return decorator
@@ -0,0 +1,90 @@
+"""
+Public appointment intake for the landing page form.
+
+Each request goes through:
+
+1. IntakeThrottle (main/throttle.py), INTAKE_THROTTLE_LIMIT requests per
+   client IP per INTAKE_THROTTLE_WINDOW seconds.
+2. An idempotency key: a SHA-256 of the patient's name and date of birth,
+   the preferred date and the appointment type, normalised for case and
+   spacing. `cache.add()` on that key is the dedupe precheck, atomic in
+   Redis, so a first request costs no query before its insert. When the key
+   is already taken, one indexed query checks that the earlier request is
+   still open: a cancelled request may be made again, as the
+   unique_open_intake_key constraint on the row allows.
+3. One INSERT before the response, so the visitor is only told the request
+   was received once the row is written. A duplicate that slips past
+   the precheck (two concurrent submissions, or an expired cache entry) trips
+   unique_open_intake_key and is answered as DUPLICATE. The row's post_save
+   signals bump the `appointment` cache namespace and publish the change feed
+   event.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from . import metrics
+from .models import PatientAppointment
+
+ACCEPTED = 'accepted'
+DUPLICATE = 'duplicate'
+
+
+def _normalise(value):
+    return ' '.join(str(value or '').split()).casefold()
+
+
+def intake_key(data):
+    """Idempotency key for cleaned AppointmentRequestForm data"""
+    parts = [
+        data['first_name'], data['last_name'], data['dob'].isoformat(),
+        data['available_date'].isoformat(), data['appointment_type'],
+    ]
+    return hashlib.sha256('|'.join(_normalise(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+def _is_open(key):
+    return PatientAppointment.objects.filter(intake_key=key).exclude(status='cancelled').exists()
+
+
+def submit(data):
+    """
+    Store an appointment request from cleaned AppointmentRequestForm data.
+    Returns ACCEPTED, or DUPLICATE when the same request was already received.
+    """
+    key = intake_key(data)
+    dedupe_seconds = getattr(settings, 'INTAKE_DEDUPE_SECONDS', 86400)
+    if not cache.add(f'intake:{key}', 1, dedupe_seconds):
+        if _is_open(key):
+            metrics.INTAKE_REQUESTS.inc(result=DUPLICATE)
+            return DUPLICATE
+        # The earlier request was cancelled; this one replaces it
+        cache.set(f'intake:{key}', 1, dedupe_seconds)
+
+    appointment = PatientAppointment(
+        first_name=data['first_name'],
+        last_name=data['last_name'],
+        middle_name=data['middle_name'],
+        date_of_birth=data['dob'],
+        gender=data['gender'],
+        email=data['email'],
+        contact_number=data['contact'],
+        address=data['address'],
+        appointment_type=data['appointment_type'],
+        appointment_date=data['available_date'],
+        notes=data['notes'],
+        status='pending',
+        intake_key=key,
+    )
+    try:
+        with transaction.atomic():
+            appointment.save()
+    except IntegrityError:
+        if not _is_open(key):
+            raise
+        metrics.INTAKE_REQUESTS.inc(result=DUPLICATE)
+        return DUPLICATE
+    metrics.INTAKE_REQUESTS.inc(result=ACCEPTED)
+    return ACCEPTED
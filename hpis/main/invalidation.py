@@ -0,0 +1,91 @@
+"""
+Cross-worker invalidation for the two-tier cache (main/cache.py).
+
+bump('medicine') increments that namespace's CacheVersion row once the
+current transaction commits and clears this process's L1 cache.
+CacheInvalidationMiddleware calls poll() before each request; at most every
+CACHE_INVALIDATION_POLL_SECONDS it reads all versions in one query and clears
+L1 when any moved, so other workers catch up within that interval. The table
+works on SQLite and Postgres alike, and the poll is a primary-key scan of a
+handful of rows.
+"""
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .metrics import registry
+from .models import CacheVersion
+
+NAMESPACES = ('medicine', 'appointment', 'profile')
+
+L1_INVALIDATIONS = registry.counter(
+    'hpis_cache_l1_invalidations_total',
+    'L1 cache clears: origin is local for changes made in this worker, remote for ones seen by polling.',
+    ('origin',),
+)
+
+_state = {'versions': None, 'next_poll': 0.0}
+
+
+def clear_local():
+    """Clear the L1 tier of every two-tier cache in this process"""
+    from .cache import TieredCache
+
+    for alias in settings.CACHES:
+        backend = caches[alias]
+        if isinstance(backend, TieredCache):
+            backend.clear_local()
+
+
+def _write(namespaces):
+    now = timezone.now()
+    for namespace in namespaces:
+        updated = CacheVersion.objects.filter(namespace=namespace).update(version=F('version') + 1, updated_at=now)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    CacheVersion.objects.create(namespace=namespace, version=1)
+            except IntegrityError:
+                # Another worker created it first
+                CacheVersion.objects.filter(namespace=namespace).update(version=F('version') + 1, updated_at=now)
+    # L1 is cleared after every bump so far, so the next poll need not clear it again
+    _state['versions'] = dict(CacheVersion.objects.values_list('namespace', 'version'))
+    clear_local()
+    L1_INVALIDATIONS.inc(origin='local')
+
+
+def bump(*namespaces):
+    """Invalidate L1 copies in every worker once the current transaction commits"""
+    transaction.on_commit(partial(_write, namespaces))
+
+
+def poll_due():
+    return time.monotonic() >= _state['next_poll']
+
+
+def poll(force=False):
+    """Clear L1 if another worker bumped a namespace since the last poll"""
+    now = time.monotonic()
+    if not force and now < _state['next_poll']:
+        return
+    _state['next_poll'] = now + getattr(settings, 'CACHE_INVALIDATION_POLL_SECONDS', 1)
+    try:
+        versions = dict(CacheVersion.objects.values_list('namespace', 'version'))
+    except DatabaseError:
+        return  # table not migrated yet
+    if _state['versions'] is not None and versions != _state['versions']:
+        clear_local()
+        L1_INVALIDATIONS.inc(origin='remote')
+    _state['versions'] = versions
+
+
+def versions(*namespaces):
+    """Versions of `namespaces` as of the last poll or local bump (0 when never bumped)"""
+    poll()
+    known = _state['versions'] or {}
+    return [known.get(namespace, 0) for namespace in namespaces]
@@ -0,0 +1,70 @@
+"""
+Helpers for remote (AJAX) foreign-key lookups.
+
+Endpoints answer ``?q=<prefix>&page=<n>`` with a small page of
+``{"results": [{"id", "text"}], "pagination": {"more"}}`` (the select2 format),
+so forms never have to render a whole table into a <select>.
+"""
+from django.db.models import Q
+from django.http import JsonResponse
+
+LOOKUP_PAGE_SIZE = 20
+LOOKUP_MAX_PAGE = 50
+
+
+def prefix_filter(queryset, term, fields):
+    """Case-insensitive prefix match on any of `fields` (backed by prefix indexes)"""
+    term = ' '.join((term or '').split())
+    if not term:
+        return queryset
+    q = Q()
+    for field in fields:
+        q |= Q(**{f'{field}__istartswith': term})
+    return queryset.filter(q)
+
+
+def lookup_response(request, queryset, search_fields, label=str):
+    """Paginated JSON page of `queryset` filtered by the `q` prefix"""
+    try:
+        page = min(max(int(request.GET.get('page', 1)), 1), LOOKUP_MAX_PAGE)
+    except ValueError:
+        page = 1
+
+    queryset = prefix_filter(queryset, request.GET.get('q', ''), search_fields)
+    offset = (page - 1) * LOOKUP_PAGE_SIZE
+    # Fetch one extra row instead of running COUNT(*) to know if there is more
+    rows = list(queryset[offset:offset + LOOKUP_PAGE_SIZE + 1])
+
+    return JsonResponse({
+        'results': [{'id': obj.pk, 'text': label(obj)} for obj in rows[:LOOKUP_PAGE_SIZE]],
+        'pagination': {'more': len(rows) > LOOKUP_PAGE_SIZE},
+    })
+
+
+def install_prefix_indexes(conn, table, columns):
+    """
+    Create indexes that serve Django's ``istartswith`` for `columns` of `table`.
+
+    PostgreSQL emits ``UPPER(col::text) LIKE UPPER(%s)``, which needs a
+    text_pattern_ops index on that expression; SQLite's LIKE is
+    case-insensitive and uses an index only with NOCASE collation.
+    """
+    with conn.cursor() as cursor:
+        for column in columns:
+            name = f'{table}_{column}_prefix'
+            if conn.vendor == 'postgresql':
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+                    f'((UPPER("{column}"::text)) text_pattern_ops)'
+                )
+            elif conn.vendor == 'sqlite':
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {name} ON {table} ("{column}" COLLATE NOCASE)'
+                )
+
+
+def drop_prefix_indexes(conn, table, columns):
+    with conn.cursor() as cursor:
+        for column in columns:
+            if conn.vendor in ('postgresql', 'sqlite'):
+                cursor.execute(f'DROP INDEX IF EXISTS {table}_{column}_prefix')
@@ -0,0 +1,134 @@
+import json
+import platform
+import sys
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from main import concurrency
+from main.benchmarks import VIEW_CASES, run_cases
+from main.dataset import DatasetGenerator
+from main.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the hot views at several data scales on a throwaway test database '
+            'and write p50/p95 latency, query counts and peak memory as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='0.1,0.5,1',
+                            help='Comma-separated generate_dataset scales, smallest first')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--views', default='',
+                            help='Comma-separated view names to run (default: all)')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Keep the cache between requests (default: cleared before each one)')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Reuse the test database; seeding still adds each scale')
+        parser.add_argument('--db-latency-ms', type=float, default=0,
+                            help='Round trip added to every statement, to stand in for a remote database')
+        parser.add_argument('--query-workers', default='',
+                            help='Comma-separated DASHBOARD_QUERY_WORKERS to run every case with, '
+                                 'e.g. 1,4 (default: the configured value)')
+        parser.add_argument('--output', default='benchmark-results.json')
+
+    def handle(self, *args, **options):
+        try:
+            scales = sorted(float(s) for s in options['scales'].split(',') if s.strip())
+        except ValueError:
+            raise CommandError('--scales must be numbers, e.g. 0.1,1,5')
+        if not scales or scales[0] <= 0:
+            raise CommandError('--scales must be positive.')
+        names = {n.strip() for n in options['views'].split(',') if n.strip()}
+        cases = [case for case in VIEW_CASES if not names or case.name in names]
+        if not cases:
+            raise CommandError(f"No such views; choose from {', '.join(c.name for c in VIEW_CASES)}.")
+        try:
+            workers = [int(w) for w in options['query_workers'].split(',') if w.strip()]
+        except ValueError:
+            raise CommandError('--query-workers must be whole numbers, e.g. 1,4')
+        if any(w < 1 for w in workers):
+            raise CommandError('--query-workers must be at least 1.')
+
+        report = {
+            'meta': {
+                'started_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'django': django.get_version(),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'warmup': options['warmup'],
+                'repeat': options['repeat'],
+                'cache': 'warm' if options['warm_cache'] else 'cold',
+                'db_latency_ms': options['db_latency_ms'],
+            },
+            'runs': [],
+        }
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            seeded = 0
+            for index, scale in enumerate(scales):
+                # Each scale tops up the previous one with a dataset under a new seed
+                generator = DatasetGenerator(scale=scale - seeded, seed=1000 + index)
+                self.stdout.write(f'Seeding scale {scale:g}...')
+                counts = generator.generate()
+                seeded = scale
+
+                users = {role: self.benchmark_user(role) for role in ('super_admin', 'admin', 'doctor')}
+                for worker_count in workers or [None]:
+                    results = self.run_with_workers(
+                        worker_count, users, cases,
+                        warmup=max(0, options['warmup']), repeat=max(1, options['repeat']),
+                        cold_cache=not options['warm_cache'], latency_ms=max(0, options['db_latency_ms']),
+                    )
+                    report['runs'].append({
+                        'scale': scale, 'query_workers': worker_count or settings.DASHBOARD_QUERY_WORKERS,
+                        'rows_added': counts, 'results': results,
+                    })
+                    self.write_table(scale, results, worker_count)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as handle:
+            json.dump(report, handle, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+    def run_with_workers(self, worker_count, users, cases, **options):
+        """run_cases() with the dashboard query pool resized to `worker_count` (None keeps it)"""
+        if worker_count is None:
+            return run_cases(users, cases, **options)
+        with override_settings(DASHBOARD_QUERY_WORKERS=worker_count):
+            concurrency.reset()
+            try:
+                return run_cases(users, cases, **options)
+            finally:
+                concurrency.reset()
+
+    def benchmark_user(self, role):
+        """The first generated user with `role`, or a dedicated one at scales too small to have it"""
+        user = User.objects.filter(profile__role=role).order_by('id').first()
+        if user is None:
+            user, _ = User.objects.get_or_create(username=f'benchmark_{role}')
+            UserProfile.objects.update_or_create(user=user, defaults={'role': role})
+        return user
+
+    def write_table(self, scale, results, worker_count=None):
+        self.stdout.write(f'\nScale {scale:g}' + (f', {worker_count} query workers' if worker_count else ''))
+        self.stdout.write(
+            f"{'view':<36}{'status':>7}{'p50 ms':>10}{'p95 ms':>10}{'queries':>9}{'slowest q':>11}{'peak KiB':>11}"
+        )
+        for row in results:
+            self.stdout.write(
+                f"{row['view']:<36}{row['status']:>7}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+                f"{row['queries']:>9}{row['slowest_query_ms']:>11.1f}{row['peak_kib']:>11.1f}"
+            )
+        self.stdout.write('')
@@ -0,0 +1,78 @@
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from main.dataset import DEFAULT_BATCH_SIZE, DEFAULT_PASSWORD, SCALE_UNIT, DatasetGenerator
+
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic synthetic dataset for load testing (rows per unit of scale: %s)' % (
+        ', '.join(f'{table}={count}' for table, count in SCALE_UNIT.items())
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1, help='Multiplier for every table size')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Random seed; also namespaces the generated rows')
+        parser.add_argument('--days', type=int, default=365, help='Spread timestamps over this many days')
+        parser.add_argument('--end-date', help='Last day of the window (YYYY-MM-DD, default today); '
+                                               'pin it to reproduce the exact same rows later')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--force', action='store_true',
+                            help='Run against a database that may hold real data (DEBUG off or a remote host); '
+                                 'the generated accounts share a known password')
+
+    def unsafe_database(self):
+        """Why the default database may hold real data, or None for a local development one"""
+        if not settings.DEBUG:
+            return 'DEBUG is off'
+        host = connection.settings_dict.get('HOST') or ''
+        if connection.vendor != 'sqlite' and host not in ('', 'localhost', '127.0.0.1', '::1'):
+            return f'The database is on {host}'
+        return None
+
+    def handle(self, *args, **options):
+        if not options['force'] and (reason := self.unsafe_database()):
+            raise CommandError(
+                f'{reason}, so this may be a production database. generate_dataset creates active admin '
+                f"and doctor accounts with the password '{DEFAULT_PASSWORD}'; pass --force to run anyway."
+            )
+        if options['scale'] <= 0:
+            raise CommandError('--scale must be positive.')
+
+        end = None
+        if options['end_date']:
+            try:
+                day = datetime.strptime(options['end_date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--end-date must be YYYY-MM-DD.')
+            end = timezone.make_aware(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+
+        def progress(table, count):
+            self.stdout.write(f'\r{table}: {count:,}', ending='')
+            self.stdout.flush()
+
+        generator = DatasetGenerator(
+            scale=options['scale'], seed=options['seed'], days=max(1, options['days']),
+            batch_size=max(1, options['batch_size']), end=end, progress=progress,
+        )
+        if generator.exists():
+            raise CommandError(
+                f"A dataset for seed {options['seed']} already exists; use a different --seed."
+            )
+
+        began = time.monotonic()
+        counts = generator.generate()
+        elapsed = time.monotonic() - began
+
+        self.stdout.write('')
+        for table, count in counts.items():
+            self.stdout.write(f'{table:>16}: {count:,}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {sum(counts.values()):,} rows in {elapsed:.1f}s. '
+            f"Users are {generator.prefix}_userNNNNN with password '{DEFAULT_PASSWORD}'."
+        ))
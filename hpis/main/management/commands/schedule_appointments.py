@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main import scheduling
+
+
+class Command(BaseCommand):
+    help = 'Assign every pending appointment to the earliest free doctor slot (see main/scheduling.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--department', help='Only schedule with doctors of this department')
+        parser.add_argument('--days', type=int, default=settings.SCHEDULER_HORIZON_DAYS,
+                            help='How many days past the requested date to look for a slot')
+        parser.add_argument('--dry-run', action='store_true', help='Print the plan without saving it')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1.')
+
+        result = scheduling.schedule(
+            department=options['department'], horizon_days=options['days'], commit=not options['dry_run'],
+        )
+
+        for conflict in result.conflicts:
+            appointment = conflict.appointment
+            self.stdout.write(self.style.WARNING(
+                f'#{appointment.pk} {appointment.first_name} {appointment.last_name} '
+                f'({appointment.appointment_type}, {appointment.appointment_date}): {conflict.reason}'
+            ))
+        verb = 'Assigned' if result.committed else 'Would assign'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {len(result.assignments):,} appointments, {len(result.conflicts):,} conflicts, '
+            f'in {result.elapsed:.2f}s.'
+        ))
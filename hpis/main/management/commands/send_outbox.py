@@ -0,0 +1,57 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from main import outbox
+
+
+class Command(BaseCommand):
+    help = ('Send the due emails in the outbox in batches, one connection per batch (see main/outbox.py); '
+            'with --loop keep polling for new ones')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE,
+                            help='Emails claimed and sent over one connection at a time')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for due emails')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to wait when the outbox is empty (with --loop)')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        try:
+            while True:
+                totals = self.drain(options['batch_size'])
+                if not options['loop']:
+                    break
+                if any(totals.values()):
+                    self.report(totals)
+                time.sleep(options['interval'])
+                close_old_connections()
+        except KeyboardInterrupt:
+            return
+        self.report(totals)
+
+    def drain(self, batch_size):
+        """Send batches until nothing is due"""
+        totals = dict.fromkeys(('sent', 'skipped', 'retried', 'failed'), 0)
+        while True:
+            result = outbox.dispatch(batch_size)
+            for name in totals:
+                totals[name] += len(getattr(result, name))
+            for email in result.failed:
+                self.stderr.write(self.style.ERROR(
+                    f'#{email.pk} to {email.to_email} failed after {email.attempts} attempts: {email.last_error}'
+                ))
+            if len(result) < batch_size:
+                return totals
+
+    def report(self, totals):
+        style = self.style.SUCCESS if not (totals['retried'] or totals['failed']) else self.style.WARNING
+        self.stdout.write(style(
+            f"Sent {totals['sent']:,} emails, skipped {totals['skipped']:,} by preference, "
+            f"{totals['retried']:,} to retry, {totals['failed']:,} failed."
+        ))
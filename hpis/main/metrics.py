@@ -0,0 +1,279 @@
+"""
+In-process metrics registry rendered in the Prometheus text format.
+
+Counters and histograms live in memory per process. With METRICS_DIR set,
+every worker writes a JSON snapshot of its own values to
+METRICS_DIR/worker-<pid>.json at most every METRICS_FLUSH_SECONDS, and the
+worker answering /metrics adds up all snapshots, so gunicorn workers report
+as one. Snapshots of exited workers are kept, which keeps counters
+monotonic; clear the directory on deploy.
+
+Gauges are callbacks evaluated at scrape time (queue depths are read from the
+database then), so they are never written to snapshots.
+"""
+import atexit
+import copy
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labels=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.samples = {}  # label values tuple -> value
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.samples[key] = self.samples.get(key, 0) + amount
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def render(self, samples):
+        lines = self.header()
+        for key, value in sorted(samples.items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_number(value)}')
+        return lines
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labels=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            # [per-bucket counts (not cumulative; last is +Inf), sum, count]
+            sample = self.samples.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    break
+            else:
+                index = len(self.buckets)
+            sample[0][index] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    @staticmethod
+    def merge(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def render(self, samples):
+        lines = self.header()
+        for key, (counts, total, count) in sorted(samples.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                labels = _format_labels(self.labels, key, [('le', _format_number(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {_format_number(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, registry, name, documentation, labels=(), callback=None):
+        super().__init__(registry, name, documentation, labels)
+        self.callback = callback  # () -> {label values tuple: value}
+
+    def render(self, samples=None):
+        lines = self.header()
+        for key, value in sorted(self.callback().items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_number(value)}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self._flushed_at = 0.0
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._add(Counter(self, name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._add(Histogram(self, name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, labels=(), callback=None):
+        return self._add(Gauge(self, name, documentation, labels, callback))
+
+    # ---- multi-worker snapshots ----
+
+    @property
+    def directory(self):
+        path = getattr(settings, 'METRICS_DIR', None)
+        return Path(path) if path else None
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: [[list(key), copy.deepcopy(value)] for key, value in metric.samples.items()]
+                for name, metric in self.metrics.items() if not isinstance(metric, Gauge)
+            }
+
+    def flush(self):
+        directory = self.directory
+        if directory is None:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        target = directory / f'worker-{os.getpid()}.json'
+        temporary = target.with_suffix('.tmp')
+        temporary.write_text(json.dumps(self.snapshot()))
+        os.replace(temporary, target)
+        self._flushed_at = time.monotonic()
+
+    def flush_due(self):
+        return time.monotonic() - self._flushed_at >= getattr(settings, 'METRICS_FLUSH_SECONDS', 5)
+
+    def maybe_flush(self):
+        if self.flush_due():
+            self.flush()
+
+    def collect(self):
+        """{metric name: {label values: value}} summed over this process and every snapshot"""
+        merged = {name: {} for name in self.metrics}
+
+        def add(name, samples):
+            metric = self.metrics.get(name)
+            if metric is None or isinstance(metric, Gauge):
+                return
+            target = merged[name]
+            for key, value in samples:
+                key = tuple(key)
+                target[key] = metric.merge(target[key], value) if key in target else value
+
+        own = self.snapshot()
+        for name, samples in own.items():
+            add(name, samples)
+
+        directory = self.directory
+        if directory is not None and directory.is_dir():
+            own_file = f'worker-{os.getpid()}.json'
+            for path in directory.glob('worker-*.json'):
+                if path.name == own_file:
+                    continue
+                try:
+                    snapshot = json.loads(path.read_text())
+                except (OSError, ValueError):
+                    continue  # being replaced, or unreadable
+                for name, samples in snapshot.items():
+                    add(name, samples)
+        return merged
+
+    def render(self):
+        collected = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.extend(metric.render(collected.get(name)))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+REQUESTS = registry.counter(
+    'hpis_http_requests_total', 'HTTP requests handled, by URL name, method and status.',
+    ('view', 'method', 'status'),
+)
+REQUEST_LATENCY = registry.histogram(
+    'hpis_http_request_duration_seconds', 'Time to produce a response, by URL name.', ('view',),
+)
+DB_QUERIES = registry.counter(
+    'hpis_db_queries_total', 'SQL statements executed while handling requests, by URL name.', ('view',),
+)
+DB_TIME = registry.counter(
+    'hpis_db_query_seconds_total', 'Time spent in SQL while handling requests, by URL name.', ('view',),
+)
+CACHE_OPERATIONS = registry.counter(
+    'hpis_cache_operations_total',
+    'Cache operations on the two-tier cache; namespace is page, session or app, '
+    'get results are l1_hit, l2_hit or miss.',
+    ('cache', 'namespace', 'operation', 'result'),
+)
+SESSION_OPERATIONS = registry.counter(
+    'hpis_session_operations_total', 'Session backend operations.', ('operation',),
+)
+INTAKE_REQUESTS = registry.counter(
+    'hpis_intake_requests_total',
+    'Public appointment requests, by result: accepted, duplicate, rate_limited or invalid.',
+    ('result',),
+)
+OUTBOX_EMAILS = registry.counter(
+    'hpis_outbox_emails_total',
+    'Outbox emails handled by send_outbox, by result: sent, skipped, retried or failed.',
+    ('result',),
+)
+
+
+def _queue_depths():
+    from .models import DataExportRequest, DeleteAccountRequest, OutboxEmail, PatientAppointment, Report
+
+    queues = {
+        'appointments_pending': PatientAppointment.objects.filter(status='pending'),
+        'data_exports_pending': DataExportRequest.objects.filter(status='pending'),
+        'account_deletions_pending': DeleteAccountRequest.objects.filter(status='pending'),
+        'reports_pending': Report.objects.filter(status='pending'),
+        'emails_pending': OutboxEmail.objects.filter(status='pending'),
+    }
+    return {(name, ): queryset.count() for name, queryset in queues.items()}
+
+
+QUEUE_DEPTH = registry.gauge(
+    'hpis_queue_depth', 'Items waiting in work queues, read at scrape time.', ('queue',), _queue_depths,
+)
+
+
+def view_label(request):
+    """URL name of the matched view; unmatched paths share one label to bound cardinality"""
+    match = getattr(request, 'resolver_match', None)
+    return (match.view_name or match._func_path) if match else '<unmatched>'
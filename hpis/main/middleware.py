@@ -0,0 +1,191 @@
+import json
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import invalidation, metrics
+from .instrumentation import QueryRecorder
+from .principal import load_principal
+
+logger = logging.getLogger('hpis.sql')
+
+
+class HybridMiddleware:
+    """
+    Base for middleware that runs natively in both chains: __call__ under
+    WSGI, __acall__ under ASGI. One sync-only middleware would make Django
+    run everything inside it, async views included, on a worker thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+
+class RequestMetricsMiddleware(HybridMiddleware):
+    """
+    Count requests and time them into the metrics registry by URL name, then
+    flush this worker's snapshot for /metrics when it is due. Goes first in
+    MIDDLEWARE so the latency covers every other middleware.
+    """
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, started)
+        metrics.registry.maybe_flush()
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, started)
+        if metrics.registry.flush_due():
+            await sync_to_async(metrics.registry.flush)()
+        return response
+
+    def record(self, request, response, started):
+        view = metrics.view_label(request)
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - started, view=view)
+        metrics.REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+
+
+class QueryInstrumentationMiddleware(HybridMiddleware):
+    """
+    Record the SQL run while handling each request.
+
+    Adds X-DB-Queries, X-DB-Time-Ms, X-DB-Duplicates and a Server-Timing entry
+    to the response when SQL_INSTRUMENTATION_HEADERS is on, and logs one JSON
+    line per request to the `hpis.sql` logger: at DEBUG normally, at WARNING
+    when a statement repeats SQL_REPEATED_QUERY_THRESHOLD times or DB time
+    passes SQL_SLOW_REQUEST_MS. Queries run while a streaming response is
+    iterated happen after this middleware returns and are not counted.
+
+    Under ASGI the recorder is installed on the request's sync thread, where
+    Django and main/concurrency.py run the request's ORM work.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.headers = getattr(settings, 'SQL_INSTRUMENTATION_HEADERS', settings.DEBUG)
+        self.slow_ms = getattr(settings, 'SQL_SLOW_REQUEST_MS', 500)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        return self.report(request, response, recorder)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        await sync_to_async(recorder.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(recorder.__exit__)(None, None, None)
+        return self.report(request, response, recorder)
+
+    def report(self, request, response, recorder):
+        if self.headers:
+            response['X-DB-Queries'] = recorder.count
+            response['X-DB-Time-Ms'] = f"{recorder.total_ms:.1f}"
+            response['X-DB-Duplicates'] = recorder.duplicates
+            timing = f'db;dur={recorder.total_ms:.1f};desc="{recorder.count} queries"'
+            existing = response.get('Server-Timing')
+            response['Server-Timing'] = f"{existing}, {timing}" if existing else timing
+
+        view = metrics.view_label(request)
+        metrics.DB_QUERIES.inc(recorder.count, view=view)
+        metrics.DB_TIME.inc(recorder.total_ms / 1000, view=view)
+
+        summary = recorder.summary()
+        noteworthy = summary['repeated'] or recorder.total_ms >= self.slow_ms
+        level = logging.WARNING if noteworthy else logging.DEBUG
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'view': view,
+                'status': response.status_code,
+                **summary,
+            }))
+        return response
+
+
+class CacheInvalidationMiddleware(HybridMiddleware):
+    """
+    Poll the cache invalidation bus before each request so this worker's L1
+    cache drops entries other workers invalidated. Goes before the session and
+    page cache middleware, which read through the cache.
+    """
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        invalidation.poll()
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if invalidation.poll_due():
+            await sync_to_async(invalidation.poll)()
+        return await self.get_response(request)
+
+
+class PrincipalMiddleware(HybridMiddleware):
+    """
+    Set `request.principal` (role and department), evaluated lazily from the
+    session cache in main/principal.py. Goes after AuthenticationMiddleware.
+    """
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        request.principal = SimpleLazyObject(lambda: load_principal(request))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.principal = SimpleLazyObject(lambda: load_principal(request))
+        return await self.get_response(request)
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise, which is sync-only, with an async path: static files are
+    looked up and opened on a thread, every other request passes straight
+    through to the rest of the async chain.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Expression index on LOWER(auth_user.username) for the case-insensitive
+    login lookup (main.principal.find_login_user). auth_user belongs to
+    django.contrib.auth, so the index is created here with plain SQL; both
+    SQLite and PostgreSQL support expression indexes.
+    """
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('main', '0007_cache_version'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='CREATE INDEX IF NOT EXISTS main_auth_user_username_lower ON auth_user (LOWER(username));',
+            reverse_sql='DROP INDEX IF EXISTS main_auth_user_username_lower;',
+        ),
+    ]
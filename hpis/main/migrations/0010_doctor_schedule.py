@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-19 03:10
+
+import datetime
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_appointment_intake_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('working_days', models.CharField(default='01234', help_text='Weekdays worked, Monday=0 through Sunday=6, e.g. "01234"', max_length=7)),
+                ('start_time', models.TimeField(default=datetime.time(8, 0))),
+                ('end_time', models.TimeField(default=datetime.time(17, 0))),
+                ('slot_minutes', models.PositiveSmallIntegerField(default=30)),
+                ('slot_capacity', models.PositiveSmallIntegerField(default=1, help_text='Patients seen per slot')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='schedule', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Doctor Schedule',
+                'verbose_name_plural': 'Doctor Schedules',
+            },
+        ),
+    ]
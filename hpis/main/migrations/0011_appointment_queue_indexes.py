@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 03:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_doctor_schedule'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patientappointment',
+            index=models.Index(fields=['status', 'id'], name='main_patien_status_8cecad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientappointment',
+            index=models.Index(fields=['assigned_doctor', 'id'], name='main_patien_assigne_d47a0c_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+PREFIX_COLUMNS = ('username', 'first_name', 'last_name')
+
+
+def create_prefix_indexes(apps, schema_editor):
+    from main.lookups import install_prefix_indexes
+    install_prefix_indexes(schema_editor.connection, 'auth_user', PREFIX_COLUMNS)
+
+
+def remove_prefix_indexes(apps, schema_editor):
+    from main.lookups import drop_prefix_indexes
+    drop_prefix_indexes(schema_editor.connection, 'auth_user', PREFIX_COLUMNS)
+
+
+class Migration(migrations.Migration):
+    """
+    Prefix indexes for the doctor lookup (main.views.doctor_lookup), which
+    searches auth_user by username, first and last name.
+    """
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('main', '0013_email_outbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_indexes, remove_prefix_indexes),
+    ]
@@ -1,3 +1,5 @@
+import datetime
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -74,6 +76,9 @@ class PatientAppointment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Public form submissions: hash of patient, date and type (main/intake.py)
+    intake_key = models.CharField(max_length=64, blank=True, null=True, editable=False)
+
     def __str__(self):
         return f"{self.first_name} {self.last_name} - {self.appointment_date}"
 
@@ -85,6 +90,17 @@ class PatientAppointment(models.Model):
             models.Index(fields=['status', 'appointment_date']),
             models.Index(fields=['assigned_doctor', 'status']),
             models.Index(fields=['-created_at']),
+            # Keyset pages of the dashboard queues (main/queues.py)
+            models.Index(fields=['status', 'id']),
+            models.Index(fields=['assigned_doctor', 'id']),
+        ]
+        constraints = [
+            # One open request per patient, date and type; a cancelled one can be re-requested
+            models.UniqueConstraint(
+                fields=['intake_key'],
+                condition=~models.Q(status='cancelled'),
+                name='unique_open_intake_key',
+            ),
         ]
 
 
@@ -239,4 +255,122 @@ class Report(models.Model):
         ordering = ['-created_at']
 
     def __str__(self):
-        return f"{self.get_report_type_display()} - {self.user.username}"
\ No newline at end of file
+        return f"{self.get_report_type_display()} - {self.user.username}"
+
+class CacheVersion(models.Model):
+    """
+    Invalidation bus for the two-tier cache: one row per namespace whose
+    version is bumped when rows it covers change. Workers poll the table and
+    clear their in-process L1 cache when any version moves (main/invalidation.py).
+    """
+
+    namespace = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Cache Version'
+        verbose_name_plural = 'Cache Versions'
+
+    def __str__(self):
+        return f"{self.namespace} v{self.version}"
+
+
+class DoctorSchedule(models.Model):
+    """
+    Working hours and slot capacity of a doctor, used by the appointment
+    scheduler (main/scheduling.py). Doctors without a row get the defaults.
+    """
+
+    doctor = models.OneToOneField(User, on_delete=models.CASCADE, related_name='schedule')
+    working_days = models.CharField(
+        max_length=7, default='01234',
+        help_text='Weekdays worked, Monday=0 through Sunday=6, e.g. "01234"',
+    )
+    start_time = models.TimeField(default=datetime.time(8, 0))
+    end_time = models.TimeField(default=datetime.time(17, 0))
+    slot_minutes = models.PositiveSmallIntegerField(default=30)
+    slot_capacity = models.PositiveSmallIntegerField(default=1, help_text='Patients seen per slot')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Doctor Schedule'
+        verbose_name_plural = 'Doctor Schedules'
+
+    def __str__(self):
+        return f"{self.doctor.username}: {self.start_time:%H:%M}-{self.end_time:%H:%M}"
+
+    def works_on(self, day):
+        return str(day.weekday()) in self.working_days
+
+    @property
+    def slots_per_day(self):
+        start = self.start_time.hour * 60 + self.start_time.minute
+        end = self.end_time.hour * 60 + self.end_time.minute
+        return max(0, (end - start) // max(1, self.slot_minutes))
+
+
+class ChangeEvent(models.Model):
+    """
+    Change feed for live dashboard updates: one row per change worth pushing
+    (a new or reassigned appointment, stock dropping to its reorder level),
+    written when the change commits and streamed to open dashboards over
+    server-sent events (main/changefeed.py). Rows are pruned after
+    CHANGE_FEED_RETENTION_SECONDS.
+    """
+
+    kind = models.CharField(max_length=30)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Change Event'
+        verbose_name_plural = 'Change Events'
+
+    def __str__(self):
+        return f"#{self.pk} {self.kind}"
+
+
+class OutboxEmail(models.Model):
+    """
+    Transactional outbox for email: enqueued in the same transaction as the
+    change that triggers it and sent afterwards, in batches, by the
+    `send_outbox` command (main/outbox.py), so no request waits on SMTP and a
+    rolled back change sends nothing.
+    """
+
+    CATEGORY_CHOICES = [
+        ('account', 'Account'),
+        ('prescription', 'Prescription Alert'),
+        ('system', 'System Update'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('skipped', 'Skipped'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='outbox_emails')
+    to_email = models.EmailField()
+    category = models.CharField(max_length=20, choices=CATEGORY_CHOICES)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Outbox Email'
+        verbose_name_plural = 'Outbox Emails'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.to_email}: {self.subject} ({self.status})"
@@ -0,0 +1,178 @@
+"""
+Email outbox.
+
+Views never talk to SMTP. enqueue() adds an OutboxEmail row in the caller's
+transaction, so the email exists exactly when the change that triggered it
+commits, and `manage.py send_outbox` delivers the outbox with dispatch():
+
+1. a short transaction claims up to EMAIL_OUTBOX_BATCH_SIZE due emails
+   (SELECT ... FOR UPDATE SKIP LOCKED where the database has it) and pushes
+   their next attempt CLAIM_SECONDS ahead, so a second worker leaves them
+   alone while they are sent;
+2. the batch goes out over one connection of EMAIL_BACKEND, opened once;
+3. one bulk update records the outcome: sent, skipped (the recipient's
+   NotificationPreference opts out of the category), or a retry after
+   EMAIL_OUTBOX_BACKOFF_SECONDS doubled per failed attempt, until
+   EMAIL_OUTBOX_MAX_ATTEMPTS marks it failed.
+
+Preferences are read at send time, so opting out also stops emails already
+queued. Account emails (credentials) are always sent. Delivery is at least
+once: a worker killed between sending and recording leaves its batch to be
+sent again after CLAIM_SECONDS.
+
+Bodies are only kept while an email may still be sent: the outcome update
+blanks them once it is sent, skipped or failed, so a temporary password in a
+welcome email does not outlive its delivery.
+"""
+import datetime
+import logging
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection as db_connection, transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import NotificationPreference, OutboxEmail
+
+logger = logging.getLogger('hpis.outbox')
+
+CLAIM_SECONDS = 300
+
+# NotificationPreference fields that must all be on for a category to be sent
+PREFERENCES = {
+    'account': (),
+    'prescription': ('email_notifications', 'prescription_alerts'),
+    'system': ('email_notifications', 'system_updates'),
+}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue(category, to_email, subject, body, html_body='', user=None):
+    """Queue an email; call it inside the transaction of the change it reports"""
+    if category not in PREFERENCES:
+        raise ValueError(f'Unknown email category "{category}".')
+    if not to_email:
+        return None
+    return OutboxEmail.objects.create(
+        user=user, to_email=to_email, category=category, subject=subject, body=body, html_body=html_body,
+    )
+
+
+def wanted(email):
+    """False when the recipient's notification preferences opt out of the email's category"""
+    fields = PREFERENCES.get(email.category, ())
+    if not fields or email.user is None:
+        return True
+    try:
+        preference = email.user.notification_preference
+    except NotificationPreference.DoesNotExist:
+        return True  # the model's defaults are all on
+    return all(getattr(preference, name) for name in fields)
+
+
+def backoff(attempts):
+    """Delay before the next try after `attempts` failed ones"""
+    return datetime.timedelta(seconds=_setting('EMAIL_OUTBOX_BACKOFF_SECONDS', 60) * 2 ** (attempts - 1))
+
+
+@dataclass
+class DispatchResult:
+    sent: list = field(default_factory=list)
+    skipped: list = field(default_factory=list)
+    retried: list = field(default_factory=list)
+    failed: list = field(default_factory=list)
+
+    def __len__(self):
+        return len(self.sent) + len(self.skipped) + len(self.retried) + len(self.failed)
+
+
+def claim(batch_size):
+    """Ids of up to `batch_size` due emails, held back from other workers for CLAIM_SECONDS"""
+    now = timezone.now()
+    with transaction.atomic():
+        due = OutboxEmail.objects.filter(status='pending', next_attempt_at__lte=now).order_by('next_attempt_at', 'id')
+        skip_locked = db_connection.features.has_select_for_update_skip_locked
+        ids = list(due.select_for_update(skip_locked=skip_locked).values_list('id', flat=True)[:batch_size])
+        if ids:
+            OutboxEmail.objects.filter(id__in=ids).update(
+                next_attempt_at=now + datetime.timedelta(seconds=CLAIM_SECONDS),
+            )
+    return ids
+
+
+def _message(email, connection):
+    message = EmailMultiAlternatives(email.subject, email.body, to=[email.to_email], connection=connection)
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def dispatch(batch_size=None):
+    """Send one batch of due emails over a single connection; returns what happened to each"""
+    result = DispatchResult()
+    ids = claim(batch_size or _setting('EMAIL_OUTBOX_BATCH_SIZE', 50))
+    if not ids:
+        return result
+    emails = list(
+        OutboxEmail.objects.filter(id__in=ids).select_related('user__notification_preference').order_by('id')
+    )
+
+    outgoing = []
+    for email in emails:
+        if wanted(email):
+            outgoing.append(email)
+        else:
+            email.status = 'skipped'
+            result.skipped.append(email)
+
+    errors = {}
+    if outgoing:
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+        except Exception as exc:
+            logger.warning('Could not connect to send %d emails: %s', len(outgoing), exc)
+            errors = {email.pk: exc for email in outgoing}
+        else:
+            try:
+                for email in outgoing:
+                    try:
+                        connection.send_messages([_message(email, connection)])
+                    except Exception as exc:
+                        errors[email.pk] = exc
+            finally:
+                connection.close()
+
+    now = timezone.now()
+    max_attempts = _setting('EMAIL_OUTBOX_MAX_ATTEMPTS', 6)
+    for email in outgoing:
+        email.attempts += 1
+        exc = errors.get(email.pk)
+        if exc is None:
+            email.status, email.sent_at, email.last_error = 'sent', now, ''
+            result.sent.append(email)
+            continue
+        email.last_error = f'{type(exc).__name__}: {exc}'[:1000]
+        if email.attempts >= max_attempts:
+            email.status = 'failed'
+            result.failed.append(email)
+            logger.error('Giving up on email #%d to %s: %s', email.pk, email.to_email, email.last_error)
+        else:
+            email.next_attempt_at = now + backoff(email.attempts)
+            result.retried.append(email)
+
+    for email in emails:
+        if email.status != 'pending':
+            email.body = email.html_body = ''
+    OutboxEmail.objects.bulk_update(
+        emails, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at', 'body', 'html_body'],
+    )
+    for name in ('sent', 'skipped', 'retried', 'failed'):
+        if getattr(result, name):
+            metrics.OUTBOX_EMAILS.inc(len(getattr(result, name)), result=name)
+    return result
@@ -0,0 +1,115 @@
+"""
+Request-scoped principal: who is signed in, with what role.
+
+PrincipalBackend loads the signed-in user together with their UserProfile and
+NotificationPreference in one query, so `request.user.profile` and
+`request.user.notification_preference` cost nothing after login_required.
+
+main.middleware.PrincipalMiddleware adds `request.principal` (role and
+department) for role_required and other auth checks. It is cached in the
+session and stamped with the `profile` version of the invalidation bus
+(main/invalidation.py), so on a warm request it is read without touching the
+database, and any profile or account change (a deactivation, say) refreshes
+it on the next request of every user.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import SESSION_KEY, get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models import Value
+from django.db.models.functions import Lower
+
+from . import invalidation
+
+PRINCIPAL_SESSION_KEY = '_principal'
+
+
+@dataclass(frozen=True)
+class Principal:
+    user_id: Optional[str] = None
+    role: Optional[str] = None
+    department: Optional[str] = None
+
+    @property
+    def is_authenticated(self):
+        return self.user_id is not None
+
+
+ANONYMOUS = Principal()
+
+
+class PrincipalBackend(ModelBackend):
+    """ModelBackend whose session lookup joins the profile and notification preferences"""
+
+    def authenticate(self, request, username=None, password=None, user=None, **kwargs):
+        """
+        ModelBackend.authenticate(), except that the login view passes the
+        `user` find_login_user() already loaded so it is not looked up again.
+        """
+        if user is None or username is None or user.get_username() != username:
+            return super().authenticate(request, username=username, password=password, **kwargs)
+        if password is not None and user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.select_related(
+                'profile', 'notification_preference'
+            ).get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        # ModelBackend.aget_user() would skip the joins above
+        return await sync_to_async(self.get_user)(user_id)
+
+
+def find_login_user(identifier):
+    """
+    The user whose username matches `identifier` ignoring case, or None.
+    An exact match wins when usernames differ only by case; otherwise an
+    ambiguous identifier matches nobody.
+    """
+    UserModel = get_user_model()
+    candidates = list(
+        UserModel._default_manager.select_related('profile', 'notification_preference')
+        .alias(username_lower=Lower('username'))
+        .filter(username_lower=Lower(Value(identifier)))[:5]
+    )
+    if len(candidates) == 1:
+        return candidates[0]
+    for user in candidates:
+        if user.username == identifier:
+            return user
+    return None
+
+
+def load_principal(request):
+    user_id = request.session.get(SESSION_KEY)
+    if user_id is None:
+        return ANONYMOUS
+
+    version = invalidation.versions('profile')[0]
+    cached = request.session.get(PRINCIPAL_SESSION_KEY)
+    if cached and cached['user_id'] == str(user_id) and cached['version'] == version:
+        return Principal(cached['user_id'], cached['role'], cached['department'])
+
+    # Stale or missing: the profile comes with the user, so this is one query at most
+    if not request.user.is_authenticated:
+        return ANONYMOUS
+    profile = getattr(request.user, 'profile', None)
+    principal = Principal(
+        str(request.user.pk),
+        profile.role if profile else None,
+        profile.department if profile else None,
+    )
+    request.session[PRINCIPAL_SESSION_KEY] = {
+        'user_id': principal.user_id, 'role': principal.role,
+        'department': principal.department, 'version': version,
+    }
+    return principal
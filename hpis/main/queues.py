@@ -0,0 +1,123 @@
+"""
+Paginated appointment queues for the admin and doctor dashboards.
+
+Dashboards render the first page of each queue and static/js/appointment_queues.js
+fetches the rest from ``/api/appointments/<queue>/`` as JSON:
+
+    ?cursor=<id>&limit=<n>&date_from=YYYY-MM-DD&date_to=YYYY-MM-DD
+    -> {"results": [...], "next": <cursor or null>}
+
+Pages are keyset-paginated on the primary key (newest first): the cursor is
+the last id of the previous page, so a deep page costs the same as the first
+and rows added meanwhile do not shift what the reader has already seen. Only
+the columns the tables show are selected, leaving out the `address` and
+`notes` text fields.
+"""
+import datetime
+from dataclasses import dataclass
+
+from django.db.models import Count
+from django.urls import reverse
+
+from .models import PatientAppointment
+
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+LIST_FIELDS = (
+    'id', 'first_name', 'last_name', 'date_of_birth', 'email', 'contact_number',
+    'appointment_type', 'appointment_date', 'appointment_time', 'status',
+)
+
+
+@dataclass(frozen=True)
+class Queue:
+    roles: tuple
+    statuses: tuple = ()  # empty for every status
+    own: bool = False  # only appointments assigned to the signed-in doctor
+    with_doctor: bool = False
+
+
+QUEUES = {
+    'pending': Queue(('admin',), ('pending',)),
+    'assigned': Queue(('admin',), ('assigned',), with_doctor=True),
+    'my-assigned': Queue(('doctor',), ('assigned',), own=True),
+    'my-confirmed': Queue(('doctor',), ('confirmed',), own=True),
+    'my-all': Queue(('doctor',), own=True),
+}
+
+
+def parse_date(value):
+    try:
+        return datetime.date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def date_window(params):
+    """(date_from, date_to) from request parameters; invalid dates are ignored"""
+    return parse_date(params.get('date_from')), parse_date(params.get('date_to'))
+
+
+def queue_queryset(name, user, date_from=None, date_to=None):
+    queue = QUEUES[name]
+    queryset = PatientAppointment.objects.all()
+    if queue.statuses:
+        queryset = queryset.filter(status__in=queue.statuses)
+    if queue.own:
+        queryset = queryset.filter(assigned_doctor=user)
+    if date_from:
+        queryset = queryset.filter(appointment_date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(appointment_date__lte=date_to)
+    fields = LIST_FIELDS
+    if queue.with_doctor:
+        queryset = queryset.select_related('assigned_doctor')
+        fields += ('assigned_doctor__first_name', 'assigned_doctor__last_name')
+    return queryset.only(*fields).order_by('-id')
+
+
+def page(queryset, cursor=None, limit=PAGE_SIZE):
+    """(rows, next cursor or None) for the page after `cursor`"""
+    if cursor:
+        queryset = queryset.filter(id__lt=cursor)
+    # One extra row tells whether there is another page without a COUNT(*)
+    rows = list(queryset[:limit + 1])
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1].id
+    return rows, None
+
+
+def first_page(name, user, date_from=None, date_to=None):
+    rows, cursor = page(queue_queryset(name, user, date_from, date_to))
+    return {'rows': rows, 'next': cursor}
+
+
+def status_counts(queryset):
+    """{status: count} in one grouped query"""
+    return dict(queryset.order_by().values_list('status').annotate(n=Count('id')))
+
+
+def serialize(appointment):
+    data = {
+        'id': appointment.id,
+        'first_name': appointment.first_name,
+        'last_name': appointment.last_name,
+        'date_of_birth': appointment.date_of_birth.isoformat() if appointment.date_of_birth else None,
+        'email': appointment.email,
+        'contact_number': appointment.contact_number,
+        'appointment_type': appointment.appointment_type,
+        'appointment_type_display': appointment.get_appointment_type_display(),
+        'appointment_date': appointment.appointment_date.isoformat() if appointment.appointment_date else None,
+        'appointment_time': appointment.appointment_time.strftime('%H:%M') if appointment.appointment_time else None,
+        'status': appointment.status,
+        'status_display': appointment.get_status_display(),
+    }
+    if appointment.status == 'pending':
+        data['assign_url'] = reverse('assign_appointment', args=[appointment.id])
+    elif appointment.status == 'assigned':
+        data['confirm_url'] = reverse('confirm_appointment', args=[appointment.id])
+    if 'assigned_doctor' in appointment._state.fields_cache and appointment.assigned_doctor:
+        doctor = appointment.assigned_doctor
+        data['doctor'] = f'Dr. {doctor.first_name} {doctor.last_name}'
+    return data
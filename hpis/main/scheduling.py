@@ -0,0 +1,290 @@
+"""
+Capacity-aware appointment scheduler.
+
+Every doctor has working days, hours, a slot length and a number of patients
+per slot (DoctorSchedule; doctors without one get the model defaults). The
+SlotIndex keeps, for each doctor-day it has touched, a bitmap of slots that
+still have room and a bytearray of the room left in each, built from one
+query of the appointments already booked in the scheduling window. Finding a
+doctor's earliest free slot on a day is then a couple of integer operations.
+
+schedule() places pending appointments, emergencies first, then by preferred
+date and submission time, each in the earliest free slot on or after its
+preferred date (never before today) with any doctor of the departments its
+type maps to (settings.APPOINTMENT_TYPE_DEPARTMENTS; unmapped types may go to
+any doctor). Ties go to the doctor with fewer bookings that day. Appointments
+with no room within SCHEDULER_HORIZON_DAYS of their preferred date, or no
+eligible doctor, are reported as conflicts and stay pending.
+
+The pending rows are locked for the run and written back with one
+bulk_update; bulk_update sends no post_save, so the `appointment` cache
+namespace is bumped and the change feed event published here.
+"""
+import datetime
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import changefeed, invalidation
+from .models import DoctorSchedule, PatientAppointment
+
+BOOKED_STATUSES = ('assigned', 'confirmed')
+
+
+@dataclass
+class Assignment:
+    appointment: PatientAppointment
+    doctor: User
+    day: datetime.date
+    time: datetime.time
+
+
+@dataclass
+class Conflict:
+    appointment: PatientAppointment
+    reason: str
+
+
+@dataclass
+class ScheduleResult:
+    assignments: list = field(default_factory=list)
+    conflicts: list = field(default_factory=list)
+    elapsed: float = 0.0
+    committed: bool = False
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+class SlotIndex:
+    """Free slots per doctor-day, built lazily from schedules and existing bookings"""
+
+    def __init__(self, schedules, booked, now=None):
+        self.schedules = schedules  # doctor id -> DoctorSchedule
+        self.booked = booked  # (doctor id, day) -> Counter of slot numbers; None counts untimed bookings
+        self.now = now or timezone.localtime()
+        self.days = {}  # (doctor id, day) -> [free bitmap, room per slot, bookings] or None
+
+    def _build(self, doctor_id, day):
+        schedule = self.schedules[doctor_id]
+        slots = schedule.slots_per_day
+        if not schedule.works_on(day) or slots == 0 or schedule.slot_capacity == 0:
+            return None
+        room = bytearray([min(schedule.slot_capacity, 255)]) * slots
+        free = (1 << slots) - 1
+
+        if day == self.now.date():
+            # Slots already started today are not offered
+            passed = -(-(_minutes(self.now) - _minutes(schedule.start_time)) // schedule.slot_minutes)
+            for slot in range(min(max(0, passed), slots)):
+                room[slot] = 0
+                free &= ~(1 << slot)
+
+        bookings = self.booked.get((doctor_id, day), Counter())
+        untimed = bookings.get(None, 0)
+        for slot, count in bookings.items():
+            if slot is None or not 0 <= slot < slots:
+                continue
+            room[slot] = max(0, room[slot] - count)
+            if not room[slot]:
+                free &= ~(1 << slot)
+        entry = [free, room, 0]
+        for _ in range(untimed):
+            # An assignment without a time still takes the earliest place left
+            slot = self._lowest(entry)
+            if slot is None:
+                break
+            self._take(entry, slot)
+        entry[2] = sum(bookings.values())
+        return entry
+
+    def _entry(self, doctor_id, day):
+        key = (doctor_id, day)
+        if key not in self.days:
+            self.days[key] = self._build(doctor_id, day)
+        return self.days[key]
+
+    @staticmethod
+    def _lowest(entry):
+        free = entry[0]
+        return (free & -free).bit_length() - 1 if free else None
+
+    @staticmethod
+    def _take(entry, slot):
+        entry[1][slot] -= 1
+        if not entry[1][slot]:
+            entry[0] &= ~(1 << slot)
+        entry[2] += 1
+
+    def earliest(self, doctor_id, day):
+        """(start minute, bookings that day, slot number) of the doctor's first free slot, or None"""
+        entry = self._entry(doctor_id, day)
+        if entry is None:
+            return None
+        slot = self._lowest(entry)
+        if slot is None:
+            return None
+        schedule = self.schedules[doctor_id]
+        return _minutes(schedule.start_time) + slot * schedule.slot_minutes, entry[2], slot
+
+    def take(self, doctor_id, day, slot):
+        self._take(self._entry(doctor_id, day), slot)
+
+    def load(self, doctor_id, day):
+        entry = self._entry(doctor_id, day)
+        return entry[2] if entry else 0
+
+
+def _slot_number(schedule, value):
+    if value is None:
+        return None
+    return (_minutes(value) - _minutes(schedule.start_time)) // max(1, schedule.slot_minutes)
+
+
+def load_doctors(department=None):
+    doctors = User.objects.filter(profile__role='doctor', is_active=True).select_related('profile')
+    if department:
+        doctors = doctors.filter(profile__department=department)
+    doctors = list(doctors.order_by('id'))
+    schedules = {s.doctor_id: s for s in DoctorSchedule.objects.filter(doctor__in=doctors)}
+    for doctor in doctors:
+        schedules.setdefault(doctor.id, DoctorSchedule(doctor=doctor))
+    return doctors, schedules
+
+
+def load_bookings(schedules, first_day, last_day):
+    booked = defaultdict(Counter)
+    rows = PatientAppointment.objects.filter(
+        assigned_doctor_id__in=list(schedules),
+        status__in=BOOKED_STATUSES,
+        appointment_date__range=(first_day, last_day),
+    ).values_list('assigned_doctor_id', 'appointment_date', 'appointment_time')
+    for doctor_id, day, at in rows:
+        booked[(doctor_id, day)][_slot_number(schedules[doctor_id], at)] += 1
+    return booked
+
+
+def _priority(appointment):
+    return (appointment.appointment_type != 'emergency', appointment.appointment_date,
+            appointment.created_at or timezone.now(), appointment.pk or 0)
+
+
+def plan(appointments, doctors, schedules, horizon_days=None, now=None):
+    """Place `appointments` in memory; returns a ScheduleResult without saving anything"""
+    now = now or timezone.localtime()
+    today = now.date()
+    horizon = horizon_days if horizon_days is not None else getattr(settings, 'SCHEDULER_HORIZON_DAYS', 14)
+    result = ScheduleResult()
+    if not appointments:
+        return result
+
+    departments = getattr(settings, 'APPOINTMENT_TYPE_DEPARTMENTS', {})
+    by_department = defaultdict(list)
+    for doctor in doctors:
+        by_department[(doctor.profile.department or '').strip().lower()].append(doctor)
+    candidates = {}
+    for appointment_type, _ in PatientAppointment.APPOINTMENT_TYPE_CHOICES:
+        allowed = departments.get(appointment_type)
+        if allowed:
+            candidates[appointment_type] = [
+                d for name in allowed for d in by_department.get(name.strip().lower(), [])
+            ]
+        else:
+            candidates[appointment_type] = list(doctors)
+
+    ordered = sorted(appointments, key=_priority)
+    first_day = today
+    last_day = max(max(a.appointment_date, today) for a in ordered) + datetime.timedelta(days=horizon)
+    index = SlotIndex(schedules, load_bookings(schedules, first_day, last_day), now)
+    full = set()  # (appointment type, day) with no room left for any candidate
+
+    for appointment in ordered:
+        eligible = candidates.get(appointment.appointment_type, [])
+        if not eligible:
+            result.conflicts.append(Conflict(appointment, 'No doctor in the departments for this appointment type'))
+            continue
+        start = max(appointment.appointment_date, today)
+        placed = False
+        for offset in range(horizon + 1):
+            day = start + datetime.timedelta(days=offset)
+            if (appointment.appointment_type, day) in full:
+                continue
+            best = None
+            for doctor in eligible:
+                free = index.earliest(doctor.id, day)
+                if free is not None and (best is None or free[:2] < best[0][:2]):
+                    best = (free, doctor)
+            if best is None:
+                full.add((appointment.appointment_type, day))
+                continue
+            (minute, _, slot), doctor = best
+            index.take(doctor.id, day, slot)
+            result.assignments.append(
+                Assignment(appointment, doctor, day, datetime.time(minute // 60, minute % 60))
+            )
+            placed = True
+            break
+        if not placed:
+            result.conflicts.append(Conflict(
+                appointment, f'No free slot within {horizon} days of {start:%b %d, %Y}'
+            ))
+    return result
+
+
+def schedule(department=None, horizon_days=None, admin=None, commit=True):
+    """
+    Assign every pending appointment a doctor, date and time. With
+    commit=False the plan is returned without saving.
+    """
+    started = time.perf_counter()
+    doctors, schedules = load_doctors(department)
+    with transaction.atomic():
+        pending = PatientAppointment.objects.filter(status='pending')
+        if department:
+            # Leave types that belong to other departments for their own run
+            mapped = getattr(settings, 'APPOINTMENT_TYPE_DEPARTMENTS', {})
+            elsewhere = [
+                appointment_type for appointment_type, names in mapped.items()
+                if names and department.strip().lower() not in {n.strip().lower() for n in names}
+            ]
+            pending = pending.exclude(appointment_type__in=elsewhere)
+        if commit:
+            pending = pending.select_for_update()
+        result = plan(list(pending), doctors, schedules, horizon_days)
+
+        if commit and result.assignments:
+            stamp = timezone.now()
+            changed = []
+            for assignment in result.assignments:
+                appointment = assignment.appointment
+                appointment.assigned_doctor = assignment.doctor
+                appointment.assigned_admin = admin
+                appointment.status = 'assigned'
+                appointment.appointment_date = assignment.day
+                appointment.appointment_time = assignment.time
+                appointment.updated_at = stamp
+                changed.append(appointment)
+            PatientAppointment.objects.bulk_update(
+                changed,
+                ['assigned_doctor', 'assigned_admin', 'status', 'appointment_date', 'appointment_time', 'updated_at'],
+                batch_size=500,
+            )
+            invalidation.bump('appointment')
+            changefeed.appointments_changed(
+                'assigned', len(changed), [assignment.doctor.pk for assignment in result.assignments]
+            )
+            result.committed = True
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def suggest(appointment, doctors, schedules):
+    """Earliest Assignment for one appointment, or None"""
+    result = plan([appointment], doctors, schedules)
+    return result.assignments[0] if result.assignments else None
@@ -0,0 +1,25 @@
+"""
+cached_db session engine that counts backend operations in
+hpis_session_operations_total. Set SESSION_ENGINE = 'main.sessions'.
+"""
+from django.contrib.sessions.backends import cached_db
+
+from .metrics import SESSION_OPERATIONS
+
+
+class SessionStore(cached_db.SessionStore):
+    def load(self):
+        SESSION_OPERATIONS.inc(operation='load')
+        return super().load()
+
+    def create(self):
+        SESSION_OPERATIONS.inc(operation='create')
+        return super().create()
+
+    def save(self, must_create=False):
+        SESSION_OPERATIONS.inc(operation='save')
+        return super().save(must_create)
+
+    def delete(self, session_key=None):
+        SESSION_OPERATIONS.inc(operation='delete')
+        return super().delete(session_key)
@@ -1,7 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile, NotificationPreference
+from .models import UserProfile, NotificationPreference, PatientAppointment
+from . import changefeed, invalidation
 
 
 @receiver(post_save, sender=User)
@@ -51,4 +52,36 @@ def create_notification_preference(sender, instance, created, **kwargs):
             )
             print(f"✓ NotificationPreference ensured for {instance.username}")
         except Exception as e:
-            print(f"✗ Error ensuring NotificationPreference: {e}")
\ No newline at end of file
+            print(f"✗ Error ensuring NotificationPreference: {e}")
+
+
+@receiver(post_save, sender=PatientAppointment)
+@receiver(post_delete, sender=PatientAppointment)
+def invalidate_appointment_cache(sender, instance, **kwargs):
+    """Evict every worker's L1 cache when an appointment changes"""
+    invalidation.bump('appointment')
+
+
+@receiver(post_save, sender=PatientAppointment)
+def publish_appointment_change(sender, instance, created, **kwargs):
+    """Push the change to open dashboards (main/changefeed.py)"""
+    changefeed.appointment_changed(instance, created)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_profile_cache(sender, instance, **kwargs):
+    """Evict every worker's L1 cache when a role or profile changes"""
+    invalidation.bump('profile')
+
+
+@receiver(post_save, sender=User)
+def invalidate_principal_cache(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Refresh session-cached principals when an account changes, so a
+    deactivated user is signed out of request.principal on their next request.
+    The last_login stamp written at every login is not a change that matters.
+    """
+    if created or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    invalidation.bump('profile')
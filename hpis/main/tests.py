@@ -1,3 +1,1100 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import smtplib
+import tempfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import BACKEND_SESSION_KEY, SESSION_KEY, authenticate, get_user
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_login_failed
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.handlers.asgi import ASGIHandler
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import appointment_actions, changefeed, intake, invalidation, metrics, outbox, scheduling, throttle
+from .instrumentation import QueryBudgetExceeded, QueryRecorder, budgets_are_strict, query_budget
+from .middleware import QueryInstrumentationMiddleware
+from .forms import AppointmentRequestForm
+from .models import (
+    AccessLog, CacheVersion, ChangeEvent, DoctorSchedule, NotificationPreference, OutboxEmail, PatientAppointment,
+)
+from .principal import PRINCIPAL_SESSION_KEY, load_principal
+from .throttle import client_ip
+
+
+def appointment_request(**overrides):
+    """POST data for the landing page appointment form"""
+    data = {
+        'first_name': 'Ana', 'last_name': 'Reyes', 'middle_name': '', 'dob': '1990-05-01', 'gender': 'F',
+        'email': 'ana@example.com', 'contact': '09171234567', 'address': 'Cebu City',
+        'appointment_type': 'checkup', 'notes': '',
+        'available_date': (timezone.localdate() + datetime.timedelta(days=3)).isoformat(),
+    }
+    data.update(overrides)
+    return data
+
+
+class PublicPageCsrfTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_every_visitor_gets_a_csrf_cookie(self):
+        for name in ('landing_page', 'contact_us'):
+            for _ in range(2):
+                response = Client(enforce_csrf_checks=True).get(reverse(name))
+                self.assertIn('csrftoken', response.cookies, name)
+
+    def test_second_visitor_can_submit_the_appointment_form(self):
+        Client(enforce_csrf_checks=True).get(reverse('landing_page'))
+        visitor = Client(enforce_csrf_checks=True)
+        token = visitor.get(reverse('landing_page')).cookies['csrftoken'].value
+
+        response = visitor.post(reverse('landing_page'), appointment_request(csrfmiddlewaretoken=token))
+
+        self.assertEqual(response.status_code, 200)
+
+
+class ClientIpTests(TestCase):
+    def request(self, forwarded_for=None):
+        extra = {'HTTP_X_FORWARDED_FOR': forwarded_for} if forwarded_for else {}
+        return RequestFactory().get('/', REMOTE_ADDR='10.0.0.1', **extra)
+
+    @override_settings(TRUSTED_PROXY_COUNT=1)
+    def test_takes_the_entry_our_proxy_appended(self):
+        self.assertEqual(client_ip(self.request('1.2.3.4, 203.0.113.7')), '203.0.113.7')
+
+    @override_settings(TRUSTED_PROXY_COUNT=0)
+    def test_without_proxies_uses_remote_addr(self):
+        self.assertEqual(client_ip(self.request('1.2.3.4')), '10.0.0.1')
+
+    @override_settings(TRUSTED_PROXY_COUNT=2)
+    def test_fewer_hops_than_proxies_uses_remote_addr(self):
+        self.assertEqual(client_ip(self.request('203.0.113.7')), '10.0.0.1')
+
+
+@override_settings(
+    TRUSTED_PROXY_COUNT=1, LOGIN_THROTTLE_USERNAME_LIMIT=3, LOGIN_THROTTLE_IP_LIMIT=5, LOGIN_THROTTLE_LOAD_FACTOR=0,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttle._local_blocks.clear()
+        self.user = User.objects.create_user('nurse', 'nurse@example.com', 'right-pass-1')
+
+    def login(self, username='nurse', password='wrong-pass', forwarded_for='198.51.100.1'):
+        return self.client.post(reverse('user_login'), {'username': username, 'password': password},
+                                HTTP_X_FORWARDED_FOR=forwarded_for)
+
+    def test_blocks_a_username_after_its_limit(self):
+        for _ in range(3):
+            self.assertEqual(self.login().status_code, 200)
+
+        response = self.login(password='right-pass-1')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    def test_success_clears_the_username_failures(self):
+        self.login()
+        self.login()
+        self.assertEqual(self.login(password='right-pass-1').status_code, 302)
+        self.client.logout()
+
+        self.login()
+        self.login()
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_ip_limit_ignores_spoofed_forwarded_for(self):
+        for i in range(5):
+            self.login(username=f'nobody{i}', forwarded_for=f'10.9.9.{i}, 198.51.100.1')
+
+        response = self.login(username='nobody9', forwarded_for='10.9.9.9, 198.51.100.1')
+
+        self.assertEqual(response.status_code, 429)
+
+    def test_failures_fold_into_one_access_log_row(self):
+        for _ in range(3):
+            self.login()
+
+        entry = AccessLog.objects.get(user=self.user, access_type='failed_login')
+        self.assertEqual(entry.description, '3 failed login attempts within 5 minutes')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class PrincipalBackendTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttle._local_blocks.clear()
+        self.user = User.objects.create_user('Nurse.Ana', 'ana@example.com', 'right-pass-1')
+
+    def test_authenticate_reuses_the_user_already_looked_up(self):
+        with self.assertNumQueries(0):
+            user = authenticate(None, username='Nurse.Ana', password='right-pass-1', user=self.user)
+
+        self.assertIs(user, self.user)
+        self.assertEqual(user.backend, 'main.principal.PrincipalBackend')
+
+    def test_wrong_passwords_and_inactive_accounts_fail_through_authenticate(self):
+        failures = []
+        user_login_failed.connect(lambda sender, credentials, **kwargs: failures.append(credentials['username']),
+                                  weak=False, dispatch_uid='principal-test')
+        self.addCleanup(user_login_failed.disconnect, dispatch_uid='principal-test')
+
+        self.assertIsNone(authenticate(None, username='Nurse.Ana', password='wrong', user=self.user))
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(authenticate(None, username='Nurse.Ana', password='right-pass-1', user=self.user))
+
+        self.assertEqual(failures, ['Nurse.Ana', 'Nurse.Ana'])
+
+    def test_login_form_signs_in_by_username_in_any_case(self):
+        response = self.client.post(reverse('user_login'), {'username': 'nurse.ana', 'password': 'right-pass-1'})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.client.session[SESSION_KEY], str(self.user.pk))
+        self.assertEqual(self.client.session[BACKEND_SESSION_KEY], 'main.principal.PrincipalBackend')
+
+
+@override_settings(CACHE_INVALIDATION_POLL_SECONDS=0)
+class PrincipalInvalidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user('chief')
+        self.admin.profile.role = 'super_admin'
+        self.admin.profile.save()
+        self.doctor = User.objects.create_user('dr_cruz')
+        self.client.force_login(self.admin)
+        self.victim = Client()
+        self.victim.force_login(self.doctor)
+
+    def victim_principal(self):
+        """The principal the doctor's next request sees, and what it leaves cached in the session"""
+        request = RequestFactory().get('/')
+        request.session = self.victim.session
+        request.user = get_user(request)
+        principal = load_principal(request)
+        request.session.save()
+        return principal, request.session.get(PRINCIPAL_SESSION_KEY)
+
+    @override_settings(CACHE_INVALIDATION_POLL_SECONDS=60)
+    def test_a_warm_principal_is_read_from_the_session(self):
+        self.addCleanup(invalidation._state.update, next_poll=0.0)
+        self.victim_principal()
+        request = RequestFactory().get('/')
+        request.session = self.victim.session
+        request.session[PRINCIPAL_SESSION_KEY] = dict(request.session[PRINCIPAL_SESSION_KEY], role='admin')
+
+        with self.assertNumQueries(0):
+            principal = load_principal(request)
+
+        self.assertEqual(principal.role, 'admin')
+
+    def test_a_role_change_by_an_admin_reaches_the_next_request(self):
+        self.assertEqual(self.victim.get(reverse('doctor_dashboard')).status_code, 200)
+        self.assertEqual(self.victim.session[PRINCIPAL_SESSION_KEY]['role'], 'doctor')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('edit_staff', args=[self.doctor.pk]), {
+                'first_name': 'Ana', 'last_name': 'Cruz', 'email': 'ana@example.com',
+                'role': 'admin', 'department': 'Cardiology', 'license_number': 'L-1',
+            })
+
+        self.assertRedirects(self.victim.get(reverse('doctor_dashboard')), reverse('homepage'),
+                             fetch_redirect_response=False)
+        principal, cached = self.victim_principal()
+        self.assertEqual((principal.role, principal.department), ('admin', 'Cardiology'))
+        self.assertEqual(cached['role'], 'admin')
+
+    def test_a_deactivated_account_loses_its_cached_principal(self):
+        self.assertEqual(self.victim_principal()[0].role, 'doctor')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('delete_staff', args=[self.doctor.pk]))
+
+        principal, _ = self.victim_principal()
+        self.assertFalse(principal.is_authenticated)
+        self.assertRedirects(self.victim.get(reverse('doctor_dashboard')),
+                             f"{reverse('user_login')}?next={reverse('doctor_dashboard')}",
+                             fetch_redirect_response=False)
+
+
+@override_settings(TRUSTED_PROXY_COUNT=1)
+class AppointmentIntakeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttle._local_blocks.clear()
+
+    def submit(self, forwarded_for='198.51.100.1', **overrides):
+        return self.client.post(reverse('landing_page'), appointment_request(**overrides),
+                                HTTP_X_FORWARDED_FOR=forwarded_for)
+
+    def cleaned(self, data):
+        form = AppointmentRequestForm(data)
+        self.assertTrue(form.is_valid(), form.errors)
+        return form.cleaned_data
+
+    def test_stores_a_pending_request(self):
+        response = self.submit()
+
+        self.assertEqual(response.status_code, 200)
+        appointment = PatientAppointment.objects.get()
+        self.assertEqual((appointment.status, appointment.first_name), ('pending', 'Ana'))
+        self.assertEqual(len(appointment.intake_key), 64)
+
+    def test_repeats_are_answered_but_stored_once(self):
+        self.submit()
+        response = self.submit(first_name=' ana ', last_name='REYES')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PatientAppointment.objects.count(), 1)
+
+    def test_a_cancelled_request_can_be_made_again(self):
+        self.submit()
+        PatientAppointment.objects.update(status='cancelled')
+
+        self.submit()
+
+        self.assertEqual(
+            sorted(PatientAppointment.objects.values_list('status', flat=True)), ['cancelled', 'pending'],
+        )
+
+    def test_rejects_choices_the_model_does_not_have(self):
+        response = self.submit(appointment_type='surgery')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PatientAppointment.objects.exists())
+
+    @override_settings(INTAKE_THROTTLE_LIMIT=3)
+    def test_rate_limit_ignores_spoofed_forwarded_for(self):
+        for i in range(3):
+            self.submit(forwarded_for=f'10.9.9.{i}, 198.51.100.1', first_name=f'Patient{i}')
+
+        response = self.submit(forwarded_for='10.9.9.9, 198.51.100.1', first_name='Patient9')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(PatientAppointment.objects.count(), 3)
+
+    def test_the_constraint_catches_duplicates_the_cache_forgot(self):
+        data = self.cleaned(appointment_request())
+        self.assertEqual(intake.submit(data), intake.ACCEPTED)
+        cache.clear()
+
+        self.assertEqual(intake.submit(data), intake.DUPLICATE)
+        self.assertEqual(PatientAppointment.objects.count(), 1)
+
+    def test_concurrent_submissions_store_one_row(self):
+        data = self.cleaned(appointment_request())
+
+        # Both requests pass the cache precheck before either row exists
+        with mock.patch.object(intake.cache, 'add', return_value=True):
+            results = [intake.submit(data), intake.submit(data)]
+
+        self.assertEqual(results, [intake.ACCEPTED, intake.DUPLICATE])
+        self.assertEqual(PatientAppointment.objects.count(), 1)
+
+
+# Monday 10:05; slots that started before it are no longer offered
+SCHEDULER_NOW = timezone.make_aware(datetime.datetime(2030, 1, 7, 10, 5))
+MONDAY = SCHEDULER_NOW.date()
+
+
+def make_doctor(username, department='', first_name='', last_name='', **schedule):
+    doctor = User.objects.create_user(username, password='x', first_name=first_name, last_name=last_name)
+    doctor.profile.role = 'doctor'
+    doctor.profile.department = department
+    doctor.profile.save()
+    if schedule:
+        DoctorSchedule.objects.create(doctor=doctor, **schedule)
+    return doctor
+
+
+def make_appointment(day, appointment_type='consultation', **fields):
+    return PatientAppointment.objects.create(
+        first_name='Ana', last_name='Reyes', date_of_birth=datetime.date(1990, 5, 1), gender='F',
+        email='ana@example.com', contact_number='09171234567', address='Cebu City',
+        appointment_type=appointment_type, appointment_date=day, **fields,
+    )
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SchedulerTests(TestCase):
+    def plan(self, appointments, horizon_days=None):
+        doctors, schedules = scheduling.load_doctors()
+        return scheduling.plan(appointments, doctors, schedules, horizon_days, now=SCHEDULER_NOW)
+
+    def placed(self, result):
+        return [(a.doctor.username, a.day, a.time) for a in result.assignments]
+
+    def test_fills_each_slot_to_capacity(self):
+        make_doctor('dr_cruz', working_days='0123456', start_time=datetime.time(8), end_time=datetime.time(9),
+                    slot_minutes=30, slot_capacity=2)
+        tomorrow = MONDAY + datetime.timedelta(days=1)
+
+        result = self.plan([make_appointment(tomorrow) for _ in range(5)])
+
+        self.assertEqual([(day, at) for _, day, at in self.placed(result)], [
+            (tomorrow, datetime.time(8, 0)), (tomorrow, datetime.time(8, 0)),
+            (tomorrow, datetime.time(8, 30)), (tomorrow, datetime.time(8, 30)),
+            (tomorrow + datetime.timedelta(days=1), datetime.time(8, 0)),
+        ])
+
+    def test_existing_bookings_take_their_places(self):
+        doctor = make_doctor('dr_cruz')
+        tomorrow = MONDAY + datetime.timedelta(days=1)
+        make_appointment(tomorrow, status='confirmed', assigned_doctor=doctor, appointment_time=datetime.time(8))
+        make_appointment(tomorrow, status='cancelled', assigned_doctor=doctor, appointment_time=datetime.time(8, 30))
+
+        result = self.plan([make_appointment(tomorrow)])
+
+        self.assertEqual(self.placed(result), [('dr_cruz', tomorrow, datetime.time(8, 30))])
+
+    def test_skips_slots_already_started_today_and_past_dates(self):
+        make_doctor('dr_cruz')
+
+        result = self.plan([make_appointment(MONDAY), make_appointment(MONDAY - datetime.timedelta(days=3))])
+
+        self.assertEqual([(day, at) for _, day, at in self.placed(result)], [
+            (MONDAY, datetime.time(10, 30)), (MONDAY, datetime.time(11, 0)),
+        ])
+
+    def test_places_emergencies_first_and_on_the_least_booked_doctor(self):
+        make_doctor('dr_cruz')
+        make_doctor('dr_santos')
+        tomorrow = MONDAY + datetime.timedelta(days=1)
+        routine = make_appointment(tomorrow, 'checkup')
+        emergency = make_appointment(tomorrow, 'emergency')
+
+        result = self.plan([routine, emergency])
+
+        self.assertEqual([a.appointment for a in result.assignments], [emergency, routine])
+        self.assertEqual(self.placed(result), [
+            ('dr_cruz', tomorrow, datetime.time(8)), ('dr_santos', tomorrow, datetime.time(8)),
+        ])
+
+    @override_settings(APPOINTMENT_TYPE_DEPARTMENTS={'emergency': ['Emergency '], 'followup': ['Cardiology']})
+    def test_maps_appointment_types_to_departments(self):
+        make_doctor('dr_cruz', 'General Medicine')
+        make_doctor('dr_santos', 'emergency')
+        tomorrow = MONDAY + datetime.timedelta(days=1)
+        followup = make_appointment(tomorrow, 'followup')
+
+        result = self.plan([make_appointment(tomorrow, 'emergency'), make_appointment(tomorrow, 'emergency'),
+                            make_appointment(tomorrow), followup])
+
+        self.assertEqual([username for username, _, _ in self.placed(result)], ['dr_santos', 'dr_santos', 'dr_cruz'])
+        self.assertEqual([(c.appointment, c.reason) for c in result.conflicts],
+                         [(followup, 'No doctor in the departments for this appointment type')])
+
+    def test_reports_a_conflict_when_the_horizon_is_full(self):
+        make_doctor('dr_cruz', working_days='1', start_time=datetime.time(8), end_time=datetime.time(8, 30))
+        tomorrow = MONDAY + datetime.timedelta(days=1)
+        first, second = make_appointment(tomorrow), make_appointment(tomorrow)
+
+        result = self.plan([first, second], horizon_days=3)
+
+        self.assertEqual([a.appointment for a in result.assignments], [first])
+        self.assertEqual([c.appointment for c in result.conflicts], [second])
+        self.assertEqual(result.conflicts[0].reason, f'No free slot within 3 days of {tomorrow:%b %d, %Y}')
+
+    def test_schedule_saves_assignments_and_leaves_conflicts_pending(self):
+        make_doctor('dr_cruz', working_days='0123456', start_time=datetime.time(8), end_time=datetime.time(8, 30))
+        day = timezone.localdate() + datetime.timedelta(days=2)
+        first, second = make_appointment(day), make_appointment(day)
+
+        result = scheduling.schedule(horizon_days=0)
+
+        self.assertTrue(result.committed)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.status, first.assigned_doctor.username, first.appointment_date,
+                          first.appointment_time), ('assigned', 'dr_cruz', day, datetime.time(8)))
+        self.assertEqual((second.status, second.assigned_doctor), ('pending', None))
+
+    def test_schedule_without_commit_saves_nothing(self):
+        make_doctor('dr_cruz')
+        appointment = make_appointment(timezone.localdate() + datetime.timedelta(days=2))
+
+        result = scheduling.schedule(commit=False)
+
+        self.assertEqual([a.appointment for a in result.assignments], [appointment])
+        self.assertFalse(result.committed)
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.status, 'pending')
+
+    def test_a_zero_day_horizon_keeps_requests_on_their_preferred_day(self):
+        make_doctor('dr_cruz', working_days='0123456', start_time=datetime.time(8), end_time=datetime.time(8, 30))
+        day = timezone.localdate() + datetime.timedelta(days=2)
+        make_appointment(day)
+        make_appointment(day)
+        admin = User.objects.create_user('clerk')
+        admin.profile.role = 'admin'
+        admin.profile.save()
+        self.client.force_login(admin)
+
+        response = self.client.post(reverse('auto_assign_appointments'), {'horizon': '0', 'action': 'preview'})
+
+        self.assertEqual(response.context['horizon'], 0)
+        self.assertEqual([(a.day, a.time) for a in response.context['assignments']], [(day, datetime.time(8))])
+        self.assertEqual(len(response.context['conflicts']), 1)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AppointmentQueueTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('clerk')
+        self.admin.profile.role = 'admin'
+        self.admin.profile.save()
+        self.doctor = make_doctor('dr_cruz')
+        self.day = timezone.localdate() + datetime.timedelta(days=2)
+        self.pending = [make_appointment(self.day + datetime.timedelta(days=n), status='pending') for n in range(5)]
+
+    def fetch(self, queue='pending', **params):
+        return self.client.get(reverse('appointment_queue', args=[queue]), params)
+
+    def walk(self, queue='pending', **params):
+        """Ids of every page of `queue`, following the cursors"""
+        ids, cursor = [], None
+        while True:
+            data = self.fetch(queue, **params, **({'cursor': cursor} if cursor else {})).json()
+            ids.append([row['id'] for row in data['results']])
+            cursor = data['next']
+            if cursor is None:
+                return ids
+
+    def test_cursors_walk_every_row_once_newest_first(self):
+        self.client.force_login(self.admin)
+        ids = [a.id for a in reversed(self.pending)]
+
+        self.assertEqual(self.walk(limit=2), [ids[:2], ids[2:4], ids[4:]])
+        self.assertEqual(self.walk(limit=5), [ids])
+
+    def test_rows_added_meanwhile_do_not_shift_later_pages(self):
+        self.client.force_login(self.admin)
+        first = self.fetch(limit=2).json()
+
+        make_appointment(self.day, status='pending')
+        second = self.fetch(limit=2, cursor=first['next']).json()
+
+        self.assertEqual([row['id'] for row in second['results']], [self.pending[2].id, self.pending[1].id])
+
+    def test_malformed_cursors_and_limits_are_refused_or_clamped(self):
+        self.client.force_login(self.admin)
+
+        for params in ({'cursor': 'abc'}, {'cursor': '12.5'}, {'limit': 'ten'}):
+            response = self.fetch(**params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'error': 'cursor and limit must be integers.'})
+        self.assertEqual(len(self.fetch(limit=0).json()['results']), 1)
+        self.assertEqual(len(self.fetch(limit=1000).json()['results']), 5)
+
+    def test_date_window_filters_and_ignores_bad_dates(self):
+        self.client.force_login(self.admin)
+        window = {'date_from': (self.day + datetime.timedelta(days=1)).isoformat(),
+                  'date_to': (self.day + datetime.timedelta(days=2)).isoformat()}
+
+        self.assertEqual(self.walk(**window), [[self.pending[2].id, self.pending[1].id]])
+        self.assertEqual(len(self.fetch(date_from='soon').json()['results']), 5)
+
+    def test_doctors_see_only_their_own_appointments(self):
+        mine = make_appointment(self.day, status='assigned', assigned_doctor=self.doctor)
+        make_appointment(self.day, status='assigned', assigned_doctor=make_doctor('dr_santos'))
+        self.client.force_login(self.doctor)
+
+        self.assertEqual(self.walk('my-assigned'), [[mine.id]])
+
+    def test_unknown_queues_and_other_roles_queues_are_refused(self):
+        self.client.force_login(self.admin)
+        self.assertEqual(self.fetch('everything').status_code, 404)
+        self.assertEqual(self.fetch('my-all').status_code, 403)
+
+        self.client.force_login(self.doctor)
+        self.assertEqual(self.fetch('pending').status_code, 403)
+
+    def test_anonymous_users_are_sent_to_log_in(self):
+        response = self.fetch()
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(reverse('user_login')))
+
+
+def sse_events(body):
+    """[(id, event, data)] of the SSE messages in `body`; comments and bare retry/id lines are skipped"""
+    events = []
+    for message in body.decode().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in message.splitlines() if not line.startswith(':'))
+        if 'event' in fields:
+            events.append((fields.get('id'), fields['event'], json.loads(fields['data'])))
+    return events
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user('clerk')
+        self.admin.profile.role = 'admin'
+        self.admin.profile.save()
+        self.doctor = make_doctor('dr_cruz')
+        self.other = make_doctor('dr_santos')
+        self.day = timezone.localdate() + datetime.timedelta(days=2)
+
+    def replay(self, user, last_event_id=None):
+        self.client.force_login(user)
+        headers = {} if last_event_id is None else {'Last-Event-ID': str(last_event_id)}
+        return self.client.get(reverse('dashboard_events'), headers=headers)
+
+    def test_events_are_written_only_when_the_change_commits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                make_appointment(self.day)
+                raise RuntimeError('rolled back')
+        self.assertFalse(ChangeEvent.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment = make_appointment(self.day)
+            self.assertFalse(ChangeEvent.objects.exists())
+
+        event = ChangeEvent.objects.get()
+        self.assertEqual((event.kind, event.payload['id'], event.payload['created']), ('appointment', appointment.id, True))
+
+    def test_first_connection_starts_from_the_current_position(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_appointment(self.day)
+
+        body = self.replay(self.admin).content.decode()
+
+        self.assertIn(f'id: {changefeed.latest_id()}\n\n', body)
+        self.assertNotIn('event:', body)
+
+    def test_replay_sends_only_what_followed_last_event_id(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_appointment(self.day)
+        seen = changefeed.latest_id()
+        with self.captureOnCommitCallbacks(execute=True):
+            second = make_appointment(self.day, status='pending')
+            changefeed.appointments_changed('assigned', 2, [self.doctor.id])
+
+        events = sse_events(self.replay(self.admin, seen).content)
+
+        self.assertEqual([(kind, data.get('id')) for _, kind, data in events],
+                         [('appointment', second.id), ('appointments', None), ('counters', None)])
+        self.assertEqual(events[-1][2], {'pending': 2, 'assigned': 0})
+        self.assertEqual(events[1][0], str(changefeed.latest_id()))
+
+    def test_doctors_receive_only_their_own_appointment_events(self):
+        seen = changefeed.latest_id()
+        with self.captureOnCommitCallbacks(execute=True):
+            mine = make_appointment(self.day, status='assigned', assigned_doctor=self.doctor)
+            make_appointment(self.day, status='assigned', assigned_doctor=self.other)
+            changefeed.appointments_changed('confirmed', 3, [self.other.id])
+            changefeed.publish('stock', {'id': 1, 'name': 'Paracetamol', 'quantity': 0, 'reorder_level': 5})
+
+        response = self.replay(self.doctor, seen)
+        events = sse_events(response.content)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual([(kind, data.get('id')) for _, kind, data in events],
+                         [('appointment', mine.id), ('counters', None)])
+        self.assertEqual(events[-1][2], {'assigned': 1, 'confirmed': 0, 'total': 1})
+        # The browser is moved past the events it was not sent
+        self.assertTrue(response.content.decode().endswith(f'id: {changefeed.latest_id()}\n\n'))
+
+    def test_a_backlog_longer_than_the_replay_limit_asks_for_a_reload(self):
+        seen = changefeed.latest_id()
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                make_appointment(self.day)
+
+        with mock.patch.object(changefeed, 'REPLAY_LIMIT', 2):
+            events = sse_events(self.replay(self.admin, seen).content)
+
+        self.assertEqual(events, [(None, 'reload', {})])
+
+    def test_other_roles_are_refused(self):
+        chief = User.objects.create_user('chief')
+        chief.profile.role = 'super_admin'
+        chief.profile.save()
+
+        self.assertEqual(self.replay(chief).status_code, 403)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BulkAppointmentActionTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('clerk', password='x')
+        self.admin.profile.role = 'admin'
+        self.admin.profile.save()
+        self.doctor = make_doctor('dr_cruz', first_name='Jose', last_name='Cruz')
+        self.other_doctor = make_doctor('dr_santos')
+        self.day = timezone.localdate() + datetime.timedelta(days=2)
+
+    def statuses(self, *appointments):
+        return [PatientAppointment.objects.get(pk=a.pk).status for a in appointments]
+
+    def test_admin_assigns_pending_and_skips_the_rest(self):
+        pending = make_appointment(self.day)
+        confirmed = make_appointment(self.day, status='confirmed', assigned_doctor=self.other_doctor)
+
+        result = appointment_actions.apply('assign', [pending.pk, confirmed.pk, 999999], self.admin, 'admin',
+                                           doctor=self.doctor, appointment_time=datetime.time(9))
+
+        self.assertEqual(result.updated, [pending.pk])
+        self.assertEqual(result.skipped, {confirmed.pk: 'Is confirmed, must be pending', 999999: 'Not found'})
+        pending.refresh_from_db()
+        self.assertEqual((pending.status, pending.assigned_doctor, pending.assigned_admin, pending.appointment_time),
+                         ('assigned', self.doctor, self.admin, datetime.time(9)))
+        self.assertEqual(AccessLog.objects.get(access_type='data_update').description,
+                         f'Assigned appointment #{pending.pk} to Dr. Jose Cruz (bulk)')
+
+    def test_doctors_only_act_on_their_own_appointments(self):
+        mine = make_appointment(self.day, status='assigned', assigned_doctor=self.doctor)
+        theirs = make_appointment(self.day, status='assigned', assigned_doctor=self.other_doctor)
+
+        result = appointment_actions.apply('confirm', [mine.pk, theirs.pk], self.doctor, 'doctor')
+
+        self.assertEqual(result.updated, [mine.pk])
+        self.assertEqual(result.skipped, {theirs.pk: 'Not found or not assigned to you'})
+        self.assertEqual(self.statuses(mine, theirs), ['confirmed', 'assigned'])
+
+    def test_only_doctors_confirm_and_complete(self):
+        appointment = make_appointment(self.day, status='assigned', assigned_doctor=self.doctor)
+
+        for name in ('confirm', 'complete'):
+            with self.assertRaisesMessage(appointment_actions.BulkActionError, 'permission'):
+                appointment_actions.apply(name, [appointment.pk], self.admin, 'admin')
+        with self.assertRaisesMessage(appointment_actions.BulkActionError, 'permission'):
+            appointment_actions.apply('assign', [appointment.pk], self.doctor, 'doctor', doctor=self.doctor)
+        self.assertEqual(self.statuses(appointment), ['assigned'])
+
+    def test_status_guard_and_duplicates(self):
+        assigned = make_appointment(self.day, status='assigned', assigned_doctor=self.doctor)
+        confirmed = make_appointment(self.day, status='confirmed', assigned_doctor=self.doctor)
+
+        result = appointment_actions.apply('complete', [confirmed.pk, assigned.pk, confirmed.pk],
+                                           self.doctor, 'doctor')
+
+        self.assertEqual(result.updated, [confirmed.pk])
+        self.assertEqual(result.skipped, {assigned.pk: 'Is assigned, must be confirmed'})
+        self.assertEqual(AccessLog.objects.filter(access_type='data_update').count(), 1)
+
+    def test_rejects_oversized_batches_and_assigning_without_a_doctor(self):
+        with self.assertRaisesMessage(appointment_actions.BulkActionError, 'at most'):
+            appointment_actions.apply('cancel', range(appointment_actions.MAX_BATCH + 1), self.admin, 'admin')
+        with self.assertRaisesMessage(appointment_actions.BulkActionError, 'Choose a doctor'):
+            appointment_actions.apply('assign', [1], self.admin, 'admin')
+
+    def test_view_answers_json_and_refuses_admin_confirm(self):
+        appointment = make_appointment(self.day, status='assigned', assigned_doctor=self.doctor)
+        url = reverse('bulk_appointment_action')
+
+        self.client.force_login(self.admin)
+        response = self.client.post(url, {'action': 'confirm', 'appointment_ids': [appointment.pk]},
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_login(self.doctor)
+        response = self.client.post(url, {'action': 'confirm', 'appointment_ids': [appointment.pk]},
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {'action': 'confirm', 'updated': [appointment.pk], 'skipped': {}})
+        self.assertEqual(self.statuses(appointment), ['confirmed'])
+
+
+@override_settings(SQL_INSTRUMENTATION_HEADERS=True, CACHE_INVALIDATION_POLL_SECONDS=0)
+class AsgiMiddlewareTests(TestCase):
+    @override_settings(DEBUG=True)
+    def test_async_chain_needs_no_sync_adapters(self):
+        # Django logs every middleware it has to adapt to the other mode when DEBUG is on
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
+
+    def test_queries_are_counted_the_same_under_asgi(self):
+        user = User.objects.create_user('dr_cruz')
+        self.client.force_login(user)
+        self.async_client.force_login(user)
+
+        expected = self.client.get(reverse('doctor_lookup'))['X-DB-Queries']
+        response = async_to_sync(self.async_client.get)(reverse('doctor_lookup'))
+
+        self.assertEqual(response['X-DB-Queries'], expected)
+        self.assertGreater(int(expected), 0)
+
+
+class QueryInstrumentationTests(TestCase):
+    def run_queries(self, repeats=3):
+        for _ in range(repeats):
+            User.objects.filter(username='dr_cruz').exists()
+        User.objects.count()
+
+    def view(self, request):
+        self.run_queries()
+        return HttpResponse()
+
+    def test_recorder_counts_statements_and_repeats(self):
+        with QueryRecorder() as recorder:
+            self.run_queries()
+
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual(recorder.duplicates, 2)
+        self.assertEqual([n for _, n in recorder.repeated(threshold=3)], [3])
+        self.assertEqual(recorder.summary()['queries'], 4)
+
+    def test_recorder_stops_at_the_end_of_the_block(self):
+        with QueryRecorder() as recorder:
+            self.run_queries(repeats=1)
+        self.run_queries()
+
+        self.assertEqual(recorder.count, 2)
+
+    @override_settings(SQL_INSTRUMENTATION_HEADERS=True)
+    def test_middleware_reports_the_requests_queries(self):
+        middleware = QueryInstrumentationMiddleware(self.view)
+
+        response = middleware(RequestFactory().get('/'))
+
+        self.assertEqual(response['X-DB-Queries'], '4')
+        self.assertEqual(response['X-DB-Duplicates'], '2')
+        self.assertIn('desc="4 queries"', response['Server-Timing'])
+
+    def test_the_test_runner_makes_budgets_strict(self):
+        self.assertTrue(budgets_are_strict())
+
+    def test_budget_raises_when_strict_and_warns_otherwise(self):
+        view = query_budget(2)(self.view)
+        request = RequestFactory().get('/')
+
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'ran 4 queries, budget is 2'):
+            view(request)
+        with override_settings(QUERY_BUDGET_STRICT=False), self.assertLogs('hpis.sql', 'WARNING'):
+            self.assertEqual(view(request).status_code, 200)
+
+    def test_max_repeated_catches_a_loop_within_the_total(self):
+        view = query_budget(10, max_repeated=2)(self.view)
+
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'repeated 3 times (max 2)'):
+            view(RequestFactory().get('/'))
+
+
+# Two TieredCache aliases stand in for two workers: each has its own L1 and
+# both share the 'shared' L2
+WORKER_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tiered-default'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tiered-l2'},
+    **{
+        worker: {
+            'BACKEND': 'main.cache.TieredCache',
+            'LOCATION': worker,
+            'OPTIONS': {'L2': 'shared', 'L1_TIMEOUT': 30, 'L1_EXCLUDE_PREFIXES': ('throttle:',)},
+        }
+        for worker in ('worker_a', 'worker_b')
+    },
+}
+
+
+@override_settings(CACHES=WORKER_CACHES, CACHE_INVALIDATION_POLL_SECONDS=0)
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        self.a, self.b = caches['worker_a'], caches['worker_b']
+        self.a.clear()
+        self.b.clear_local()
+
+    def gets(self, worker, result):
+        return metrics.CACHE_OPERATIONS.samples.get((worker.location, 'app', 'get', result), 0)
+
+    def test_reads_fall_back_to_l2_and_are_then_served_from_l1(self):
+        self.a.set('ward', 'A3')
+        before = {result: self.gets(self.b, result) for result in ('l1_hit', 'l2_hit', 'miss')}
+
+        self.assertEqual(self.b.get('ward'), 'A3')
+        self.assertEqual(self.b.get('ward'), 'A3')
+        self.assertIsNone(self.b.get('bed'))
+
+        self.assertEqual(self.gets(self.b, 'l2_hit') - before['l2_hit'], 1)
+        self.assertEqual(self.gets(self.b, 'l1_hit') - before['l1_hit'], 1)
+        self.assertEqual(self.gets(self.b, 'miss') - before['miss'], 1)
+        self.assertEqual(self.b.l1.get('ward'), 'A3')
+
+    def test_get_many_fills_l1_from_l2(self):
+        self.a.set_many({'ward': 'A3', 'bed': 7})
+        self.b.set('floor', 2)
+
+        self.assertEqual(self.b.get_many(['ward', 'bed', 'floor', 'room']), {'ward': 'A3', 'bed': 7, 'floor': 2})
+        self.assertEqual(self.b.l1.get('bed'), 7)
+
+    def test_excluded_prefixes_never_enter_l1(self):
+        self.a.set('throttle:login', 1)
+        self.a.incr('throttle:login')
+
+        self.assertEqual(self.b.get('throttle:login'), 2)
+        self.assertFalse(self.a.l1.has_key('throttle:login'))
+        self.assertFalse(self.b.l1.has_key('throttle:login'))
+
+    def test_writes_reach_other_workers_once_their_l1_is_cleared(self):
+        self.a.set('ward', 'A3')
+        self.b.get('ward')
+
+        self.a.set('ward', 'B1')
+        self.assertEqual(self.b.get('ward'), 'A3')  # stale until L1_TIMEOUT or an invalidation
+        self.b.clear_local()
+        self.assertEqual(self.b.get('ward'), 'B1')
+
+        self.a.delete('ward')
+        self.b.clear_local()
+        self.assertIsNone(self.b.get('ward'))
+
+    def test_a_version_bump_clears_l1_in_every_worker(self):
+        invalidation.poll(force=True)
+        self.a.set('ward', 'A3')
+        self.b.get('ward')
+        self.a.l2.set('ward', 'B1')  # changed behind both workers' L1
+
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidation.bump('medicine')
+
+        self.assertEqual(CacheVersion.objects.get(namespace='medicine').version, 1)
+        self.assertEqual(self.a.get('ward'), 'B1')
+        self.assertEqual(self.b.get('ward'), 'B1')
+
+    def test_polling_picks_up_another_workers_bump(self):
+        invalidation.poll(force=True)
+        self.b.set('ward', 'A3')
+        self.b.l2.set('ward', 'B1')
+
+        # Another process bumps the row without touching this one's L1
+        CacheVersion.objects.create(namespace='appointment', version=1)
+        self.assertEqual(self.b.get('ward'), 'A3')
+        invalidation.poll()
+
+        self.assertEqual(self.b.get('ward'), 'B1')
+        self.assertEqual(invalidation.versions('appointment', 'profile'), [1, 0])
+
+
+def worker_registry():
+    """A registry shaped like one gunicorn worker's"""
+    registry = metrics.Registry()
+    registry.counter('requests_total', 'Requests.', ('view',))
+    registry.histogram('latency_seconds', 'Latency.', ('view',), buckets=(0.1, 1))
+    registry.gauge('depth', 'Depth.', ('queue',), lambda: {('emails',): 3})
+    return registry
+
+
+class MetricsRegistryTests(TestCase):
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(METRICS_DIR=self.directory))
+
+    def test_scrape_adds_up_every_workers_snapshot(self):
+        other = worker_registry()
+        other.metrics['requests_total'].inc(view='home')
+        other.metrics['requests_total'].inc(2, view='login')
+        other.metrics['latency_seconds'].observe(0.5, view='home')
+        Path(self.directory, 'worker-999999.json').write_text(json.dumps(other.snapshot()))
+        this = worker_registry()
+        this.metrics['requests_total'].inc(3, view='home')
+        this.metrics['latency_seconds'].observe(0.05, view='home')
+        this.metrics['latency_seconds'].observe(5, view='home')
+        this.flush()
+
+        collected = this.collect()
+
+        self.assertEqual(collected['requests_total'], {('home',): 4, ('login',): 2})
+        self.assertEqual(collected['latency_seconds'], {('home',): [[1, 1, 1], 5.55, 3]})
+        rendered = this.render()
+        self.assertIn('latency_seconds_bucket{view="home",le="1"} 2', rendered)
+        self.assertIn('latency_seconds_bucket{view="home",le="+Inf"} 3', rendered)
+        self.assertIn('depth{queue="emails"} 3', rendered)
+
+    def test_unreadable_snapshots_are_skipped(self):
+        Path(self.directory, 'worker-999999.json').write_text('{"requests_total": [[["ho')
+        this = worker_registry()
+        this.metrics['requests_total'].inc(view='home')
+
+        self.assertEqual(this.collect()['requests_total'], {('home',): 1})
+
+
+@override_settings(METRICS_TOKEN='scrape-secret', METRICS_DIR='')
+class MetricsViewTests(TestCase):
+    def sign_in(self, role):
+        user = User.objects.create_user(f'{role}_user')
+        user.profile.role = role
+        user.profile.save()
+        self.client.force_login(user)
+
+    def test_scrapers_need_the_bearer_token(self):
+        url = reverse('metrics')
+
+        response = self.client.get(url, headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE hpis_http_requests_total counter', response.content.decode())
+
+        for headers in ({}, {'Authorization': 'Bearer wrong'}, {'Authorization': 'Basic c2NyYXBl'}):
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="metrics"')
+
+    @override_settings(METRICS_TOKEN='')
+    def test_an_unset_token_lets_no_scraper_in(self):
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer '})
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_signed_in_admins_may_view_and_doctors_are_refused(self):
+        self.sign_in('admin')
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+        self.sign_in('doctor')
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+
+# The dashboard's queries run concurrently on other connections, which
+# SQLite would block behind TestCase's open transaction
+@override_settings(SQL_INSTRUMENTATION_HEADERS=True, QUERY_BUDGET_STRICT=True)
+class AnalyticsDashboardTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('clerk')
+        self.user.profile.role = 'admin'
+        self.user.profile.save()
+
+    def test_stays_within_its_query_budget(self):
+        self.client.force_login(self.user)
+
+        for params in ({}, {'department': 'Cardiology'}):
+            response = self.client.get(reverse('analytics_dashboard'), params)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(int(response['X-DB-Queries']), 13)
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    EMAIL_OUTBOX_BATCH_SIZE=50, EMAIL_OUTBOX_MAX_ATTEMPTS=3, EMAIL_OUTBOX_BACKOFF_SECONDS=60,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('dr_cruz', email='cruz@example.com')
+
+    def enqueue(self, category='system', body='Body', **fields):
+        return outbox.enqueue(category, self.user.email, 'Subject', body, user=self.user, **fields)
+
+    def failing_sends(self):
+        return mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                          side_effect=smtplib.SMTPException('Connection unexpectedly closed'))
+
+    def test_sends_a_batch_over_one_connection(self):
+        emails = [self.enqueue(), self.enqueue(), self.enqueue(html_body='<p>Body</p>')]
+
+        with mock.patch('main.outbox.get_connection', wraps=get_connection) as connect:
+            result = outbox.dispatch()
+
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(result.sent, emails)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[2].alternatives[0][0], '<p>Body</p>')
+        self.assertEqual(outbox.dispatch().sent, [])
+
+    def test_sent_emails_keep_no_body(self):
+        email = self.enqueue('account', 'Temporary password: s3cret', html_body='<code>s3cret</code>')
+
+        outbox.dispatch()
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts, email.body, email.html_body), ('sent', 1, '', ''))
+        self.assertIsNotNone(email.sent_at)
+        self.assertIn('s3cret', mail.outbox[0].body)
+
+    def test_preferences_skip_opted_out_categories_but_not_account_emails(self):
+        NotificationPreference.objects.update_or_create(user=self.user, defaults={'system_updates': False})
+        system, account = self.enqueue('system'), self.enqueue('account')
+
+        result = outbox.dispatch()
+
+        self.assertEqual((result.skipped, result.sent), ([system], [account]))
+        system.refresh_from_db()
+        self.assertEqual((system.status, system.attempts, system.body), ('skipped', 0, ''))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failures_back_off_then_give_up(self):
+        email = self.enqueue()
+
+        for attempt, delay in ((1, 60), (2, 120)):
+            started = timezone.now()
+            with self.failing_sends():
+                self.assertEqual(outbox.dispatch().retried, [email])
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts, email.body), ('pending', attempt, 'Body'))
+            self.assertGreaterEqual(email.next_attempt_at, started + datetime.timedelta(seconds=delay))
+            self.assertIn('SMTPException', email.last_error)
+            self.assertEqual(outbox.dispatch().retried, [])  # not due yet
+            OutboxEmail.objects.update(next_attempt_at=timezone.now())
+
+        with self.failing_sends():
+            self.assertEqual(outbox.dispatch().failed, [email])
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts, email.body), ('failed', 3, ''))
+
+    def test_a_connection_failure_retries_the_whole_batch(self):
+        emails = [self.enqueue(), self.enqueue()]
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=OSError('refused')):
+            result = outbox.dispatch()
+
+        self.assertEqual(result.retried, emails)
+        self.assertEqual(mail.outbox, [])
+
+    def test_command_drains_the_outbox_in_batches(self):
+        for _ in range(5):
+            self.enqueue()
+        stdout = io.StringIO()
+
+        call_command('send_outbox', batch_size=2, stdout=stdout)
+
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertIn('Sent 5 emails', stdout.getvalue())
+
+    def test_admin_never_shows_bodies(self):
+        admin = User.objects.create_superuser('root', 'root@example.com', 'x')
+        email = self.enqueue('account', 'Temporary password: s3cret')
+        self.client.force_login(admin)
+
+        response = self.client.get(reverse('admin:main_outboxemail_change', args=[email.pk]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 's3cret')
+
+
+class GenerateDatasetGuardTests(TestCase):
+    def assert_refused(self, reason):
+        with self.assertRaisesMessage(CommandError, reason):
+            call_command('generate_dataset', scale=0.001, stdout=io.StringIO())
+        self.assertFalse(User.objects.exists())
+
+    @override_settings(DEBUG=False)
+    def test_refuses_when_debug_is_off(self):
+        self.assert_refused('DEBUG is off')
+
+    @override_settings(DEBUG=True)
+    def test_refuses_a_remote_database(self):
+        remote = mock.Mock(vendor='postgresql', settings_dict={'HOST': 'db.example.com'})
+        with mock.patch('main.management.commands.generate_dataset.connection', remote):
+            self.assert_refused('The database is on db.example.com')
+
+    @override_settings(DEBUG=False, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+    def test_force_runs_anyway(self):
+        stdout = io.StringIO()
+
+        call_command('generate_dataset', scale=0.001, force=True, stdout=stdout)
+
+        self.assertIn('Generated', stdout.getvalue())
+        self.assertTrue(User.objects.exists())
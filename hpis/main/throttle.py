@@ -0,0 +1,189 @@
+"""
+Sliding-window throttles for public endpoints, checked before any expensive
+work (password hashing, database writes) is done.
+
+Hits are counted per key (a username, a client IP) in two fixed windows in
+the shared cache, the previous one weighted by how much of it still overlaps
+the last `window` seconds. Once a key is over its limit the request is
+refused, and the worker remembers the block in memory for up to
+THROTTLE_LOCAL_SECONDS, so a flood costs one dict lookup per request.
+Throttle keys start with `throttle:` and are kept out of the L1 cache
+(settings.CACHES), so every worker counts against the same numbers.
+
+LoginThrottle counts failed logins per username and per IP; its limits halve
+while the 1-minute load average per CPU is above LOGIN_THROTTLE_LOAD_FACTOR,
+when hashing competes with page requests for CPU. Failures against a real
+account are written to AccessLog as one `failed_login` row per user and
+window, whose description is updated with the running count instead of
+adding a row per attempt.
+
+IntakeThrottle counts public appointment requests per IP.
+
+Per-IP keys use client_ip(), which trusts only the X-Forwarded-For entries
+appended by our own TRUSTED_PROXY_COUNT proxies. Entries further left are
+whatever the client sent, and keying on them would let a client rotate the
+header to get a fresh bucket for every attempt.
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+_local_blocks = {}  # cache key prefix -> (local block ends, retry allowed), time.monotonic()
+_local_lock = threading.Lock()
+LOCAL_MAX_ENTRIES = 10000
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def client_ip(request):
+    """The address that connected to the outermost of our TRUSTED_PROXY_COUNT proxies"""
+    proxies = _setting('TRUSTED_PROXY_COUNT', 0)
+    if proxies > 0:
+        hops = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+        if len(hops) >= proxies:
+            return hops[-proxies]
+    return request.META.get('REMOTE_ADDR')
+
+
+def under_cpu_pressure():
+    factor = _setting('LOGIN_THROTTLE_LOAD_FACTOR', 1.5)
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return False
+    return bool(factor) and load > factor
+
+
+class SlidingWindowThrottle:
+    """Subclasses set `window` and implement limits() -> {scope: hits allowed per window}"""
+
+    window = 300
+
+    def __init__(self, **values):
+        self.prefixes = {scope: self._prefix(scope, value) for scope, value in values.items()}
+
+    @staticmethod
+    def _prefix(scope, value):
+        return f"throttle:{scope}:{hashlib.md5(str(value).encode('utf-8')).hexdigest()}"
+
+    def limits(self):
+        raise NotImplementedError
+
+    def _position(self):
+        now = time.time()
+        return int(now // self.window), (now % self.window) / self.window
+
+    def retry_after(self):
+        """Seconds until another request is allowed; 0 when it is allowed now"""
+        now = time.monotonic()
+        with _local_lock:
+            for prefix in self.prefixes.values():
+                block = _local_blocks.get(prefix)
+                if block is not None:
+                    if block[0] > now:
+                        return max(1, math.ceil(block[1] - now))
+                    del _local_blocks[prefix]
+
+        current, elapsed = self._position()
+        keys = {prefix: (f'{prefix}:{current}', f'{prefix}:{current - 1}') for prefix in self.prefixes.values()}
+        counts = cache.get_many([key for pair in keys.values() for key in pair])
+
+        wait = 0
+        for scope, limit in self.limits().items():
+            prefix = self.prefixes[scope]
+            current_key, previous_key = keys[prefix]
+            estimate = counts.get(previous_key, 0) * (1 - elapsed) + counts.get(current_key, 0)
+            if estimate >= limit:
+                # The estimate only falls once the current window rolls over
+                wait = max(wait, math.ceil(self.window * (1 - elapsed)))
+                local = min(wait, _setting('THROTTLE_LOCAL_SECONDS', 10))
+                with _local_lock:
+                    if len(_local_blocks) >= LOCAL_MAX_ENTRIES:
+                        for stale in [k for k, v in _local_blocks.items() if v[0] <= now]:
+                            del _local_blocks[stale]
+                    _local_blocks[prefix] = (now + local, now + wait)
+        return wait
+
+    def hit(self):
+        """Count one hit against every key; returns {scope: hits in the current window}"""
+        current, _ = self._position()
+        counts = {}
+        for scope, prefix in self.prefixes.items():
+            key = f'{prefix}:{current}'
+            if cache.add(key, 1, self.window * 2):
+                counts[scope] = 1
+                continue
+            try:
+                counts[scope] = cache.incr(key)
+            except ValueError:  # expired between add() and incr()
+                cache.set(key, 1, self.window * 2)
+                counts[scope] = 1
+        return counts
+
+    def reset(self, scope):
+        current, _ = self._position()
+        prefix = self.prefixes[scope]
+        cache.delete_many([f'{prefix}:{current}', f'{prefix}:{current - 1}'])
+        with _local_lock:
+            _local_blocks.pop(prefix, None)
+
+
+class LoginThrottle(SlidingWindowThrottle):
+    def __init__(self, identifier, ip_address):
+        self.window = _setting('LOGIN_THROTTLE_WINDOW', 300)
+        super().__init__(
+            login_username=(identifier or '').strip().lower(),
+            login_ip=ip_address or 'unknown',
+        )
+
+    def limits(self):
+        limits = {
+            'login_username': _setting('LOGIN_THROTTLE_USERNAME_LIMIT', 5),
+            'login_ip': _setting('LOGIN_THROTTLE_IP_LIMIT', 20),
+        }
+        if under_cpu_pressure():
+            return {scope: max(1, limit // 2) for scope, limit in limits.items()}
+        return limits
+
+    def failed(self, user=None, request=None):
+        """Count a failed attempt; for an existing `user`, fold it into the window's AccessLog row"""
+        failures = self.hit()['login_username']
+        if user is not None:
+            self._log(user, self._position()[0], failures, request)
+
+    def succeeded(self):
+        """A correct password clears the username's failures (not the IP's)"""
+        self.reset('login_username')
+
+    def _log(self, user, window, failures, request):
+        from .models import AccessLog
+        from .views import log_access
+
+        minutes = max(1, self.window // 60)
+        description = (
+            'Failed login attempt' if failures <= 1
+            else f'{failures} failed login attempts within {minutes} minutes'
+        )
+        key = f'throttle:log:{user.pk}:{window}'
+        log_id = cache.get(key)
+        if log_id is not None and AccessLog.objects.filter(pk=log_id).update(description=description):
+            return
+        entry = log_access(user, 'failed_login', description, request)
+        if entry is not None:
+            cache.set(key, entry.pk, self.window * 2)
+
+
+class IntakeThrottle(SlidingWindowThrottle):
+    def __init__(self, ip_address):
+        self.window = _setting('INTAKE_THROTTLE_WINDOW', 600)
+        super().__init__(intake_ip=ip_address or 'unknown')
+
+    def limits(self):
+        return {'intake_ip': _setting('INTAKE_THROTTLE_LIMIT', 10)}
@@ -11,6 +11,7 @@ urlpatterns = [
     path("homepage/", views.homepage, name="homepage"),
     path('support/', views.help_faq_view, name='help_faq'),
     path('contact/', views.contact_us_view, name='contact_us'),
+    path('metrics', views.metrics_view, name='metrics'),
 
     # Super Admin URLs
     path("admin/dashboard/", views.super_admin_dashboard, name="super_admin_dashboard"),
@@ -25,6 +26,11 @@ urlpatterns = [
     # Admin URLs
     path("admin-panel/dashboard/", views.admin_dashboard, name="admin_dashboard"),
     path("admin-panel/assign-appointment/<int:appointment_id>/", views.assign_appointment, name="assign_appointment"),
+    path("admin-panel/auto-assign/", views.auto_assign_appointments, name="auto_assign_appointments"),
+    path("api/appointments/<str:queue>/", views.appointment_queue, name="appointment_queue"),
+    path("appointments/bulk/", views.bulk_appointment_action, name="bulk_appointment_action"),
+    path("events/", views.dashboard_events, name="dashboard_events"),
+    path("lookup/doctors/", views.doctor_lookup, name="doctor_lookup"),
     path('records/', include('records.urls')),
 
     # Doctor URLs
@@ -4,24 +4,36 @@ from django.contrib.auth.models import User
 from django.utils.crypto import get_random_string
 import string
 from django.contrib import messages
-from django.http import JsonResponse, FileResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, FileResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.html import escape
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth import authenticate, login, logout, update_session_auth_hash
 from datetime import timedelta
+import hmac
 import json
 import csv
 from django.contrib.auth import update_session_auth_hash
 from io import BytesIO, StringIO
 from functools import wraps
 
-from .forms import LoginForm, CustomPasswordChangeForm, NotificationPreferencesForm, UserProfileForm
+from asgiref.sync import iscoroutinefunction
+
+from . import appointment_actions, changefeed, concurrency, intake, metrics, outbox, queues, scheduling
+from .fragments import acached_widget, cached_widget
+from .instrumentation import query_budget
+from .forms import (
+    AppointmentRequestForm, BulkAppointmentActionForm, LoginForm, CustomPasswordChangeForm, NotificationPreferencesForm, UserProfileForm,
+)
+from .lookups import lookup_response
+from .principal import find_login_user
+from .throttle import IntakeThrottle, LoginThrottle, client_ip
 from .models import (
     UserProfile, NotificationPreference, AccessLog,
     DataExportRequest, DeleteAccountRequest, PatientAppointment, Report
 )
 from django.db import transaction
-from django.core.mail import send_mail
 from django.http import HttpResponse
 import openpyxl
 from openpyxl.styles import Font, PatternFill
@@ -34,7 +46,8 @@ from django.contrib.auth import logout
 from django.shortcuts import redirect
 from django.views.decorators.http import require_POST
 
-from django.views.decorators.cache import never_cache
+from django.views.decorators.cache import cache_page, never_cache
+from django.conf import settings as django_settings
 
 
 @require_POST
@@ -57,13 +70,8 @@ def admin_dashboard(request):
     ...
 
 def get_client_ip(request):
-    """Extract client IP address from request"""
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
+    """Extract client IP address from request (only trusting our own proxies' X-Forwarded-For entries)"""
+    return client_ip(request)
 
 
 def log_access(user, access_type, description="", request=None):
@@ -71,7 +79,7 @@ def log_access(user, access_type, description="", request=None):
     ip_address = get_client_ip(request) if request else None
     user_agent = request.META.get('HTTP_USER_AGENT', '') if request else ''
 
-    AccessLog.objects.create(
+    return AccessLog.objects.create(
         user=user,
         access_type=access_type,
         ip_address=ip_address,
@@ -83,22 +91,32 @@ def log_access(user, access_type, description="", request=None):
 def role_required(*allowed_roles):
     """Decorator to check if user has required role"""
 
-    def decorator(view_func):
-        @wraps(view_func)
-        def wrapper(request, *args, **kwargs):
-            if not request.user.is_authenticated:
-                return redirect('user_login')
+    def refuse(request):
+        """Redirect for a user without one of the allowed roles, else None"""
+        if not request.user.is_authenticated:
+            return redirect('user_login')
 
-            try:
-                user_role = request.user.profile.role
-            except UserProfile.DoesNotExist:
-                return redirect('user_login')
+        # Cached in the session; see main/principal.py
+        user_role = request.principal.role
+        if user_role is None:
+            return redirect('user_login')
 
-            if user_role not in allowed_roles:
-                messages.error(request, 'You do not have permission to access this page.')
-                return redirect('homepage')
+        if user_role not in allowed_roles:
+            messages.error(request, 'You do not have permission to access this page.')
+            return redirect('homepage')
+        return None
 
-            return view_func(request, *args, **kwargs)
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def wrapper(request, *args, **kwargs):
+                # Reuse the user async login_required loaded; request.user would load it again
+                request.user = await request.auser()
+                return await concurrency.run(refuse, request) or await view_func(request, *args, **kwargs)
+        else:
+            @wraps(view_func)
+            def wrapper(request, *args, **kwargs):
+                return refuse(request) or view_func(request, *args, **kwargs)
 
         return wrapper
 
@@ -107,15 +125,20 @@ def role_required(*allowed_roles):
 
 # ==================== Authentication Views ====================
 
+# Public pages without forms are the only ones cached whole; GETs only, varied by cookie
+
+@cache_page(django_settings.CACHE_MIDDLEWARE_SECONDS)
 def help_faq_view(request):
     """Renders the public-facing Help/FAQ page."""
     return render(request, 'help_faq.html', {'title': 'Help & FAQ'})
 
+@cache_page(django_settings.CACHE_MIDDLEWARE_SECONDS)
 def about_us(request):
     """Renders the public-facing About Us page."""
     return render(request, 'about_us.html', {'title': 'About Us'})
 
 
+# Not cached: a cached copy of a page with {% csrf_token %} would not set the visitor's CSRF cookie
 def contact_us_view(request):
     """Renders the public-facing Contact Us page."""
     # Logic for handling the form submission would go here (checking POST request)
@@ -125,22 +148,25 @@ def contact_us_view(request):
 def landing_page(request):
     """Landing page with appointment booking form for patients"""
     if request.method == "POST":
-        # Create appointment from form data
-        appointment = PatientAppointment.objects.create(
-            first_name=request.POST.get('first_name'),
-            last_name=request.POST.get('last_name'),
-            middle_name=request.POST.get('middle_name', ''),
-            date_of_birth=request.POST.get('dob'),
-            gender=request.POST.get('gender'),
-            email=request.POST.get('email'),
-            contact_number=request.POST.get('contact'),
-            address=request.POST.get('address'),
-            appointment_type=request.POST.get('appointment_type'),
-            appointment_date=request.POST.get('available_date'),
-            notes=request.POST.get('notes', ''),
-            status='pending'
-        )
+        throttle = IntakeThrottle(get_client_ip(request))
+        retry_after = throttle.retry_after()
+        if retry_after:
+            metrics.INTAKE_REQUESTS.inc(result='rate_limited')
+            response = render(request, 'landing_page.html', {
+                'intake_error': 'Too many appointment requests from your connection. Please try again later.',
+            }, status=429)
+            response['Retry-After'] = str(retry_after)
+            return response
+        throttle.hit()
 
+        form = AppointmentRequestForm(request.POST)
+        if not form.is_valid():
+            metrics.INTAKE_REQUESTS.inc(result='invalid')
+            errors = [error for field_errors in form.errors.values() for error in field_errors]
+            return render(request, 'landing_page.html', {'intake_error': ' '.join(errors)}, status=400)
+
+        # Duplicates get the same answer: the original request is on file
+        intake.submit(form.cleaned_data)
         messages.success(
             request,
             'Your appointment request has been submitted. An admin will review and assign it to a doctor shortly.'
@@ -158,15 +184,28 @@ def user_login(request):
             identifier = form.cleaned_data['username']
             password = form.cleaned_data['password']
 
-            try:
-                user_obj = User.objects.get(username__iexact=identifier)
-            except User.DoesNotExist:
+            # Refuse floods before the user lookup and the password hash
+            throttle = LoginThrottle(identifier, get_client_ip(request))
+            retry_after = throttle.retry_after()
+            if retry_after:
+                messages.error(
+                    request,
+                    f"Too many failed login attempts. Try again in {max(1, round(retry_after / 60))} minute(s).",
+                )
+                response = render(request, "login.html", {"form": form}, status=429)
+                response['Retry-After'] = str(retry_after)
+                return response
+
+            user_obj = find_login_user(identifier)
+            if user_obj is None:
+                throttle.failed()
                 messages.error(request, "User not found.")
                 return render(request, "login.html", {"form": form})
 
-            user = authenticate(request, username=user_obj.username, password=password)
+            user = authenticate(request, username=user_obj.username, password=password, user=user_obj)
 
             if user is not None:
+                throttle.succeeded()
                 login(request, user)
                 # If the user's profile requires a password change, redirect them to change-password
                 try:
@@ -200,8 +239,7 @@ def user_login(request):
                     return redirect('homepage')
             else:
                 messages.error(request, "Incorrect password.")
-                if 'user_obj' in locals():
-                    log_access(user_obj, 'failed_login', 'Failed login attempt', request)
+                throttle.failed(user_obj, request)
     else:
         form = LoginForm()
 
@@ -212,27 +250,33 @@ def user_login(request):
 
 @login_required
 @role_required('super_admin')
-def super_admin_dashboard(request):
+async def super_admin_dashboard(request):
     """Super Admin main dashboard"""
     from django.db.models import Count, Q
-    
-    # Optimize with single aggregated query
-    staff_counts = UserProfile.objects.aggregate(
-        total_staff=Count('id', filter=Q(role__in=['admin', 'doctor'])),
-        admins=Count('id', filter=Q(role='admin')),
-        doctors=Count('id', filter=Q(role='doctor')),
-    )
-    
-    stats = {
-        'total_staff': staff_counts['total_staff'],
-        'admins': staff_counts['admins'],
-        'doctors': staff_counts['doctors'],
-        'pending_appointments': PatientAppointment.objects.filter(status='pending').count(),
-    }
 
-    log_access(request.user, 'data_view', 'Accessed super admin dashboard', request)
+    async def compute_stats():
+        # Independent queries run concurrently; see main/concurrency.py
+        results = await concurrency.gather(
+            staff=lambda: UserProfile.objects.aggregate(
+                total_staff=Count('id', filter=Q(role__in=['admin', 'doctor'])),
+                admins=Count('id', filter=Q(role='admin')),
+                doctors=Count('id', filter=Q(role='doctor')),
+            ),
+            pending=PatientAppointment.objects.filter(status='pending').count,
+        )
+        staff_counts = results['staff']
+        return {
+            'total_staff': staff_counts['total_staff'],
+            'admins': staff_counts['admins'],
+            'doctors': staff_counts['doctors'],
+            'pending_appointments': results['pending'],
+        }
+
+    stats = await acached_widget(request, 'super_admin.stats', compute_stats, ('profile', 'appointment'))
 
-    return render(request, 'super_admin_dashboard.html', {'stats': stats})
+    await concurrency.run(log_access, request.user, 'data_view', 'Accessed super admin dashboard', request)
+
+    return await concurrency.run(render, request, 'super_admin_dashboard.html', {'stats': stats})
 
 
 @login_required
@@ -269,19 +313,20 @@ def create_staff(request):
             # Create user with temporary password
             # temp_password = User.objects.make_random_password(12)
             temp_password = str(123456)
-            user = User.objects.create_user(
-                username=username,
-                email=email,
-                password=temp_password,
-                first_name=first_name,
-                last_name=last_name
-            )
 
-            # Create profile with role and notification preferences atomically
             # Read optional checkbox to email temp password
             email_temp = request.POST.get('email_temp_password') == 'on'
 
+            # Create the user, profile and welcome email atomically
             with transaction.atomic():
+                user = User.objects.create_user(
+                    username=username,
+                    email=email,
+                    password=temp_password,
+                    first_name=first_name,
+                    last_name=last_name
+                )
+
                 # Safely get the profile (which may have been created by a signal)
                 profile, created = UserProfile.objects.get_or_create(user=user)
 
@@ -298,40 +343,31 @@ def create_staff(request):
                 # Keep the NotificationPreference check as a safety measure
                 NotificationPreference.objects.get_or_create(user=user)
 
-            # Optionally send the temporary password via email (HTML)
-            if email_temp and email:
-                try:
-                    subject = 'Welcome to the Healthcare Patient Information System'
-                    plain_message = (
-                        f'Hello {first_name or username},\n\n'
-                        f'An account has been created for you.\n'
-                        f'Username: {username}\n'
-                        f'Temporary password: {temp_password}\n\n'
-                        'Please change your password on first login.\n\n'
-                        'If you have any questions, contact IT Support.'
+                # Optionally email the temporary password; send_outbox delivers it
+                if email_temp and email:
+                    outbox.enqueue(
+                        'account',
+                        email,
+                        'Welcome to the Healthcare Patient Information System',
+                        (
+                            f'Hello {first_name or username},\n\n'
+                            f'An account has been created for you.\n'
+                            f'Username: {username}\n'
+                            f'Temporary password: {temp_password}\n\n'
+                            'Please change your password on first login.\n\n'
+                            'If you have any questions, contact IT Support.'
+                        ),
+                        html_body=(
+                            f'<p>Hello {escape(first_name or username)},</p>'
+                            f'<p>An account has been created for you.</p>'
+                            f'<ul><li><strong>Username:</strong> {escape(username)}</li>'
+                            f'<li><strong>Temporary password:</strong> <code>{escape(temp_password)}</code></li></ul>'
+                            f'<p>Please change your password on first login.</p>'
+                            f'<p>If you have any questions, contact IT Support.</p>'
+                        ),
+                        user=user,
                     )
 
-                    html_message = (
-                        f'<p>Hello {first_name or username},</p>'
-                        f'<p>An account has been created for you.</p>'
-                        f'<ul><li><strong>Username:</strong> {username}</li>'
-                        f'<li><strong>Temporary password:</strong> <code>{temp_password}</code></li></ul>'
-                        f'<p>Please change your password on first login.</p>'
-                        f'<p>If you have any questions, contact IT Support.</p>'
-                    )
-
-                    send_mail(
-                        subject=subject,
-                        message=plain_message,
-                        from_email=None,
-                        recipient_list=[email],
-                        html_message=html_message,
-                        fail_silently=True,
-                    )
-                except Exception:
-                    # Swallow email errors but log if desired
-                    pass
-
             log_access(
                 request.user,
                 'data_update',
@@ -466,46 +502,32 @@ def reactivate_staff(request, staff_id):
 # ==================== Admin Dashboard ====================
 
 @login_required
+@query_budget(9, max_repeated=2)
 @role_required('admin')
 def admin_dashboard(request):
     """Admin main dashboard"""
 
-    # Fetch fresh data + reduce DB hits
-    pending_appointments = (
-        PatientAppointment.objects
-        .filter(status='pending')
-        .select_related('assigned_doctor', 'assigned_admin')
-        .order_by('-id')
-    )
-
-    assigned_appointments = (
-        PatientAppointment.objects
-        .filter(status='assigned')
-        .select_related('assigned_doctor', 'assigned_admin')
-        .order_by('-id')
-    )
-
-    # Prefetch doctor profiles
-    doctors = (
-        User.objects
-        .filter(profile__role='doctor')
-        .select_related('profile')
+    date_from, date_to = queues.date_window(request.GET)
+
+    def compute_queues():
+        # First page of each queue; the tables fetch the rest from appointment_queue
+        counts = queues.status_counts(PatientAppointment.objects.filter(status__in=['pending', 'assigned']))
+        return {
+            'pending_count': counts.get('pending', 0),
+            'assigned_count': counts.get('assigned', 0),
+            'pending_page': queues.first_page('pending', request.user, date_from, date_to),
+            'assigned_page': queues.first_page('assigned', request.user, date_from, date_to),
+            'doctor_count': User.objects.filter(profile__role='doctor').count(),
+        }
+
+    context = cached_widget(
+        request, 'admin.queues', compute_queues, ('appointment', 'profile'),
+        params={'date_from': date_from, 'date_to': date_to},
     )
-
-    # Fast, index-friendly counts
-    pending_count = PatientAppointment.objects.filter(status='pending').count()
-    assigned_count = PatientAppointment.objects.filter(status='assigned').count()
+    context.update(date_from=date_from, date_to=date_to, bulk_form=BulkAppointmentActionForm())
 
     log_access(request.user, 'data_view', 'Accessed admin dashboard', request)
 
-    context = {
-        'pending_count': pending_count,
-        'assigned_count': assigned_count,
-        'pending_appointments': list(pending_appointments),  # FORCE EVALUATION HERE
-        'assigned_appointments': list(assigned_appointments),  # FORCE EVALUATION HERE
-        'doctors': doctors,
-    }
-
     return render(request, 'admin_dashboard.html', context)
 
 
@@ -545,42 +567,200 @@ def assign_appointment(request, appointment_id):
         except User.DoesNotExist:
             messages.error(request, 'Doctor not found.')
 
-    doctors = User.objects.filter(profile__role='doctor').select_related('profile')
-    return render(request, 'assign_appointment.html', {'appointment': appointment, 'doctors': doctors})
+    from django.db.models import Count
+
+    # Show each doctor's bookings on the requested date and the scheduler's pick
+    doctors, schedules = scheduling.load_doctors()
+    day_load = dict(
+        PatientAppointment.objects.filter(
+            assigned_doctor__in=doctors,
+            status__in=scheduling.BOOKED_STATUSES,
+            appointment_date=appointment.appointment_date,
+        ).values_list('assigned_doctor').annotate(n=Count('id'))
+    )
+    for doctor in doctors:
+        doctor.day_load = day_load.get(doctor.id, 0)
+    suggestion = scheduling.suggest(appointment, doctors, schedules) if appointment.status == 'pending' else None
+    return render(request, 'assign_appointment.html', {
+        'appointment': appointment, 'doctors': doctors, 'suggestion': suggestion,
+    })
+
+
+@login_required
+@role_required('admin')
+def auto_assign_appointments(request):
+    """Schedule every pending appointment into free doctor slots in one pass"""
+    doctors, _ = scheduling.load_doctors()
+    departments = sorted({d.profile.department for d in doctors if d.profile.department})
+    department = request.POST.get('department') or request.GET.get('department') or ''
+    try:
+        horizon = max(0, min(int(request.POST.get('horizon') or django_settings.SCHEDULER_HORIZON_DAYS), 90))
+    except ValueError:
+        horizon = django_settings.SCHEDULER_HORIZON_DAYS
+
+    result = None
+    if request.method == 'POST':
+        commit = request.POST.get('action') == 'assign'
+        result = scheduling.schedule(
+            department=department or None, horizon_days=horizon, admin=request.user, commit=commit,
+        )
+        if commit:
+            log_access(
+                request.user, 'data_update',
+                f'Auto-assigned {len(result.assignments)} appointments '
+                f'({len(result.conflicts)} left pending)',
+                request,
+            )
+            messages.success(
+                request,
+                f'Assigned {len(result.assignments)} appointment(s) in {result.elapsed:.1f}s; '
+                f'{len(result.conflicts)} could not be placed.',
+            )
+
+    return render(request, 'auto_assign_appointments.html', {
+        'departments': departments,
+        'department': department,
+        'horizon': horizon,
+        'pending_count': PatientAppointment.objects.filter(status='pending').count(),
+        'result': result,
+        'assignments': result.assignments[:200] if result else [],
+        'conflicts': result.conflicts[:200] if result else [],
+    })
+
+
+@login_required
+@require_http_methods(["GET"])
+def appointment_queue(request, queue):
+    """One keyset page of a dashboard appointment queue as JSON (see main/queues.py)"""
+    spec = queues.QUEUES.get(queue)
+    if spec is None:
+        return JsonResponse({'error': 'Unknown queue.'}, status=404)
+    if request.principal.role not in spec.roles:
+        return JsonResponse({'error': 'You do not have permission to view this queue.'}, status=403)
+
+    try:
+        cursor = int(request.GET['cursor']) if request.GET.get('cursor') else None
+        limit = min(max(int(request.GET.get('limit', queues.PAGE_SIZE)), 1), queues.MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'cursor and limit must be integers.'}, status=400)
+
+    date_from, date_to = queues.date_window(request.GET)
+    rows, next_cursor = queues.page(
+        queues.queue_queryset(queue, request.user, date_from, date_to), cursor, limit,
+    )
+    return JsonResponse({'results': [queues.serialize(row) for row in rows], 'next': next_cursor})
+
+
+@never_cache
+@login_required
+@require_http_methods(["GET"])
+def dashboard_events(request):
+    """Live dashboard updates as server-sent events (see main/changefeed.py)"""
+    role = request.principal.role
+    if role not in ('admin', 'doctor'):
+        return HttpResponse(status=403)
+    subscriber = changefeed.Subscriber(role, request.user.id)
+    try:
+        last_event_id = int(request.headers['Last-Event-ID'])
+    except (KeyError, ValueError):
+        last_event_id = None
+
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(
+            changefeed.stream(subscriber, last_event_id), content_type='text/event-stream',
+        )
+    else:
+        # A WSGI worker cannot be held per dashboard; answer and let the browser reconnect
+        response = HttpResponse(changefeed.replay(subscriber, last_event_id), content_type='text/event-stream')
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+@require_POST
+@role_required('admin', 'doctor')
+def bulk_appointment_action(request):
+    """Assign, confirm, complete or cancel the selected appointments in one go"""
+    role = request.principal.role
+    dashboard = 'admin_dashboard' if role == 'admin' else 'doctor_dashboard'
+    wants_json = 'application/json' in request.headers.get('Accept', '')
+
+    form = BulkAppointmentActionForm(request.POST)
+    if not form.is_valid():
+        errors = [error for field_errors in form.errors.values() for error in field_errors]
+        if wants_json:
+            return JsonResponse({'error': ' '.join(errors)}, status=400)
+        messages.error(request, ' '.join(errors))
+        return redirect(dashboard)
+
+    data = form.cleaned_data
+    try:
+        result = appointment_actions.apply(
+            data['action'], data['appointment_ids'], request.user, role,
+            doctor=data.get('doctor'), appointment_date=data.get('appointment_date'),
+            appointment_time=data.get('appointment_time'), request=request,
+        )
+    except appointment_actions.BulkActionError as exc:
+        if wants_json:
+            return JsonResponse({'error': str(exc)}, status=403)
+        messages.error(request, str(exc))
+        return redirect(dashboard)
+
+    if wants_json:
+        return JsonResponse({
+            'action': result.action,
+            'updated': result.updated,
+            'skipped': {str(k): v for k, v in result.skipped.items()},
+        })
+
+    verb = appointment_actions.ACTIONS[result.action].verb.lower()
+    if result.updated:
+        messages.success(request, f'{verb.capitalize()} {len(result.updated)} appointment(s).')
+    if result.skipped:
+        reasons = '; '.join(f'#{k}: {v}' for k, v in list(result.skipped.items())[:10])
+        more = f' and {len(result.skipped) - 10} more' if len(result.skipped) > 10 else ''
+        messages.warning(request, f'{len(result.skipped)} appointment(s) not {verb}: {reasons}{more}.')
+    return redirect(dashboard)
+
+
+@login_required
+@role_required('admin', 'doctor')
+def doctor_lookup(request):
+    """Paginated doctor search for remote select widgets"""
+    doctors = User.objects.filter(profile__role='doctor').order_by('username', 'id')
+    return lookup_response(request, doctors, ['username', 'first_name', 'last_name'])
 
 
 # ==================== Doctor Dashboard ====================
 
 @login_required
+@query_budget(7, max_repeated=2)
 @role_required('doctor')
 def doctor_dashboard(request):
     """Doctor main dashboard"""
 
-    # Fetch the doctor's appointments with optimized joins
-    my_appointments = (
-        PatientAppointment.objects
-        .filter(assigned_doctor=request.user)
-        .select_related('assigned_admin')  # Avoid N+1 queries
-        .order_by('-id')
+    date_from, date_to = queues.date_window(request.GET)
+
+    def compute_appointments():
+        # Counts in one grouped query; first page of each tab, the rest is fetched on demand
+        counts = queues.status_counts(PatientAppointment.objects.filter(assigned_doctor=request.user))
+        return {
+            'pending_count': counts.get('assigned', 0),
+            'confirmed_count': counts.get('confirmed', 0),
+            'total_count': sum(counts.values()),
+            'assigned_page': queues.first_page('my-assigned', request.user, date_from, date_to),
+            'confirmed_page': queues.first_page('my-confirmed', request.user, date_from, date_to),
+            'all_page': queues.first_page('my-all', request.user, date_from, date_to),
+        }
+
+    context = cached_widget(
+        request, 'doctor.appointments', compute_appointments, ('appointment',), scope='user',
+        params={'date_from': date_from, 'date_to': date_to},
     )
-
-    # Count queries remain lightweight and efficient
-    confirmed_count = PatientAppointment.objects.filter(
-        assigned_doctor=request.user, status='confirmed'
-    ).count()
-
-    pending_count = PatientAppointment.objects.filter(
-        assigned_doctor=request.user, status='assigned'
-    ).count()
+    context.update(date_from=date_from, date_to=date_to)
 
     log_access(request.user, 'data_view', 'Accessed doctor dashboard', request)
 
-    context = {
-        'appointments': list(my_appointments),  # FORCE QUERY EVALUATION
-        'confirmed_count': confirmed_count,
-        'pending_count': pending_count,
-    }
-
     return render(request, 'doctor_dashboard.html', context)
 
 
@@ -758,7 +938,21 @@ def change_password(request):
         form = CustomPasswordChangeForm(request.user, request.POST)
 
         if form.is_valid():
-            user = form.save()
+            with transaction.atomic():
+                user = form.save()
+                # Security notice, subject to the user's system update preference
+                outbox.enqueue(
+                    'system',
+                    user.email,
+                    'Your HPIS password was changed',
+                    (
+                        f'Hello {user.first_name or user.username},\n\n'
+                        f'The password of your account ({user.username}) was changed on '
+                        f'{timezone.localtime():%B %d, %Y at %I:%M %p}.\n\n'
+                        'If this was not you, contact IT Support immediately.'
+                    ),
+                    user=user,
+                )
 
             # 🌟 FIX: Keep the user logged in after password change 🌟
             update_session_auth_hash(request, user)
@@ -1078,8 +1272,9 @@ def cancel_account_deletion(request):
         return redirect('settings')
 
 @login_required
+@query_budget(13)
 @role_required('super_admin', 'admin', 'doctor')
-def analytics_dashboard(request):
+async def analytics_dashboard(request):
     """Analytics dashboard with KPIs and visualizations"""
     from django.db.models import Count, Q
     from datetime import datetime, timedelta
@@ -1094,112 +1289,123 @@ def analytics_dashboard(request):
     date_to = request.GET.get('date_to')
     department = request.GET.get('department')
 
-    # Build base queryset
-    appointments = PatientAppointment.objects.all()
+    async def compute_kpis():
+        # Build base queryset
+        appointments = PatientAppointment.objects.all()
+
+        # Apply filters if provided
+        if date_from:
+            appointments = appointments.filter(appointment_date__gte=date_from)
+        if date_to:
+            appointments = appointments.filter(appointment_date__lte=date_to)
+        if department:
+            appointments = appointments.filter(assigned_doctor__profile__department=department)
+
+        # Monthly trend windows (last 12 months)
+        months = []
+        for i in range(11, -1, -1):
+            month_date = today - timedelta(days=30 * i)
+            month_start = month_date.replace(day=1)
+            if i > 0:
+                next_month = (month_date.replace(day=28) + timedelta(days=4)).replace(day=1)
+                month_end = next_month - timedelta(days=1)
+            else:
+                month_end = today
+            months.append((month_start, month_end))
+
+        # The queries below are independent, so they run concurrently (main/concurrency.py)
+        results = await concurrency.gather(
+            # KPI Calculations
+            stats=lambda: appointments.aggregate(
+                total=Count('id'),
+                pending=Count('id', filter=Q(status='pending')),
+                confirmed=Count('id', filter=Q(status='confirmed')),
+                completed=Count('id', filter=Q(status='completed')),
+                assigned=Count('id', filter=Q(status='assigned')),
+            ),
+            waits=lambda: list(appointments.filter(status='confirmed').values_list('created_at', 'updated_at')),
+            # Count active patients (unique patients with appointments)
+            active_patients=appointments.values('email').distinct().count,
+            # All twelve months in one aggregate
+            monthly=lambda: PatientAppointment.objects.aggregate(**{
+                f'month_{n}': Count('id', filter=Q(appointment_date__gte=start, appointment_date__lte=end))
+                for n, (start, end) in enumerate(months)
+            }),
+            # Appointment types distribution
+            types=lambda: list(appointments.values('appointment_type').annotate(count=Count('id'))),
+            # Status distribution
+            statuses=lambda: list(appointments.values('status').annotate(count=Count('id'))),
+            # Department workload (top 5 departments)
+            departments=lambda: list(
+                User.objects.filter(profile__role='doctor')
+                .values('profile__department')
+                .annotate(count=Count('assigned_appointments'))
+                .order_by('-count')[:5]
+            ),
+            # Compare with last month
+            last_month_total=PatientAppointment.objects.filter(
+                appointment_date__gte=last_month,
+                appointment_date__lt=today - timedelta(days=30)
+            ).count,
+        )
 
-    # Apply filters if provided
-    if date_from:
-        appointments = appointments.filter(appointment_date__gte=date_from)
-    if date_to:
-        appointments = appointments.filter(appointment_date__lte=date_to)
-    if department:
-        appointments = appointments.filter(assigned_doctor__profile__department=department)
+        appointment_stats = results['stats']
+        total_appointments = appointment_stats['total']
+        pending_appointments = appointment_stats['pending']
+        confirmed_appointments = appointment_stats['confirmed']
+        completed_appointments = appointment_stats['completed']
 
-    # KPI Calculations
-    appointment_stats = appointments.aggregate(
-        total=Count('id'),
-        pending=Count('id', filter=Q(status='pending')),
-        confirmed=Count('id', filter=Q(status='confirmed')),
-        completed=Count('id', filter=Q(status='completed')),
-        assigned=Count('id', filter=Q(status='assigned')),
-    )
+        # Calculate patient satisfaction (based on completed appointments ratio)
+        satisfaction_rate = round((completed_appointments / total_appointments * 100), 1) if total_appointments > 0 else 0
 
-    total_appointments = appointment_stats['total']
-    pending_appointments = appointment_stats['pending']
-    confirmed_appointments = appointment_stats['confirmed']
-    completed_appointments = appointment_stats['completed']
+        # Calculate average wait time (simplified - days between creation and confirmation)
+        waits = results['waits']
+        if waits:
+            total_wait = sum((updated_at - created_at).days for created_at, updated_at in waits)
+            avg_wait_time = round(total_wait / len(waits), 1)
+        else:
+            avg_wait_time = 0
 
-    # Calculate patient satisfaction (based on completed appointments ratio)
-    satisfaction_rate = round((completed_appointments / total_appointments * 100), 1) if total_appointments > 0 else 0
+        active_patients = results['active_patients']
 
-    # Calculate average wait time (simplified - days between creation and confirmation)
-    confirmed_appts = appointments.filter(status='confirmed')
-    if confirmed_appts.exists():
-        total_wait = sum([(appt.updated_at - appt.created_at).days for appt in confirmed_appts])
-        avg_wait_time = round(total_wait / confirmed_appts.count(), 1)
-    else:
-        avg_wait_time = 0
-
-    # Count active patients (unique patients with appointments)
-    active_patients = appointments.values('email').distinct().count()
-
-    # Monthly trend data (last 12 months)
-    monthly_data = []
-    for i in range(11, -1, -1):
-        month_date = today - timedelta(days=30 * i)
-        month_start = month_date.replace(day=1)
-        if i > 0:
-            next_month = (month_date.replace(day=28) + timedelta(days=4)).replace(day=1)
-            month_end = next_month - timedelta(days=1)
-        else:
-            month_end = today
+        # Monthly trend data (last 12 months)
+        monthly_data = [
+            {'month': start.strftime('%b'), 'count': results['monthly'][f'month_{n}']}
+            for n, (start, end) in enumerate(months)
+        ]
 
-        count = PatientAppointment.objects.filter(
-            appointment_date__gte=month_start,
-            appointment_date__lte=month_end
-        ).count()
+        type_data = results['types']
 
-        monthly_data.append({
-            'month': month_start.strftime('%b'),
-            'count': count
-        })
+        # Format type data for Chart.js
+        type_labels = [dict(PatientAppointment.APPOINTMENT_TYPE_CHOICES).get(item['appointment_type'], item['appointment_type']) for item in type_data]
+        type_counts = [item['count'] for item in type_data]
 
-    # Appointment types distribution
-    type_data = list(appointments.values('appointment_type').annotate(
-        count=Count('id')
-    ))
-
-    # Format type data for Chart.js
-    type_labels = [dict(PatientAppointment.APPOINTMENT_TYPE_CHOICES).get(item['appointment_type'], item['appointment_type']) for item in type_data]
-    type_counts = [item['count'] for item in type_data]
-
-    # Status distribution
-    status_data = list(appointments.values('status').annotate(
-        count=Count('id')
-    ))
-
-    # Format status data for Chart.js
-    status_labels = [dict(PatientAppointment.STATUS_CHOICES).get(item['status'], item['status']) for item in status_data]
-    status_counts = [item['count'] for item in status_data]
-
-    # Department workload (top 5 departments)
-    department_data = User.objects.filter(
-        profile__role='doctor'
-    ).values(
-        'profile__department'
-    ).annotate(
-        count=Count('assigned_appointments')
-    ).order_by('-count')[:5]
-
-    # Format department data
-    dept_labels = [item['profile__department'] or 'Unassigned' for item in department_data]
-    dept_counts = [item['count'] for item in department_data]
-
-    # Calculate percentage changes (compare with last month)
-    last_month_total = PatientAppointment.objects.filter(
-        appointment_date__gte=last_month,
-        appointment_date__lt=today - timedelta(days=30)
-    ).count()
-
-    total_change = ((total_appointments - last_month_total) / last_month_total * 100) if last_month_total > 0 else 0
+        status_data = results['statuses']
 
-    # If this is an AJAX request, return JSON
-    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return JsonResponse({
-            'total_appointments': f"{total_appointments:,}",
-            'patient_satisfaction': f"{satisfaction_rate}%",
-            'avg_wait_time': f"{avg_wait_time} days",
-            'active_patients': f"{active_patients:,}",
+        # Format status data for Chart.js
+        status_labels = [dict(PatientAppointment.STATUS_CHOICES).get(item['status'], item['status']) for item in status_data]
+        status_counts = [item['count'] for item in status_data]
+
+        department_data = results['departments']
+
+        # Format department data
+        dept_labels = [item['profile__department'] or 'Unassigned' for item in department_data]
+        dept_counts = [item['count'] for item in department_data]
+
+        # Calculate percentage changes (compare with last month)
+        last_month_total = results['last_month_total']
+
+        total_change = ((total_appointments - last_month_total) / last_month_total * 100) if last_month_total > 0 else 0
+
+        return {
+            'total_appointments': total_appointments,
+            'pending_appointments': pending_appointments,
+            'confirmed_appointments': confirmed_appointments,
+            'completed_appointments': completed_appointments,
+            'satisfaction_rate': satisfaction_rate,
+            'avg_wait_time': avg_wait_time,
+            'active_patients': active_patients,
+            'total_change': total_change,
             'monthly_data': monthly_data,
             'type_labels': type_labels,
             'type_counts': type_counts,
@@ -1207,32 +1413,57 @@ def analytics_dashboard(request):
             'status_counts': status_counts,
             'dept_labels': dept_labels,
             'dept_counts': dept_counts,
+        }
+
+    kpis = await acached_widget(
+        request, 'analytics.kpis', compute_kpis, ('appointment', 'profile'),
+        params={'date_from': date_from, 'date_to': date_to, 'department': department, 'today': today},
+    )
+    total_appointments = kpis['total_appointments']
+    satisfaction_rate = kpis['satisfaction_rate']
+    avg_wait_time = kpis['avg_wait_time']
+    active_patients = kpis['active_patients']
+
+    # If this is an AJAX request, return JSON
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({
+            'total_appointments': f"{total_appointments:,}",
+            'patient_satisfaction': f"{satisfaction_rate}%",
+            'avg_wait_time': f"{avg_wait_time} days",
+            'active_patients': f"{active_patients:,}",
+            'monthly_data': kpis['monthly_data'],
+            'type_labels': kpis['type_labels'],
+            'type_counts': kpis['type_counts'],
+            'status_labels': kpis['status_labels'],
+            'status_counts': kpis['status_counts'],
+            'dept_labels': kpis['dept_labels'],
+            'dept_counts': kpis['dept_counts'],
         })
 
     context = {
         'total_appointments': total_appointments,
-        'pending_appointments': pending_appointments,
-        'confirmed_appointments': confirmed_appointments,
-        'completed_appointments': completed_appointments,
+        'pending_appointments': kpis['pending_appointments'],
+        'confirmed_appointments': kpis['confirmed_appointments'],
+        'completed_appointments': kpis['completed_appointments'],
         'satisfaction_rate': satisfaction_rate,
         'avg_wait_time': avg_wait_time,
         'active_patients': active_patients,
-        'total_change': round(total_change, 1),
-        'monthly_data': json.dumps(monthly_data),
-        'type_labels': json.dumps(type_labels),
-        'type_counts': json.dumps(type_counts),
-        'status_labels': json.dumps(status_labels),
-        'status_counts': json.dumps(status_counts),
-        'dept_labels': json.dumps(dept_labels),
-        'dept_counts': json.dumps(dept_counts),
+        'total_change': round(kpis['total_change'], 1),
+        'monthly_data': json.dumps(kpis['monthly_data']),
+        'type_labels': json.dumps(kpis['type_labels']),
+        'type_counts': json.dumps(kpis['type_counts']),
+        'status_labels': json.dumps(kpis['status_labels']),
+        'status_counts': json.dumps(kpis['status_counts']),
+        'dept_labels': json.dumps(kpis['dept_labels']),
+        'dept_counts': json.dumps(kpis['dept_counts']),
         'date_from': date_from or '',
         'date_to': date_to or '',
         'selected_department': department or '',
     }
 
-    log_access(request.user, 'data_view', 'Accessed analytics dashboard', request)
+    await concurrency.run(log_access, request.user, 'data_view', 'Accessed analytics dashboard', request)
 
-    return render(request, 'analytics_dashboard.html', context)
+    return await concurrency.run(render, request, 'analytics_dashboard.html', context)
 
 @login_required
 def generate_report(request):
@@ -1512,4 +1743,30 @@ def export_to_pdf(data):
         elements.append(table)
 
     doc.build(elements)
-    return output.getvalue()
\ No newline at end of file
+    return output.getvalue()
+
+# ==================== Metrics ====================
+
+@never_cache
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """
+    Prometheus metrics. Scrapers authenticate with `Authorization: Bearer
+    <METRICS_TOKEN>`; signed-in super admins and admins may also view them.
+    Missing or wrong credentials get 401, signed-in users of other roles 403.
+    """
+    token = getattr(django_settings, 'METRICS_TOKEN', '')
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    authorized = bool(token) and header.startswith('Bearer ') and hmac.compare_digest(
+        header[len('Bearer '):].encode(), token.encode()
+    )
+    if not authorized and request.user.is_authenticated and not header:
+        profile = getattr(request.user, 'profile', None)
+        if not (request.user.is_superuser or (profile and profile.role in ('super_admin', 'admin'))):
+            return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+        authorized = True
+    if not authorized:
+        response = HttpResponse('Unauthorized\n', status=401, content_type='text/plain')
+        response['WWW-Authenticate'] = 'Bearer realm="metrics"'
+        return response
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,46 @@
+from django import forms
+from django.core.exceptions import ValidationError
+from django.urls import reverse
+
+
+class RemoteSelect(forms.Select):
+    """
+    <select> for a ModelChoiceField that only renders the selected option.
+
+    The rest of the choices are fetched page by page from a lookup endpoint
+    (see main.lookups) by static/js/remote_select.js, so page size does not
+    grow with the size of the related table. Validation is unchanged: the
+    field still checks the submitted id against its queryset.
+    """
+
+    class Media:
+        js = ('js/remote_select.js',)
+
+    def __init__(self, url_name, attrs=None, placeholder='Type to search...'):
+        super().__init__(attrs)
+        self.url_name = url_name
+        self.placeholder = placeholder
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs.setdefault('data-lookup-url', reverse(self.url_name))
+        attrs.setdefault('data-placeholder', self.placeholder)
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        selected = {str(v) for v in value if v not in (None, '')}
+        options = [self.create_option(name, '', '---------', not selected, 0)]
+
+        queryset = getattr(self.choices, 'queryset', None)
+        if selected and queryset is not None:
+            field = self.choices.field
+            try:
+                objects = list(queryset.filter(pk__in=selected))
+            except (ValueError, TypeError, ValidationError):
+                # Garbage submitted; the field's own validation reports it
+                objects = []
+            for index, obj in enumerate(objects, start=1):
+                options.append(self.create_option(
+                    name, field.prepare_value(obj), field.label_from_instance(obj), True, index
+                ))
+        return [(None, options, 0)]
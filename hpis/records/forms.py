@@ -4,6 +4,7 @@ from django import forms
 from django.contrib.auth.models import User
 from .models import PatientRecord, VisitLog
 from main.models import UserProfile
+from main.widgets import RemoteSelect
 
 DEPARTMENT_CHOICES = [
     ('general_medicine', 'General Medicine'),
@@ -43,7 +44,8 @@ class PatientRecordForm(forms.ModelForm):
             'gender': forms.Select(attrs={'class': 'form-control'}, choices=PatientRecord.GENDER_CHOICES),
             'department': forms.Select(attrs={'class': 'form-control'}, choices=DEPARTMENT_CHOICES),
             'photo': forms.ClearableFileInput(attrs={'class': 'form-control'}),
-            'attending_physician': forms.Select(attrs={'class': 'form-control'}),
+            'attending_physician': RemoteSelect('doctor_lookup', attrs={'class': 'form-control'},
+                                                placeholder='Search doctor...'),
         }
 
     def clean(self):
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+PREFIX_COLUMNS = ('full_name', 'patient_code')
+
+
+def create_prefix_indexes(apps, schema_editor):
+    from main.lookups import install_prefix_indexes
+    install_prefix_indexes(schema_editor.connection, 'records_patientrecord', PREFIX_COLUMNS)
+
+
+def remove_prefix_indexes(apps, schema_editor):
+    from main.lookups import drop_prefix_indexes
+    drop_prefix_indexes(schema_editor.connection, 'records_patientrecord', PREFIX_COLUMNS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0007_alter_patientrecord_patient_code'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_indexes, remove_prefix_indexes),
+    ]
@@ -1,3 +1,67 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from .models import PatientRecord
+
+
+class PatientLookupTests(TestCase):
+    def setUp(self):
+        PatientRecord.objects.create(full_name='Ana Reyes', gender='F', department='General')
+        PatientRecord.objects.create(full_name='Ben Cruz', gender='M', department='General')
+
+    def login(self, role):
+        user = User.objects.create_user(f'{role}_user', password='secret-pass-1')
+        user.profile.role = role
+        user.profile.save()
+        self.client.force_login(user)
+
+    def test_doctors_search_by_name_prefix(self):
+        self.login('doctor')
+
+        response = self.client.get(reverse('patient_lookup'), {'q': 'an'})
+
+        self.assertEqual(response.status_code, 200)
+        ana = PatientRecord.objects.get(full_name='Ana Reyes')
+        self.assertEqual(response.json()['results'], [{'id': ana.pk, 'text': str(ana)}])
+
+    def test_every_role_with_a_patient_picker_can_search(self):
+        # Dispensing and the audit log filter render the picker for any signed-in user
+        for role in ('admin', 'super_admin'):
+            self.login(role)
+
+            response = self.client.get(reverse('patient_lookup'), {'q': 'be'})
+
+            ben = PatientRecord.objects.get(full_name='Ben Cruz')
+            self.assertEqual([row['id'] for row in response.json()['results']], [ben.pk], role)
+
+    def test_anonymous_users_are_sent_to_log_in(self):
+        response = self.client.get(reverse('patient_lookup'), {'q': 'an'})
+
+        self.assertEqual(response.status_code, 302)
+
+
+class DoctorLookupTests(TestCase):
+    def setUp(self):
+        self.doctor = User.objects.create_user('dr_cruz', first_name='Jose', last_name='Cruz')
+
+    def login(self, role):
+        user = User.objects.create_user(f'{role}_user')
+        user.profile.role = role
+        user.profile.save()
+        self.client.force_login(user)
+
+    def test_admins_and_doctors_search_doctors(self):
+        for role in ('admin', 'doctor'):
+            self.login(role)
+
+            response = self.client.get(reverse('doctor_lookup'), {'q': 'dr_'})
+
+            self.assertEqual([row['id'] for row in response.json()['results']], [self.doctor.pk], role)
+
+    def test_super_admins_are_refused(self):
+        self.login('super_admin')
+
+        response = self.client.get(reverse('doctor_lookup'), {'q': 'dr_'})
+
+        self.assertRedirects(response, reverse('homepage'), fetch_redirect_response=False)
@@ -6,6 +6,7 @@ urlpatterns = [
     path('<int:pk>/', views.patient_record_detail, name='patient_record_detail'),
     path('<int:pk>/edit/', views.update_patient_record, name='update_patient_record'),
     path('', views.records_list, name='records_list'),
+    path('lookup/', views.patient_lookup, name='patient_lookup'),
     path('<int:pk>/log/', views.add_visit_log, name='add_visit_log'),
     path('<int:pk>/pdf/', views.download_patient_pdf, name='download_patient_pdf'),
 ]
\ No newline at end of file
@@ -7,6 +7,8 @@ from .forms import PatientRecordForm, VisitLogForm
 from .models import PatientRecord
 from django.core.paginator import Paginator
 from django.db.models import Q   # ✅ needed for search queries
+from main.instrumentation import query_budget
+from main.lookups import lookup_response
 
 
 from django.http import HttpResponse
@@ -54,6 +56,15 @@ def download_patient_pdf(request, pk):
 
 
 
+# Every role reaches a patient picker: records (doctors, admins), dispensing
+# and the audit log filter (any signed-in user)
+@login_required
+def patient_lookup(request):
+    """Paginated patient search (name or patient code prefix) for remote select widgets"""
+    patients = PatientRecord.objects.order_by('full_name', 'id')
+    return lookup_response(request, patients, ['full_name', 'patient_code'])
+
+
 @never_cache
 @login_required
 @user_passes_test(is_doctor_or_admin)
@@ -141,6 +152,7 @@ def add_visit_log(request, pk):
 
 
 @login_required
+@query_budget(5, max_repeated=2)
 @user_passes_test(is_doctor_or_admin)
 def records_list(request):
     queryset = PatientRecord.objects.all().select_related('attending_physician').order_by('-created_at')
@@ -0,0 +1,133 @@
+// Lazy pages for the dashboard appointment tables (main/queues.py).
+// A <table data-queue-url="..." data-next="<cursor>" data-columns="..."> holds the
+// first page rendered by the server; its "Load more" button
+// (<button data-queue-more="<table id>">) appends the next page from the JSON
+// endpoint, keeping the dashboard's date filter. A "select" column holds the
+// checkboxes of the bulk action form around the table; the header checkbox
+// (<input data-select-all>) ticks every row loaded so far.
+(function () {
+  const MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'];
+  const BADGES = { pending: 'badge-pending', assigned: 'badge-assigned', confirmed: 'badge-confirmed' };
+
+  function formatDate(iso) {
+    if (!iso) return '—';
+    const [year, month, day] = iso.split('-');
+    return MONTHS[Number(month) - 1] + ' ' + day + ', ' + year;
+  }
+
+  function formatTime(value) {
+    if (!value) return '—';
+    let [hours, minutes] = value.split(':').map(Number);
+    const suffix = hours < 12 ? 'AM' : 'PM';
+    hours = hours % 12 || 12;
+    return String(hours).padStart(2, '0') + ':' + String(minutes).padStart(2, '0') + ' ' + suffix;
+  }
+
+  function el(tag, className, text) {
+    const node = document.createElement(tag);
+    if (className) node.className = className;
+    if (text !== undefined) node.textContent = text;
+    return node;
+  }
+
+  function patientInfo(lines) {
+    const div = el('div', 'patient-info');
+    lines.forEach(function ([tag, text]) { div.appendChild(el(tag, '', text)); });
+    return div;
+  }
+
+  function link(href, text) {
+    const a = el('a', 'action-btn', text);
+    a.href = href;
+    return a;
+  }
+
+  const CELLS = {
+    select: function (row) {
+      const box = el('input');
+      box.type = 'checkbox';
+      box.name = 'appointment_ids';
+      box.value = row.id;
+      return box;
+    },
+    patient: function (row) {
+      return patientInfo([['h4', row.first_name + ' ' + row.last_name], ['p', 'DOB: ' + formatDate(row.date_of_birth)]]);
+    },
+    name: function (row) { return patientInfo([['h4', row.first_name + ' ' + row.last_name]]); },
+    contact: function (row) { return patientInfo([['p', row.email], ['p', row.contact_number]]); },
+    doctor: function (row) { return row.doctor || '—'; },
+    type: function (row) { return row.appointment_type_display; },
+    date: function (row) { return formatDate(row.appointment_date); },
+    time: function (row) { return formatTime(row.appointment_time); },
+    status: function (row, table) {
+      const badge = table.dataset['badge' + row.status.charAt(0).toUpperCase() + row.status.slice(1)] || BADGES[row.status] || '';
+      return el('span', 'badge ' + badge, row.status_display);
+    },
+    assign: function (row) { return row.assign_url ? link(row.assign_url, 'Assign to Doctor') : ''; },
+    confirm: function (row) { return row.confirm_url ? link(row.confirm_url, 'Confirm') : ''; },
+  };
+
+  function renderRow(table, row) {
+    const tr = document.createElement('tr');
+    table.dataset.columns.split(',').forEach(function (column) {
+      const td = document.createElement('td');
+      const content = CELLS[column](row, table);
+      if (content instanceof Node) td.appendChild(content);
+      else td.textContent = content;
+      tr.appendChild(td);
+    });
+    return tr;
+  }
+
+  function initQueue(button) {
+    const table = document.getElementById(button.dataset.queueMore);
+    if (!table) return;
+    const label = button.textContent;
+
+    button.addEventListener('click', function () {
+      if (!table.dataset.next || button.disabled) return;
+      const params = new URLSearchParams(window.location.search);
+      const query = new URLSearchParams({ cursor: table.dataset.next });
+      ['date_from', 'date_to'].forEach(function (name) {
+        if (params.get(name)) query.set(name, params.get(name));
+      });
+
+      button.disabled = true;
+      button.textContent = 'Loading…';
+      fetch(table.dataset.queueUrl + '?' + query.toString(), { headers: { 'Accept': 'application/json' } })
+        .then(function (response) {
+          if (!response.ok) throw new Error(response.status);
+          return response.json();
+        })
+        .then(function (data) {
+          const body = table.tBodies[0];
+          data.results.forEach(function (row) { body.appendChild(renderRow(table, row)); });
+          table.dataset.next = data.next || '';
+          button.hidden = !data.next;
+        })
+        .catch(function () {
+          button.textContent = 'Could not load more; try again';
+          button.disabled = false;
+          return Promise.reject();
+        })
+        .then(function () {
+          button.textContent = label;
+          button.disabled = false;
+        }, function () {});
+    });
+  }
+
+  function initSelectAll(box) {
+    const table = box.closest('table');
+    box.addEventListener('change', function () {
+      table.querySelectorAll('input[name="appointment_ids"]').forEach(function (row) {
+        row.checked = box.checked;
+      });
+    });
+  }
+
+  document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('[data-queue-more]').forEach(initQueue);
+    document.querySelectorAll('[data-select-all]').forEach(initSelectAll);
+  });
+})();
@@ -0,0 +1,62 @@
+// Live dashboard updates over server-sent events (main/changefeed.py).
+// The element with data-events-url opens the stream and doubles as the
+// banner announcing changes the tables do not show yet; elements with
+// data-counter="<name>" are kept in step with `counters` events.
+(function () {
+  function plural(count, word) {
+    return count + ' ' + word + (count === 1 ? '' : 's');
+  }
+
+  document.addEventListener('DOMContentLoaded', function () {
+    const banner = document.querySelector('[data-events-url]');
+    if (!banner || !window.EventSource) return;
+    const text = banner.querySelector('[data-live-text]');
+    const source = new EventSource(banner.dataset.eventsUrl);
+    const seen = { requests: 0, assigned: 0, updated: 0 };
+    const lowStock = new Map();
+    let stale = false;
+
+    function show() {
+      const notes = [];
+      if (seen.requests) notes.push(plural(seen.requests, 'new appointment request'));
+      if (seen.assigned) notes.push(plural(seen.assigned, 'appointment') + ' assigned');
+      if (seen.updated) notes.push(plural(seen.updated, 'appointment') + ' updated');
+      lowStock.forEach(function (item) {
+        notes.push('Low stock: ' + item.name + ' (' + item.quantity + ' left)');
+      });
+      if (stale) notes.push('Some updates were missed');
+      text.textContent = notes.join(' · ');
+      banner.hidden = notes.length === 0;
+    }
+
+    function count(status, number, created) {
+      if (created || status === 'pending') seen.requests += number;
+      else if (status === 'assigned') seen.assigned += number;
+      else seen.updated += number;
+      show();
+    }
+
+    function on(name, handler) {
+      source.addEventListener(name, function (event) { handler(JSON.parse(event.data)); });
+    }
+
+    on('appointment', function (data) { count(data.status, 1, data.created); });
+    on('appointments', function (data) { count(data.status, data.count, false); });
+    on('stock', function (data) {
+      lowStock.set(data.id, data);
+      show();
+    });
+    on('counters', function (data) {
+      Object.keys(data).forEach(function (name) {
+        document.querySelectorAll('[data-counter="' + name + '"]').forEach(function (node) {
+          node.textContent = data[name];
+        });
+      });
+    });
+    on('reload', function () {
+      source.close();
+      stale = true;
+      show();
+    });
+  });
+})();
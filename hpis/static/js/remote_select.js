@@ -0,0 +1,112 @@
+// Remote lookup for <select data-lookup-url="..."> rendered by main.widgets.RemoteSelect.
+// The select stays in the form (hidden) and keeps submitting the chosen id;
+// a text box fetches matching options page by page as the user types.
+(function () {
+  const DEBOUNCE_MS = 250;
+
+  function initRemoteSelect(select) {
+    const url = select.dataset.lookupUrl;
+    const wrapper = document.createElement('div');
+    const input = document.createElement('input');
+    const list = document.createElement('ul');
+    let timer = null;
+    let query = '';
+    let page = 1;
+    let more = false;
+    let loading = false;
+
+    wrapper.style.position = 'relative';
+    input.type = 'text';
+    input.className = select.className;
+    input.placeholder = select.dataset.placeholder || '';
+    input.autocomplete = 'off';
+    const current = select.options[select.selectedIndex];
+    input.value = current && current.value ? current.text : '';
+
+    list.style.cssText = 'position:absolute;left:0;right:0;top:100%;z-index:20;margin:0;padding:0;' +
+      'list-style:none;background:#fff;border:1px solid #ddd;border-radius:4px;' +
+      'max-height:260px;overflow-y:auto;display:none;';
+
+    select.style.display = 'none';
+    select.parentNode.insertBefore(wrapper, select);
+    wrapper.appendChild(input);
+    wrapper.appendChild(list);
+    wrapper.appendChild(select);
+
+    function choose(item) {
+      select.innerHTML = '';
+      const option = new Option(item.text, item.id, true, true);
+      select.appendChild(option);
+      input.value = item.text;
+      list.style.display = 'none';
+      select.dispatchEvent(new Event('change', { bubbles: true }));
+    }
+
+    function render(results, append) {
+      if (!append) list.innerHTML = '';
+      results.forEach(function (item) {
+        const li = document.createElement('li');
+        li.textContent = item.text;
+        li.style.cssText = 'padding:8px 10px;cursor:pointer;font-size:14px;';
+        li.addEventListener('mouseenter', function () { li.style.background = '#f4f6f9'; });
+        li.addEventListener('mouseleave', function () { li.style.background = ''; });
+        li.addEventListener('mousedown', function (event) { event.preventDefault(); choose(item); });
+        list.appendChild(li);
+      });
+      list.style.display = list.children.length ? 'block' : 'none';
+    }
+
+    function fetchPage(append) {
+      const requested = query;
+      loading = true;
+      fetch(url + '?q=' + encodeURIComponent(requested) + '&page=' + page, {
+        headers: { 'X-Requested-With': 'XMLHttpRequest' }
+      })
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          if (requested !== query) return;  // a newer query is in flight
+          more = data.pagination && data.pagination.more;
+          render(data.results, append);
+        })
+        .finally(function () { loading = false; });
+    }
+
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      if (!input.value.trim()) {
+        select.innerHTML = '<option value="" selected></option>';
+      }
+      timer = setTimeout(function () {
+        query = input.value.trim();
+        page = 1;
+        fetchPage(false);
+      }, DEBOUNCE_MS);
+    });
+
+    input.addEventListener('focus', function () {
+      if (!list.children.length) {
+        query = input.value.trim() === (current && current.text) ? '' : input.value.trim();
+        page = 1;
+        fetchPage(false);
+      } else {
+        list.style.display = 'block';
+      }
+    });
+
+    input.addEventListener('blur', function () { list.style.display = 'none'; });
+
+    list.addEventListener('scroll', function () {
+      if (more && !loading && list.scrollTop + list.clientHeight >= list.scrollHeight - 20) {
+        page += 1;
+        fetchPage(true);
+      }
+    });
+  }
+
+  // For selects added after page load (e.g. new formset rows)
+  window.initRemoteSelect = initRemoteSelect;
+
+  document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('select[data-lookup-url]').forEach(initRemoteSelect);
+  });
+})();